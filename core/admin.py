@@ -6,6 +6,8 @@ from .models import Story
 from .models import Like 
 from .models import Comment
 from .models import Follower
+from .models import GeocodeCacheEntry
+from .models import GeocodeJob
 
 # Register your models here.
 admin.site.register(Profile)
@@ -14,4 +16,6 @@ admin.site.register(Location)
 admin.site.register(Story)
 admin.site.register(Like)
 admin.site.register(Comment)
-admin.site.register(Follower)
\ No newline at end of file
+admin.site.register(Follower)
+admin.site.register(GeocodeCacheEntry)
+admin.site.register(GeocodeJob)
\ No newline at end of file
@@ -0,0 +1,249 @@
+import heapq
+import logging
+import threading
+import time
+import uuid
+from bisect import bisect_left, insort
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import Count
+
+logger = logging.getLogger(__name__)
+
+# How many suggestions the endpoint returns by default
+DEFAULT_LIMIT = getattr(settings, 'AUTOCOMPLETE_LIMIT', 10)
+
+# Every process keeps its own index, rebuilding it this often picks up the
+# changes made by the other processes
+REBUILD_INTERVAL = getattr(settings, 'AUTOCOMPLETE_REBUILD_INTERVAL', 600)
+
+# Requests are answered from the index as it is, a thread in every process
+# looks this often whether it is stale and builds a new one to swap in
+CHECK_INTERVAL = getattr(settings, 'AUTOCOMPLETE_CHECK_INTERVAL', 30)
+
+# Top suggestions of prefixes up to this long are memoized, their ranges
+# are the largest ones to rank
+MEMO_PREFIX_LENGTH = 2
+
+# Shared cache holding the version every process's index is built at,
+# moved on by bulk changes made without signals
+CACHE = getattr(settings, 'AUTOCOMPLETE_CACHE', 'default')
+VERSION_KEY = 'autocomplete-version'
+
+
+def normalize(name):
+    return ' '.join(name.split()).casefold()
+
+
+class PrefixIndex:
+    """
+    Names kept in a sorted array of normalized keys, a prefix is the range
+    found by two binary searches and is ranked by usage count.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.keys = []
+        self.names = {}
+        self.counts = {}
+        self.memo = {}
+
+    def build(self, items):
+        names, counts = {}, {}
+        for name, count in items:
+            key = normalize(name)
+            if not key:
+                continue
+            names.setdefault(key, name)
+            counts[key] = counts.get(key, 0) + count
+        with self.lock:
+            self.keys = sorted(names)
+            self.names = names
+            self.counts = counts
+            self.memo = {}
+
+    def add(self, name, delta=0):
+        key = normalize(name)
+        if not key:
+            return
+        with self.lock:
+            if key not in self.counts:
+                insort(self.keys, key)
+                self.names[key] = name
+                self.counts[key] = 0
+            self.counts[key] = max(self.counts[key] + delta, 0)
+            self.memo.clear()
+
+    def rename(self, old_name, new_name):
+        # The old name's count moves to the new one and the old name goes
+        old_key = normalize(old_name)
+        if old_key == normalize(new_name):
+            return
+        self.add(new_name, self.counts.get(old_key, 0))
+        self.remove(old_name)
+
+    def remove(self, name):
+        key = normalize(name)
+        with self.lock:
+            if key not in self.counts:
+                return
+            del self.keys[bisect_left(self.keys, key)]
+            del self.names[key]
+            del self.counts[key]
+            self.memo.clear()
+
+    def search(self, prefix, limit=DEFAULT_LIMIT):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        with self.lock:
+            memo_key = (prefix, limit)
+            if memo_key in self.memo:
+                return self.memo[memo_key]
+
+            start = bisect_left(self.keys, prefix)
+            end = bisect_left(self.keys, prefix + '\U0010ffff', start)
+            # Most used first, then the shortest completion
+            best = heapq.nsmallest(
+                limit, self.keys[start:end],
+                key=lambda key: (-self.counts[key], len(key), key))
+            results = [(self.names[key], self.counts[key]) for key in best]
+            if len(prefix) <= MEMO_PREFIX_LENGTH:
+                self.memo[memo_key] = results
+            return results
+
+
+indexes = {
+    'tags': PrefixIndex(),
+    'users': PrefixIndex(),
+    'places': PrefixIndex(),
+}
+
+# Guards swapping in new indexes and the changes signalled while they load
+changes_lock = threading.Lock()
+pending = None
+start_lock = threading.Lock()
+refresher = None
+built_at = None
+built_version = None
+
+
+def current_version():
+    return caches[CACHE].get(VERSION_KEY)
+
+
+def invalidate():
+    """Have every process rebuild its index at its next check"""
+    caches[CACHE].set(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def build():
+    """
+    Load every tag, username and place name with its usage count into new
+    indexes, and swap them in for the ones requests read.
+    """
+    global indexes, pending, built_at, built_version
+    from .models import Location, Profile, Tag
+
+    version = current_version()
+    with changes_lock:
+        pending = []
+    try:
+        fresh = {kind: PrefixIndex() for kind in indexes}
+        fresh['tags'].build(
+            Tag.objects.values_list('name').annotate(uses=Count('story')))
+        fresh['users'].build(
+            Profile.objects.values_list('username').annotate(
+                followers=Count('user__following')))
+        fresh['places'].build(
+            Location.objects.values_list('name').annotate(uses=Count('story')))
+        with changes_lock:
+            # Changes signalled while loading may be missing from the rows
+            # read, a count they are already in is off until the next build
+            for kind, method, args in pending:
+                getattr(fresh[kind], method)(*args)
+            indexes = fresh
+            built_at = time.monotonic()
+            built_version = version
+    finally:
+        with changes_lock:
+            pending = None
+
+
+def is_built():
+    # Loading counts too, its changes are replayed on the new index
+    return built_at is not None or pending is not None
+
+
+def is_stale():
+    return (built_at is None or time.monotonic() - built_at >= REBUILD_INTERVAL
+            or current_version() != built_version)
+
+
+def refresh():
+    """Build new indexes if these are stale, keep serving them if that fails"""
+    try:
+        if is_stale():
+            build()
+    except Exception:
+        logger.exception('Could not rebuild the autocomplete index')
+    finally:
+        if threading.current_thread() is not threading.main_thread():
+            connection.close()
+
+
+def refresh_forever():
+    while True:
+        refresh()
+        time.sleep(CHECK_INTERVAL)
+
+
+def start_refresh():
+    global refresher
+    if refresher is not None:
+        return
+    with start_lock:
+        if refresher is None:
+            refresher = threading.Thread(
+                target=refresh_forever, name='autocomplete-refresh', daemon=True)
+            refresher.start()
+
+
+def autocomplete(query, kinds=None, limit=DEFAULT_LIMIT):
+    """
+    The ``limit`` most used tags, usernames and place names starting with
+    ``query``, as dicts with their type, name and usage count. Nothing is
+    suggested until the first index is built.
+    """
+    start_refresh()
+    current = indexes
+    results = []
+    for kind in kinds or current:
+        for name, count in current[kind].search(query, limit):
+            results.append({'type': kind, 'name': name, 'count': count})
+    results.sort(key=lambda result: -result['count'])
+    return results[:limit]
+
+
+def change(kind, method, *args):
+    with changes_lock:
+        getattr(indexes[kind], method)(*args)
+        if pending is not None:
+            pending.append((kind, method, args))
+
+
+def update(kind, name, delta=0):
+    # Signal handlers skip the work until the index is built
+    if is_built():
+        change(kind, 'add', name, delta)
+
+
+def rename(kind, old_name, new_name):
+    if is_built():
+        change(kind, 'rename', old_name, new_name)
+
+
+def remove(kind, name):
+    if is_built():
+        change(kind, 'remove', name)
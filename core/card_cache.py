@@ -0,0 +1,58 @@
+import hashlib
+import json
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+# Cache holding the rendered card bodies, keyed on a stamp of the story row
+# so it does not have to be shared by the processes changing stories
+CACHE = getattr(settings, 'STORY_CARD_CACHE', 'default')
+
+# Seconds a rendered body is kept
+CACHE_TTL = getattr(settings, 'STORY_CARD_CACHE_TTL', 24 * 60 * 60)
+
+# The part of a story card that is the same for every viewer: title, date,
+# tags, locations, content and files. The header, like state, counters and
+# comment form are rendered around it on every request
+TEMPLATE = 'partials/story_card_body.html'
+
+
+def stamp(story):
+    # Digest of every story column the body shows, a change in any of them
+    # made by any process gives the body a new key
+    shown = [story.title, story.date_format, story.date_exact, story.date_range_start,
+             story.date_range_end, story.decade, story.exact_date_and_time, story.summary]
+    return hashlib.md5(json.dumps(shown, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def body_key(story_id, card_stamp):
+    return f'story-card:{story_id}:{card_stamp}'
+
+
+def get_bodies(stories):
+    """
+    Attach the cached body of every story whose current stamp has one as
+    ``card_body`` in one cache round trip.
+    """
+    for story in stories:
+        story.card_stamp = stamp(story)
+    bodies = caches[CACHE].get_many([body_key(story.id, story.card_stamp) for story in stories])
+    for story in stories:
+        body = bodies.get(body_key(story.id, story.card_stamp))
+        if body is not None:
+            story.card_body = mark_safe(body)
+
+
+def render_bodies(cards):
+    """Render the bodies ``get_bodies`` did not find, and cache them"""
+    rendered = {}
+    for card in cards:
+        story = card.story
+        if hasattr(story, 'card_body'):
+            continue
+        body = render_to_string(TEMPLATE, {'card': card, 'story': story, 'profile': card.profile})
+        story.card_body = mark_safe(body)
+        rendered[body_key(story.id, story.card_stamp)] = body
+    if rendered:
+        caches[CACHE].set_many(rendered, timeout=CACHE_TTL)
@@ -0,0 +1,107 @@
+from typing import NamedTuple
+from .models import Like, Profile, Story
+from .counters import apply_pending
+from .summaries import DEFAULT_AVATAR_URL
+from . import card_cache
+
+
+class StoryCard(NamedTuple):
+    """
+    Everything a feed template needs to render one story.
+
+    Unpacks like the old ``(story, profile)`` tuples, the author's name and
+    avatar, tags, locations and files are read from the story's summary
+    document.
+    """
+    story: Story
+    profile: Profile
+
+    @property
+    def summary(self):
+        return self.story.summary or {}
+
+    @property
+    def username(self):
+        return self.summary.get('username', '')
+
+    @property
+    def avatar_url(self):
+        return self.summary.get('avatar_url', DEFAULT_AVATAR_URL)
+
+    @property
+    def tags(self):
+        # Tag names
+        return self.summary.get('tags', [])
+
+    @property
+    def locations(self):
+        # Location names
+        return self.summary.get('locations', [])
+
+    @property
+    def first_location(self):
+        return self.summary.get('first_location')
+
+    @property
+    def location_count(self):
+        return self.summary.get('location_count', 0)
+
+    @property
+    def files(self):
+        # {'url', 'thumbnail'} of each file, thumbnail is None for non-images
+        return self.summary.get('files', [])
+
+    @property
+    def excerpt(self):
+        return self.summary.get('excerpt', '')
+
+    @property
+    def body(self):
+        # The cached viewer independent part of the card, see core.card_cache
+        return getattr(self.story, 'card_body', '')
+
+    @property
+    def liked(self):
+        # Whether the viewer the cards were loaded for likes this story
+        return getattr(self.story, 'liked_by_viewer', False)
+
+
+def get_author_profile(story):
+    # Only the ids the cards link and compare with, from the summary
+    profile_id = (story.summary or {}).get('profile_id')
+    if profile_id is None:
+        return None
+    return Profile(id=profile_id, user_id=story.user_id)
+
+
+def get_liked_story_ids(user, story_ids):
+    # Ids of the given stories that the user has liked, in a single query
+    return set(Like.objects.filter(
+        user=user, story_id__in=story_ids).values_list('story_id', flat=True))
+
+
+def load_story_cards(stories, viewer=None, bodies=False):
+    """
+    Build StoryCards for a page of stories without further queries, but
+    one for the like state of ``viewer`` when given. Everything a card
+    shows is on the story row.
+
+    With ``bodies`` the cards also get their rendered ``body`` from the
+    card cache.
+    """
+    stories = list(stories)
+
+    # Counters include likes and comments that are not flushed yet
+    apply_pending(stories)
+
+    liked_ids = set()
+    if viewer is not None:
+        liked_ids = get_liked_story_ids(viewer, [story.id for story in stories])
+    for story in stories:
+        story.liked_by_viewer = story.id in liked_ids
+
+    cards = [StoryCard(story, get_author_profile(story)) for story in stories]
+    if bodies:
+        card_cache.get_bodies(stories)
+        card_cache.render_bodies(cards)
+    return cards
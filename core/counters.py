@@ -0,0 +1,262 @@
+import atexit
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from .models import Story
+
+# Story columns that can be buffered
+COUNTER_FIELDS = ('no_of_likes', 'no_of_comments')
+
+FLUSH_INTERVAL = getattr(settings, 'ENGAGEMENT_COUNTER_FLUSH_INTERVAL', 5)
+FLUSH_BATCH_SIZE = 500
+
+# Seconds a crashed flush keeps the shared buffer locked
+FLUSH_LOCK_TIMEOUT = 60
+
+# Postgres advisory lock engagement transactions hold shared while they
+# record a change, and reconcile_counters exclusively while it recounts
+RECONCILE_LOCK = 7310
+
+
+class LocalCounterBuffer:
+    """
+    Pending counter deltas kept in this process, flushed by whichever
+    request notices that FLUSH_INTERVAL has passed. Other processes, the
+    flush_counters command included, cannot see them and they are lost
+    when the process is killed, so this is only meant for a single
+    development server.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.deltas = defaultdict(lambda: defaultdict(int))
+
+    def add(self, story_id, field, delta):
+        with self.lock:
+            self.deltas[str(story_id)][field] += delta
+
+    def pending(self, story_ids):
+        with self.lock:
+            return {
+                str(story_id): dict(self.deltas[str(story_id)])
+                for story_id in story_ids if str(story_id) in self.deltas
+            }
+
+    def drain(self):
+        with self.lock:
+            deltas, self.deltas = self.deltas, defaultdict(lambda: defaultdict(int))
+        return {story_id: dict(fields) for story_id, fields in deltas.items()}
+
+    def restore(self, deltas):
+        for story_id, fields in deltas.items():
+            for field, delta in fields.items():
+                self.add(story_id, field, delta)
+
+
+class CacheCounterBuffer:
+    """
+    Pending counter deltas kept in a shared Django cache so every process
+    sees them, which takes a backend with atomic increments shared by all
+    processes, like Redis or Memcached. Increments and decrements are separate non-negative keys
+    because not every backend can store negative numbers, and story ids are
+    logged under a sequence number so a flush knows which keys are dirty.
+    """
+
+    def __init__(self, alias='default', prefix='counters'):
+        self.cache = caches[alias]
+        self.prefix = prefix
+
+    def is_process_local(self):
+        # A local memory cache is a separate dict in every process
+        return isinstance(self.cache, LocMemCache)
+
+    def key(self, story_id, field, direction):
+        return f'{self.prefix}:{story_id}:{field}:{direction}'
+
+    def incr(self, key, delta):
+        self.cache.add(key, 0, timeout=None)
+        return self.cache.incr(key, delta)
+
+    def add(self, story_id, field, delta):
+        direction = 'up' if delta > 0 else 'down'
+        self.incr(self.key(story_id, field, direction), abs(delta))
+        seq = self.incr(f'{self.prefix}:seq', 1)
+        self.cache.set(f'{self.prefix}:dirty:{seq}', str(story_id), timeout=None)
+
+    def pending(self, story_ids):
+        keys = {
+            (str(story_id), field, direction): self.key(story_id, field, direction)
+            for story_id in story_ids
+            for field in COUNTER_FIELDS for direction in ('up', 'down')
+        }
+        values = self.cache.get_many(keys.values())
+
+        pending = {}
+        for (story_id, field, direction), key in keys.items():
+            value = values.get(key) or 0
+            if value:
+                sign = 1 if direction == 'up' else -1
+                fields = pending.setdefault(story_id, {})
+                fields[field] = fields.get(field, 0) + sign * value
+        return pending
+
+    def drain(self):
+        # One flush at a time across processes, a second one would write
+        # the same deltas again
+        lock = f'{self.prefix}:flush_lock'
+        if not self.cache.add(lock, 1, timeout=FLUSH_LOCK_TIMEOUT):
+            return {}
+        try:
+            return self.drain_dirty()
+        finally:
+            self.cache.delete(lock)
+
+    def drain_dirty(self):
+        last = self.cache.get(f'{self.prefix}:flushed_seq', 0)
+        current = self.cache.get(f'{self.prefix}:seq', 0)
+        dirty_keys = [f'{self.prefix}:dirty:{seq}' for seq in range(last + 1, current + 1)]
+        story_ids = set(self.cache.get_many(dirty_keys).values())
+
+        deltas = {}
+        for story_id in story_ids:
+            fields = {}
+            for field in COUNTER_FIELDS:
+                for direction, sign in (('up', 1), ('down', -1)):
+                    key = self.key(story_id, field, direction)
+                    value = self.cache.get(key) or 0
+                    if value:
+                        # decr keeps increments that arrived after the get
+                        self.cache.decr(key, value)
+                        fields[field] = fields.get(field, 0) + sign * value
+            if fields:
+                deltas[story_id] = fields
+
+        self.cache.delete_many(dirty_keys)
+        self.cache.set(f'{self.prefix}:flushed_seq', current, timeout=None)
+        return deltas
+
+    def restore(self, deltas):
+        for story_id, fields in deltas.items():
+            for field, delta in fields.items():
+                self.add(story_id, field, delta)
+
+
+def create_buffer():
+    backend = getattr(settings, 'ENGAGEMENT_COUNTER_BUFFER', None)
+    if backend == 'local':
+        return LocalCounterBuffer()
+    if backend == 'cache':
+        return CacheCounterBuffer(
+            getattr(settings, 'ENGAGEMENT_COUNTER_CACHE', 'default'))
+    return None
+
+
+buffer = create_buffer()
+last_flush = time.monotonic()
+
+
+def write_deltas(deltas):
+    # One UPDATE per batch of stories, each column shifted by its own delta
+    story_ids = list(deltas)
+    with transaction.atomic():
+        for start in range(0, len(story_ids), FLUSH_BATCH_SIZE):
+            batch = story_ids[start:start + FLUSH_BATCH_SIZE]
+            updates = {}
+            for field in COUNTER_FIELDS:
+                whens = [
+                    When(id=story_id, then=Value(deltas[story_id][field]))
+                    for story_id in batch if deltas[story_id].get(field)
+                ]
+                if whens:
+                    updates[field] = F(field) + Case(
+                        *whens, default=Value(0), output_field=IntegerField())
+            if updates:
+                Story.objects.filter(id__in=batch).update(**updates)
+
+
+def flush():
+    """Write every pending delta to the Story table, returns the story count"""
+    global last_flush
+    last_flush = time.monotonic()
+    if buffer is None:
+        return 0
+
+    deltas = buffer.drain()
+    if not deltas:
+        return 0
+    try:
+        write_deltas(deltas)
+    except Exception:
+        buffer.restore(deltas)
+        raise
+    return len(deltas)
+
+
+def is_process_local():
+    # Whether pending deltas live only in this process
+    if isinstance(buffer, CacheCounterBuffer):
+        return buffer.is_process_local()
+    return isinstance(buffer, LocalCounterBuffer)
+
+
+def lock_recording(exclusive=False):
+    """
+    Take the RECONCILE_LOCK until the current transaction ends. Recording
+    takes it shared, so a recount waits for the changes in flight and new
+    ones wait for the recount.
+    """
+    function = 'pg_advisory_xact_lock' if exclusive else 'pg_advisory_xact_lock_shared'
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT {function}(%s)', [RECONCILE_LOCK])
+
+
+def maybe_flush():
+    # Requests flush when they notice the interval has passed, the
+    # flush_counters command flushes on time when no request comes in
+    if time.monotonic() - last_flush >= FLUSH_INTERVAL:
+        flush()
+
+
+def record(story_id, field, delta):
+    """
+    Record a change to one of a story's counters, buffered when a buffer is
+    configured and written straight to the row otherwise.
+    """
+    if not delta:
+        return
+    lock_recording()
+    if buffer is None:
+        Story.objects.filter(id=story_id).update(**{field: F(field) + delta})
+        return
+    buffer.add(story_id, field, delta)
+    transaction.on_commit(maybe_flush)
+
+
+def pending_deltas(story_ids):
+    if buffer is None:
+        return {}
+    return buffer.pending(story_ids)
+
+
+def apply_pending(stories):
+    # Add not yet flushed deltas to the counters of already loaded stories
+    pending = pending_deltas([story.id for story in stories])
+    for story in stories:
+        for field, delta in pending.get(str(story.id), {}).items():
+            setattr(story, field, getattr(story, field) + delta)
+    return stories
+
+
+def current_count(story_id, field):
+    count = Story.objects.values_list(field, flat=True).get(id=story_id)
+    return count + pending_deltas([story_id]).get(str(story_id), {}).get(field, 0)
+
+
+if is_process_local():
+    # Do not lose the deltas of this process on a clean shutdown
+    atexit.register(flush)
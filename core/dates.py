@@ -0,0 +1,96 @@
+import re
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+# Latest year whose end can still be written as a datetime
+MAX_YEAR = 9998
+
+
+def as_date(value):
+    # Dates come from forms as strings until the story is read back
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return parse_date(value)
+    return value
+
+
+def as_datetime(value):
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    if value is not None and timezone.is_naive(value):
+        value = timezone.make_aware(value, dt_timezone.utc)
+    return value
+
+
+def day_start(value):
+    return datetime.combine(value, time.min, tzinfo=dt_timezone.utc)
+
+
+def year_bounds(year):
+    if not 1 <= year <= MAX_YEAR:
+        return None
+    return (datetime(year, 1, 1, tzinfo=dt_timezone.utc),
+            datetime(year + 1, 1, 1, tzinfo=dt_timezone.utc))
+
+
+def decade_bounds(text):
+    """
+    The [start, end) of the decade written in ``text``, like "1980s",
+    "1980" or "80s", or None if no decade can be read from it.
+    """
+    if not text:
+        return None
+    match = re.search(r'(\d{4})', text)
+    if match:
+        year = int(match.group(1))
+    else:
+        match = re.search(r"\b'?(\d{2})'?s\b", text)
+        if not match:
+            return None
+        year = 1900 + int(match.group(1))
+
+    start = year - year % 10
+    if not 1 <= start <= MAX_YEAR - 9:
+        return None
+    return (datetime(start, 1, 1, tzinfo=dt_timezone.utc),
+            datetime(start + 10, 1, 1, tzinfo=dt_timezone.utc))
+
+
+def query_bounds(query):
+    # A search box query that is a decade ("1980s") or a year ("1985")
+    query = query.strip()
+    if re.fullmatch(r'\d{4}s', query):
+        return decade_bounds(query)
+    if re.fullmatch(r'\d{4}', query):
+        return year_bounds(int(query))
+    return None
+
+
+def date_bounds(date_format, date_exact=None, date_range_start=None,
+                date_range_end=None, decade=None, exact_date_and_time=None):
+    """
+    The [start, end) instants a story's date covers for each of the
+    DATE_FORMAT_CHOICES, or None if the date is missing.
+    """
+    try:
+        if date_format == 1:
+            day = as_date(date_exact)
+            if day:
+                return day_start(day), day_start(day + timedelta(days=1))
+        elif date_format == 2:
+            start, end = as_date(date_range_start), as_date(date_range_end)
+            if start and end:
+                start, end = min(start, end), max(start, end)
+                return day_start(start), day_start(end + timedelta(days=1))
+        elif date_format == 3:
+            return decade_bounds(decade)
+        elif date_format == 4:
+            moment = as_datetime(exact_date_and_time)
+            if moment:
+                return moment, moment + timedelta(seconds=1)
+    except OverflowError:
+        # The last day or second of year 9999 has no end
+        pass
+    return None
@@ -0,0 +1,48 @@
+from django.db import IntegrityError, transaction
+from .models import Comment, Like, Story
+from . import counters
+
+
+def toggle_like(user, story_id):
+    """
+    Like the story for ``user``, or unlike it if it is already liked.
+
+    The counter change goes through core.counters, so it is either an
+    atomic UPDATE or a buffered delta, and never a read-modify-write in
+    Python. Returns ``(liked, no_of_likes)``.
+    """
+    with transaction.atomic():
+        if not Story.objects.filter(id=story_id).exists():
+            raise Story.DoesNotExist(story_id)
+
+        deleted, _ = Like.objects.filter(user=user, story_id=story_id).delete()
+        if deleted:
+            liked = False
+            delta = -deleted
+        else:
+            liked = True
+            try:
+                with transaction.atomic():
+                    Like.objects.create(user=user, story_id=story_id)
+                delta = 1
+            except IntegrityError:
+                # A concurrent request already liked the story
+                delta = 0
+
+        counters.record(story_id, 'no_of_likes', delta)
+    return liked, counters.current_count(story_id, 'no_of_likes')
+
+
+def add_comment(user, story_id, content):
+    """
+    Add a comment to the story and bump its counter.
+    Returns ``(comment, no_of_comments)``.
+    """
+    with transaction.atomic():
+        if not Story.objects.filter(id=story_id).exists():
+            raise Story.DoesNotExist(story_id)
+
+        comment = Comment.objects.create(
+            user=user, content=content, story_id=story_id)
+        counters.record(story_id, 'no_of_comments', 1)
+    return comment, counters.current_count(story_id, 'no_of_comments')
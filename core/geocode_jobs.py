@@ -0,0 +1,205 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.gis.geos import LineString, Point, Polygon
+from django.db import connection, transaction
+from django.db.models import Avg, F, Max, Min
+from django.utils import timezone
+from .geocoding import reverse_geocode
+from .models import GeocodeJob, Location
+
+# Lookups running at once, and at most this many started per second
+CONCURRENCY = getattr(settings, 'GEOCODE_WORKER_CONCURRENCY', 4)
+RATE_LIMIT = getattr(settings, 'GEOCODE_RATE_LIMIT', 1.0)
+
+# A failed lookup is retried after RETRY_DELAY, doubled on every attempt up
+# to MAX_RETRY_DELAY, and given up after MAX_ATTEMPTS
+MAX_ATTEMPTS = getattr(settings, 'GEOCODE_MAX_ATTEMPTS', 5)
+RETRY_DELAY = timedelta(seconds=30)
+MAX_RETRY_DELAY = timedelta(hours=1)
+
+# A claimed job is not handed to another worker until its lease runs out
+LEASE = timedelta(minutes=5)
+
+BATCH_SIZE = 50
+
+# Finished jobs are kept this long for the latency metrics
+DONE_RETENTION = timedelta(days=1)
+
+NAME_LENGTH = Location._meta.get_field('name').max_length
+
+
+def location_from_feature(feature):
+    """
+    An unsaved Location for a drawn GeoJSON feature, named after its
+    coordinates until its job resolves the place name, and that name's
+    prefix.
+    """
+    location_type = feature['geometry']['type']
+    coordinates = feature['geometry']['coordinates']
+
+    if location_type == 'Point':
+        location = Location(point=Point(coordinates))
+        radius = feature.get('properties', {}).get('radius')
+        if radius:
+            location.radius = float(radius)
+            prefix = "Circle Area in "
+        else:
+            prefix = ""
+    elif location_type == 'Polygon':
+        location = Location(area=Polygon(coordinates[0]))
+        prefix = "Area Around "
+    elif location_type == 'LineString':
+        location = Location(lines=LineString(coordinates))
+        prefix = "Lines Around "
+
+    target = geocode_target(location)
+    location.name = f"{prefix}{target.y:.4f}, {target.x:.4f}"
+    return location, prefix
+
+
+def geocode_target(location):
+    # The point, the area's centroid or the line's midpoint
+    if location.point:
+        return location.point
+    if location.area:
+        return location.area.centroid
+    if location.lines:
+        return location.lines.interpolate(location.lines.length / 2)
+    return None
+
+
+def enqueue(locations_with_prefixes):
+    # One query for all of a story's locations
+    GeocodeJob.objects.bulk_create([
+        GeocodeJob(location=location, name_prefix=prefix)
+        for location, prefix in locations_with_prefixes
+    ])
+
+
+class RateLimiter:
+    """Spaces out calls to wait() by 1 / rate seconds across threads"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+limiter = RateLimiter(RATE_LIMIT)
+
+
+def claim(batch_size=BATCH_SIZE):
+    """
+    Take up to ``batch_size`` due jobs. Rows locked by another worker are
+    skipped and the taken ones are leased so no other worker takes them.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            GeocodeJob.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(status='pending', next_attempt_at__lte=now)
+            .select_related('location')
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        GeocodeJob.objects.filter(id__in=[job.id for job in jobs]).update(
+            next_attempt_at=now + LEASE)
+    return jobs
+
+
+def lookup(job):
+    # Runs in a worker thread, returns the name or the exception
+    limiter.wait()
+    try:
+        target = geocode_target(job.location)
+        return reverse_geocode(target.y, target.x)
+    except Exception as e:
+        return e
+    finally:
+        if threading.current_thread() is not threading.main_thread():
+            connection.close()
+
+
+def retry_delay(attempts):
+    return min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def finish(job, result):
+    now = timezone.now()
+    job.attempts += 1
+    if isinstance(result, Exception):
+        job.last_error = repr(result)
+        if job.attempts >= MAX_ATTEMPTS:
+            job.status = 'failed'
+            job.finished_at = now
+        else:
+            job.next_attempt_at = now + retry_delay(job.attempts)
+        job.save()
+        return job.status
+
+    with transaction.atomic():
+        # No place name there, the coordinates placeholder stays
+        if result is not None:
+            location = job.location
+            location.name = f"{job.name_prefix}{result}"[:NAME_LENGTH]
+            # Location's post_save updates the search documents of its stories
+            location.save(update_fields=['name'])
+        job.status = 'done'
+        job.finished_at = now
+        job.last_error = ''
+        job.save()
+    return job.status
+
+
+def process(batch_size=BATCH_SIZE, concurrency=CONCURRENCY):
+    """
+    Resolve one batch of due jobs, ``concurrency`` lookups at a time.
+    Returns how many jobs ended in each status.
+    """
+    jobs = claim(batch_size)
+    if concurrency > 1 and len(jobs) > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lookup, jobs))
+    else:
+        results = [lookup(job) for job in jobs]
+
+    counts = {'done': 0, 'pending': 0, 'failed': 0}
+    for job, result in zip(jobs, results):
+        counts[finish(job, result)] += 1
+    return counts
+
+
+def purge_finished():
+    GeocodeJob.objects.filter(
+        status='done', finished_at__lt=timezone.now() - DONE_RETENTION).delete()
+
+
+def metrics(window=timedelta(hours=1)):
+    """Queue depth and the latency of the jobs finished within ``window``"""
+    now = timezone.now()
+    pending = GeocodeJob.objects.filter(status='pending')
+    oldest = pending.aggregate(oldest=Min('queued_at'))['oldest']
+    latency = GeocodeJob.objects.filter(
+        status='done', finished_at__gte=now - window
+    ).aggregate(average=Avg(F('finished_at') - F('queued_at')),
+                maximum=Max(F('finished_at') - F('queued_at')))
+
+    return {
+        'queue_depth': pending.count(),
+        'due': pending.filter(next_attempt_at__lte=now).count(),
+        'failed': GeocodeJob.objects.filter(status='failed').count(),
+        'oldest_pending_seconds': (now - oldest).total_seconds() if oldest else 0,
+        'latency_seconds': {
+            key: value.total_seconds() if value else None for key, value in latency.items()
+        },
+    }
@@ -0,0 +1,285 @@
+import csv
+import math
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import timedelta
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from geopy.exc import GeopyError
+from geopy.geocoders import Nominatim
+from .models import GeocodeCacheEntry
+
+# Where place names come from: 'nominatim' or 'gazetteer', and the backend
+# asked when the first one has no name for a point, if any
+BACKEND = getattr(settings, 'GEOCODER_BACKEND', 'nominatim')
+FALLBACK = getattr(settings, 'GEOCODER_FALLBACK', None)
+
+# CSV of places for the offline backend and how far away the nearest place
+# may be for its name to be used
+GAZETTEER_PATH = getattr(settings, 'GEOCODER_GAZETTEER_PATH', None)
+GAZETTEER_MAX_DISTANCE_KM = getattr(settings, 'GEOCODER_GAZETTEER_MAX_DISTANCE_KM', 25)
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Lookups are snapped to a grid of this many degrees, about 100 m of
+# latitude, and every point of a cell shares the name of its center
+GRID_SIZE = getattr(settings, 'GEOCODE_CACHE_GRID_SIZE', 0.001)
+
+# Names older than this are looked up again, the stale name is still served
+# if the lookup fails
+CACHE_TTL = timedelta(days=getattr(settings, 'GEOCODE_CACHE_TTL_DAYS', 30))
+
+# Cells kept in the in-process cache in front of the table
+LRU_SIZE = getattr(settings, 'GEOCODE_CACHE_LRU_SIZE', 10000)
+
+NOMINATIM_USER_AGENT = getattr(settings, 'NOMINATIM_USER_AGENT', 'my_app')
+NOMINATIM_TIMEOUT = getattr(settings, 'NOMINATIM_TIMEOUT', 10)
+
+NAME_LENGTH = GeocodeCacheEntry._meta.get_field('name').max_length
+
+
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+lru = LRUCache(LRU_SIZE)
+
+stats_lock = threading.Lock()
+stats = dict.fromkeys(
+    ('memory_hits', 'database_hits', 'misses', 'refreshes', 'errors'), 0)
+
+
+def count(stat):
+    with stats_lock:
+        stats[stat] += 1
+
+
+def get_stats():
+    # Counters of this process since it started
+    with stats_lock:
+        return dict(stats)
+
+
+geolocator = None
+
+
+def nominatim_reverse(lat, lon):
+    # One client per process instead of one per lookup
+    global geolocator
+    if geolocator is None:
+        geolocator = Nominatim(user_agent=NOMINATIM_USER_AGENT, timeout=NOMINATIM_TIMEOUT)
+    location = geolocator.reverse(f"{lat}, {lon}")
+    return location.address if location else None
+
+
+def snap(lat, lon):
+    """The cache key of the grid cell holding a point and the cell's center"""
+    row, col = round(lat / GRID_SIZE), round(lon / GRID_SIZE)
+    return f"{GRID_SIZE}:{row}:{col}", (row * GRID_SIZE, col * GRID_SIZE)
+
+
+def is_fresh(entry, now):
+    return now - entry[1] < CACHE_TTL
+
+
+def cached_nominatim_reverse(lat, lon):
+    """
+    The Nominatim name of the place at a point, or None where there is none.
+
+    Served from the in-process LRU, then from the GeocodeCacheEntry table,
+    and only looked up on Nominatim when the point's grid cell has never
+    been looked up or its name is older than CACHE_TTL.
+    """
+    cell, (cell_lat, cell_lon) = snap(lat, lon)
+    now = timezone.now()
+
+    entry = lru.get(cell)
+    if entry and is_fresh(entry, now):
+        count('memory_hits')
+        return entry[0] or None
+
+    if entry is None:
+        entry = GeocodeCacheEntry.objects.filter(cell=cell).values_list('name', 'fetched_at').first()
+        if entry:
+            lru.set(cell, entry)
+            if is_fresh(entry, now):
+                count('database_hits')
+                return entry[0] or None
+
+    count('misses' if entry is None else 'refreshes')
+    try:
+        name = nominatim_reverse(cell_lat, cell_lon)
+    except GeopyError:
+        count('errors')
+        if entry:
+            return entry[0] or None
+        raise
+
+    # Places without a name are cached as '' so the sea is not looked up again
+    entry = ((name or '')[:NAME_LENGTH], now)
+    GeocodeCacheEntry.objects.update_or_create(
+        cell=cell, defaults={'name': entry[0], 'fetched_at': now})
+    lru.set(cell, entry)
+    return entry[0] or None
+
+
+def unit_vector(lat, lon):
+    # Nearest on the sphere is nearest in 3D, without the antimeridian seam
+    lat, lon = math.radians(lat), math.radians(lon)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+class KDTree:
+    """
+    A k-d tree over 3D points kept in flat arrays. Each range of ``index``
+    is a subtree whose root is its middle element, split on ``axes[mid]``,
+    so the tree needs no node objects.
+    """
+
+    def __init__(self, points):
+        self.size = len(points)
+        self.coords = [array('d', (point[axis] for point in points)) for axis in range(3)]
+        self.index = array('l', range(self.size))
+        self.axes = array('b', bytes(self.size))
+
+        stack = [(0, self.size)]
+        while stack:
+            lo, hi = stack.pop()
+            if hi - lo <= 1:
+                continue
+            ids = self.index[lo:hi]
+            # Split on the axis the points are most spread along
+            axis = max(range(3), key=lambda axis: (
+                max(self.coords[axis][i] for i in ids) - min(self.coords[axis][i] for i in ids)))
+            self.index[lo:hi] = array('l', sorted(ids, key=self.coords[axis].__getitem__))
+            mid = (lo + hi) // 2
+            self.axes[mid] = axis
+            stack.append((lo, mid))
+            stack.append((mid + 1, hi))
+
+    def nearest(self, point):
+        """The index of the point closest to ``point`` and its squared distance"""
+        coords, index, axes = self.coords, self.index, self.axes
+        best, best_distance = None, math.inf
+
+        stack = [(0, self.size, 0.0)]
+        while stack:
+            lo, hi, bound = stack.pop()
+            if lo >= hi or bound >= best_distance:
+                continue
+            mid = (lo + hi) // 2
+            i = index[mid]
+            distance = sum((coords[axis][i] - point[axis]) ** 2 for axis in range(3))
+            if distance < best_distance:
+                best, best_distance = i, distance
+            if hi - lo == 1:
+                continue
+
+            axis = axes[mid]
+            diff = point[axis] - coords[axis][i]
+            below, above = (lo, mid), (mid + 1, hi)
+            near, far = (below, above) if diff < 0 else (above, below)
+            # The far side is only searched if the splitting plane is closer
+            stack.append((*far, diff * diff))
+            stack.append((*near, 0.0))
+        return best, best_distance
+
+
+class NominatimGeocoder:
+    def reverse(self, lat, lon):
+        return cached_nominatim_reverse(lat, lon)
+
+
+class GazetteerGeocoder:
+    """
+    Offline names from a CSV gazetteer with ``name``, ``latitude`` and
+    ``longitude`` columns and optional ``admin2``, ``admin1`` and
+    ``country`` columns, answered by a KD-tree loaded on first use.
+    """
+
+    def __init__(self, path=None, max_distance_km=None):
+        self.path = path or GAZETTEER_PATH
+        self.max_distance_km = GAZETTEER_MAX_DISTANCE_KM if max_distance_km is None else max_distance_km
+        self.lock = threading.Lock()
+        self.names = None
+        self.tree = None
+
+    def load(self):
+        if not self.path:
+            raise ImproperlyConfigured('GEOCODER_GAZETTEER_PATH is not set.')
+        names, points = [], []
+        with open(self.path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                hierarchy = [row.get(column) for column in ('name', 'admin2', 'admin1', 'country')]
+                names.append(', '.join(part for part in hierarchy if part))
+                points.append(unit_vector(float(row['latitude']), float(row['longitude'])))
+        self.tree = KDTree(points)
+        self.names = names
+
+    def reverse(self, lat, lon):
+        if self.tree is None:
+            with self.lock:
+                if self.tree is None:
+                    self.load()
+        i, distance = self.tree.nearest(unit_vector(lat, lon))
+        if i is None:
+            return None
+        # Chord length on the unit sphere to great-circle kilometers
+        km = 2 * EARTH_RADIUS_KM * math.asin(min(math.sqrt(distance) / 2, 1.0))
+        if km > self.max_distance_km:
+            return None
+        return self.names[i]
+
+
+BACKENDS = {
+    'nominatim': NominatimGeocoder,
+    'gazetteer': GazetteerGeocoder,
+}
+
+geocoders = {}
+
+
+def get_geocoder(name):
+    if name not in BACKENDS:
+        raise ImproperlyConfigured(f'Unknown geocoder backend {name!r}.')
+    if name not in geocoders:
+        geocoders[name] = BACKENDS[name]()
+    return geocoders[name]
+
+
+def reverse_geocode(lat, lon):
+    """
+    The name of the place at a point from the GEOCODER_BACKEND, or from the
+    GEOCODER_FALLBACK when the backend has none. None if neither has one.
+    """
+    name = get_geocoder(BACKEND).reverse(lat, lon)
+    if name is None and FALLBACK and FALLBACK != BACKEND:
+        try:
+            name = get_geocoder(FALLBACK).reverse(lat, lon)
+        except GeopyError:
+            # The fallback is best effort, air-gapped hosts cannot reach it
+            count('errors')
+    return name
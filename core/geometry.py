@@ -0,0 +1,115 @@
+import json
+import math
+from django.contrib.gis.geos import Polygon
+
+# Detail levels of the GeoJSON stored on each Location: simplification
+# tolerance in degrees and the decimals coordinates are rounded to
+DETAIL_LEVELS = {
+    'low': (0.01, 3),
+    'medium': (0.001, 4),
+    'high': (0.0001, 5),
+}
+
+DEFAULT_DETAIL = 'medium'
+
+# Fewest coordinates a ring and a line can keep after rounding
+MIN_COORDS = {'Polygon': 4, 'LineString': 2}
+
+# Vertices of the polygon standing for a circle location, its chords stay
+# within 0.2% of the radius inside the circle
+CIRCLE_SEGMENTS = 64
+
+EARTH_RADIUS = 6371008.8
+
+
+def round_coords(coords, decimals):
+    # Round a ring or line and drop the points rounding made repeat
+    rounded = []
+    for x, y in coords:
+        point = [round(x, decimals), round(y, decimals)]
+        if not rounded or point != rounded[-1]:
+            rounded.append(point)
+    return rounded
+
+
+def compact(geom, tolerance, decimals):
+    """
+    A GeoJSON geometry dict of ``geom`` simplified with ``tolerance`` and
+    rounded to ``decimals``, or None when that leaves too few points.
+    """
+    if geom.geom_type == 'Point':
+        return {'type': 'Point', 'coordinates': [round(geom.x, decimals), round(geom.y, decimals)]}
+
+    simplified = geom.simplify(tolerance, preserve_topology=True)
+    if simplified.geom_type != geom.geom_type:
+        return None
+    if geom.geom_type == 'Polygon':
+        coordinates = [round_coords(ring, decimals) for ring in simplified.coords]
+        rings = coordinates
+    else:
+        coordinates = round_coords(simplified.coords, decimals)
+        rings = [coordinates]
+    if any(len(ring) < MIN_COORDS[geom.geom_type] for ring in rings):
+        return None
+    return {'type': geom.geom_type, 'coordinates': coordinates}
+
+
+def simplified_geojson(point=None, area=None, lines=None):
+    """
+    The GeoJSON geometry of a location at every DETAIL_LEVELS level, from
+    whichever of its point, area or lines is set. A level that would
+    collapse the shape keeps the next finer level's geometry.
+    """
+    geom = point or area or lines
+    if geom is None:
+        return None
+
+    levels = {}
+    finer = json.loads(geom.json)
+    # Finest level first
+    for level, (tolerance, decimals) in sorted(DETAIL_LEVELS.items(), key=lambda item: item[1][0]):
+        finer = compact(geom, tolerance, decimals) or finer
+        levels[level] = finer
+    return levels
+
+
+def wrap_longitude(lon):
+    return (lon + 180.0) % 360.0 - 180.0
+
+
+def circle_polygon(point, radius, segments=CIRCLE_SEGMENTS):
+    """
+    The polygon of the points ``radius`` meters from ``point`` on the
+    sphere, for the geography column circles are searched by.
+    """
+    distance = radius / EARTH_RADIUS
+    lat, lon = math.radians(point.y), math.radians(point.x)
+    ring = []
+    for i in range(segments):
+        bearing = 2 * math.pi * i / segments
+        y = math.asin(math.sin(lat) * math.cos(distance)
+                      + math.cos(lat) * math.sin(distance) * math.cos(bearing))
+        x = lon + math.atan2(math.sin(bearing) * math.sin(distance) * math.cos(lat),
+                             math.cos(distance) - math.sin(lat) * math.sin(y))
+        ring.append((wrap_longitude(math.degrees(x)), math.degrees(y)))
+    ring.append(ring[0])
+    return Polygon(ring)
+
+
+def circle_bbox(point, radius):
+    """
+    The west, south, east, north degrees around the circle of ``radius``
+    meters at ``point``, the whole longitude range when it crosses the
+    antimeridian or a pole.
+    """
+    distance = math.degrees(radius / EARTH_RADIUS)
+    south, north = max(point.y - distance, -90), min(point.y + distance, 90)
+    if south == -90 or north == 90:
+        return -180, south, 180, north
+    # Widest where the circle reaches furthest from the equator
+    half_width = math.degrees(math.asin(min(
+        math.sin(math.radians(distance)) / math.cos(math.radians(point.y)), 1)))
+    west, east = point.x - half_width, point.x + half_width
+    if west < -180 or east > 180:
+        return -180, south, 180, north
+    return west, south, east, north
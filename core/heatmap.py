@@ -0,0 +1,151 @@
+from django.conf import settings
+from django.db import connection, transaction
+
+# Zoom levels of the Web Mercator tile grids locations are counted in. A
+# bin at resolution r is the tile r/x/y, so its id is y * 2 ** r + x
+RESOLUTIONS = getattr(settings, 'HEATMAP_RESOLUTIONS', (2, 4, 6, 8, 10, 12, 14))
+
+# A map at zoom z is shown with the bins of zoom z + BIN_ZOOM_OFFSET, about
+# 2 ** BIN_ZOOM_OFFSET bins across each of its 256 pixel tiles
+BIN_ZOOM_OFFSET = getattr(settings, 'HEATMAP_BIN_ZOOM_OFFSET', 3)
+
+# Half the width of the Web Mercator world in meters
+WORLD_HALF_WIDTH = 20037508.342789244
+
+# The cells of every story location link, at every resolution, picked by
+# the WHERE clause filled in. Areas count at their centroid and lines at
+# their midpoint, the same spot the map tiles draw them at
+CELLS_SQL = """
+WITH linked AS (
+    SELECT ST_Transform(ST_SetSRID(ST_MakePoint(
+               ST_X(geom), GREATEST(LEAST(ST_Y(geom), 85.0511), -85.0511)), 4326), 3857) AS geom
+    FROM (
+        SELECT COALESCE(
+                   location.point,
+                   ST_Centroid(location.area::geometry),
+                   ST_LineInterpolatePoint(location.lines, 0.5)
+               ) AS geom
+        FROM {through_table} story_location
+        JOIN {location_table} location ON location.id = story_location.location_id
+        WHERE {where}
+    ) links
+    WHERE geom IS NOT NULL
+)
+SELECT resolution,
+       LEAST(GREATEST(floor((ST_X(geom) + %(half)s) / (2 * %(half)s) * 2 ^ resolution), 0), 2 ^ resolution - 1)::integer AS x,
+       LEAST(GREATEST(floor((%(half)s - ST_Y(geom)) / (2 * %(half)s) * 2 ^ resolution), 0), 2 ^ resolution - 1)::integer AS y,
+       count(*) AS count
+FROM linked CROSS JOIN unnest(%(resolutions)s::integer[]) AS resolution
+GROUP BY 1, 2, 3
+"""
+
+# Adds the counted links to the bins, or takes them off with a negative sign
+APPLY_SQL = """
+INSERT INTO {bin_table} AS bin (resolution, x, y, count)
+SELECT resolution, x, y, %(sign)s * count FROM ({cells}) cells
+ON CONFLICT (resolution, x, y) DO UPDATE SET count = bin.count + EXCLUDED.count
+"""
+
+
+def quoted_tables(Story, HeatmapBin):
+    quote = connection.ops.quote_name
+    return {
+        'through_table': quote(Story.locations.through._meta.db_table),
+        'location_table': quote(Story.locations.field.related_model._meta.db_table),
+        'bin_table': quote(HeatmapBin._meta.db_table),
+    }
+
+
+def link_filter(story_ids=None, location_ids=None):
+    """
+    The WHERE clause and its parameters picking the story location links
+    between ``story_ids`` and ``location_ids``, None for no filter on that
+    side, or None when an empty list leaves no link to pick.
+    """
+    if (story_ids is not None and not story_ids) or (location_ids is not None and not location_ids):
+        return None
+    where, params = [], {}
+    if story_ids is not None:
+        where.append('story_location.story_id = ANY(%(story_ids)s::uuid[])')
+        params['story_ids'] = [str(story_id) for story_id in story_ids]
+    if location_ids is not None:
+        where.append('story_location.location_id = ANY(%(location_ids)s)')
+        params['location_ids'] = list(location_ids)
+    return ' AND '.join(where) or 'TRUE', params
+
+
+def apply_links(Story, HeatmapBin, sign, story_ids=None, location_ids=None):
+    """
+    Count the links between ``story_ids`` and ``location_ids`` in the bins
+    (``sign`` 1) or take them out (``sign`` -1), with one query. Takes the
+    models so migrations can pass their historical ones.
+    """
+    links = link_filter(story_ids, location_ids)
+    if links is None:
+        return
+    where, params = links
+
+    tables = quoted_tables(Story, HeatmapBin)
+    cells = CELLS_SQL.format(where=where, **tables)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(APPLY_SQL.format(cells=cells, **tables), {
+            'sign': sign,
+            'half': WORLD_HALF_WIDTH,
+            'resolutions': list(RESOLUTIONS),
+            **params,
+        })
+        if sign < 0:
+            HeatmapBin.objects.filter(count__lte=0).delete()
+
+
+def rebuild_bins(Story, HeatmapBin):
+    """Recount every bin from the story locations"""
+    with transaction.atomic():
+        HeatmapBin.objects.all().delete()
+        apply_links(Story, HeatmapBin, 1)
+    return HeatmapBin.objects.count()
+
+
+def apply(sign, story_ids=None, location_ids=None):
+    from .models import HeatmapBin, Story
+
+    apply_links(Story, HeatmapBin, sign, story_ids, location_ids)
+
+
+def rebuild():
+    from .models import HeatmapBin, Story
+
+    return rebuild_bins(Story, HeatmapBin)
+
+
+def resolution_for(zoom):
+    # The finest resolution at most BIN_ZOOM_OFFSET levels deeper than the map
+    wanted = zoom + BIN_ZOOM_OFFSET
+    fitting = [resolution for resolution in RESOLUTIONS if resolution <= wanted]
+    return max(fitting) if fitting else min(RESOLUTIONS)
+
+
+def heatmap(zoom, bbox=None):
+    """
+    The bins to draw a map at ``zoom``, as ``{'resolution', 'size', 'bins',
+    'counts'}`` with the bin ids and their counts in matching arrays. Bin
+    ``id`` is the tile ``resolution/(id % size)/(id // size)``. ``bbox``
+    is ``(west, south, east, north)`` in degrees.
+    """
+    from .models import HeatmapBin
+    from .tiles import tile_of
+
+    resolution = resolution_for(zoom)
+    size = 2 ** resolution
+    bins = HeatmapBin.objects.filter(resolution=resolution)
+    if bbox is not None:
+        west, south, east, north = bbox
+        min_x, min_y = tile_of(west, north, resolution)
+        max_x, max_y = tile_of(east, south, resolution)
+        bins = bins.filter(x__range=(min_x, max_x), y__range=(min_y, max_y))
+
+    ids, counts = [], []
+    for x, y, count in bins.order_by('y', 'x').values_list('x', 'y', 'count'):
+        ids.append(y * size + x)
+        counts.append(count)
+    return {'resolution': resolution, 'size': size, 'bins': ids, 'counts': counts}
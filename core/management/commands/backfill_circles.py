@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from core.models import Location
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = "Store the circle and bounding box of locations with a radius that are missing them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--all', action='store_true',
+                            help="Recompute every circle, not only the missing ones")
+
+    def handle(self, *args, **options):
+        locations = Location.objects.filter(point__isnull=False, radius__isnull=False)
+        if not options['all']:
+            locations = locations.filter(circle__isnull=True)
+
+        batch, updated = [], 0
+        for location in locations.only('id', 'point', 'radius').iterator(chunk_size=options['batch_size']):
+            location.update_circle()
+            batch.append(location)
+            if len(batch) >= options['batch_size']:
+                updated += Location.objects.bulk_update(batch, ['circle', 'bbox'])
+                batch = []
+        if batch:
+            updated += Location.objects.bulk_update(batch, ['circle', 'bbox'])
+        self.stdout.write(self.style.SUCCESS(f"Stored the circles of {updated} locations"))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core import autocomplete, heatmap, nearby, spacetime, tiles
+from core.models import Location
+from core.places import BATCH_SIZE, find_duplicates, merge_places
+from core.search import update_search_vectors
+from core.summaries import update_summaries
+
+
+class Command(BaseCommand):
+    help = "Merge locations that mark the same place and link their stories to one of them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report how many locations would be merged")
+
+    def handle(self, *args, **options):
+        keep = find_duplicates(options['batch_size'])
+        if options['dry_run'] or not keep:
+            self.stdout.write(f"{len(keep)} duplicate locations found")
+            return
+
+        # Kept places gain stories and duplicates lose theirs
+        affected = list(Location.objects.filter(id__in=set(keep) | set(keep.values())))
+        tiles.invalidate_locations(Location.objects.filter(id__in=list(keep)))
+        with transaction.atomic():
+            story_ids = merge_places(keep, options['batch_size'])
+            # Merged links move without m2m signals
+            heatmap.rebuild()
+            spacetime.rebuild()
+            update_summaries(story_ids)
+        # Location names are part of the story search documents
+        update_search_vectors(story_ids)
+        nearby.bump(affected)
+        # Place usage counts moved, the indexes of the web processes too
+        autocomplete.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f"Merged {len(keep)} duplicate locations of {len(story_ids)} stories"))
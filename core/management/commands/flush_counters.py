@@ -0,0 +1,28 @@
+import time
+from django.core.management.base import BaseCommand
+from core import counters
+
+
+class Command(BaseCommand):
+    help = (
+        "Write buffered like and comment counter deltas to the Story table "
+        "every ENGAGEMENT_COUNTER_FLUSH_INTERVAL seconds"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=counters.FLUSH_INTERVAL, metavar='SECONDS',
+                            help="Seconds between flushes")
+        parser.add_argument('--once', action='store_true',
+                            help="Flush once and exit instead of running periodically")
+
+    def handle(self, *args, **options):
+        if counters.is_process_local():
+            self.stderr.write(self.style.WARNING(
+                "ENGAGEMENT_COUNTER_BUFFER is 'local', the deltas of the web processes "
+                "are not visible here and only they flush them"))
+        while True:
+            flushed = counters.flush()
+            self.stdout.write(f"Flushed counters of {flushed} stories")
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,28 @@
+import time
+from django.core.management.base import BaseCommand
+from core import geocode_jobs
+
+
+class Command(BaseCommand):
+    help = "Resolve the names of newly drawn locations queued by new posts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', type=float, metavar='SECONDS',
+                            help="Keep polling the queue every SECONDS instead of running once")
+        parser.add_argument('--batch-size', type=int, default=geocode_jobs.BATCH_SIZE)
+        parser.add_argument('--concurrency', type=int, default=geocode_jobs.CONCURRENCY)
+
+    def handle(self, *args, **options):
+        while True:
+            counts = geocode_jobs.process(options['batch_size'], options['concurrency'])
+            if any(counts.values()):
+                self.stdout.write(
+                    f"Resolved {counts['done']} locations, {counts['pending']} to retry, "
+                    f"{counts['failed']} failed")
+            # A full batch means more jobs are probably due
+            if sum(counts.values()) == options['batch_size']:
+                continue
+            if not options['loop']:
+                break
+            geocode_jobs.purge_finished()
+            time.sleep(options['loop'])
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core import autocomplete
+from core.models import Story, Tag
+from core.search import update_search_vectors
+from core.summaries import update_summaries
+from core.tags import BATCH_SIZE, merge_duplicate_tags
+
+
+class Command(BaseCommand):
+    help = "Merge tags whose names only differ in case or whitespace"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            removed, story_ids = merge_duplicate_tags(Tag, Story, options['batch_size'])
+            # Merged links move without m2m signals, cached cards follow the summaries
+            update_summaries(story_ids)
+        # Tag names are part of the story search documents
+        update_search_vectors(story_ids)
+        # Tag usage counts moved, the indexes of the web processes too
+        autocomplete.invalidate()
+        self.stdout.write(self.style.SUCCESS(f"Merged {removed} duplicate tags"))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from core import heatmap
+
+
+class Command(BaseCommand):
+    help = "Recount the heatmap bins of every story location, for data saved before they were kept"
+
+    def handle(self, *args, **options):
+        count = heatmap.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} heatmap bins"))
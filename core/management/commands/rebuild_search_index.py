@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from core.models import Story
+from core.search import update_search_vectors
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search document of every story"
+
+    def handle(self, *args, **options):
+        story_ids = list(Story.objects.values_list('id', flat=True))
+        update_search_vectors(story_ids)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(story_ids)} search documents"))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from core import spacetime
+
+
+class Command(BaseCommand):
+    help = "Recount the space-time cube of every dated story location, for data saved before it was kept"
+
+    def handle(self, *args, **options):
+        count = spacetime.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} space-time cells"))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from core.models import Story
+from core.summaries import update_summaries
+
+
+class Command(BaseCommand):
+    help = "Rebuild the feed card summary of every story"
+
+    def handle(self, *args, **options):
+        story_ids = list(Story.objects.values_list('id', flat=True))
+        update_summaries(story_ids)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(story_ids)} story summaries"))
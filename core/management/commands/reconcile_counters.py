@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from core import counters
+from core.models import Comment, Like, Story
+
+
+def count_subquery(model):
+    counts = model.objects.filter(story=OuterRef('pk')).values(
+        'story').annotate(total=Count('id')).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+class Command(BaseCommand):
+    help = "Recompute Story.no_of_likes and no_of_comments from the Like and Comment tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if counters.is_process_local():
+            # The web processes would add their unflushed deltas on top of
+            # the recomputed values later on
+            raise CommandError(
+                "The engagement counter buffer is local to each process, its deltas cannot be "
+                "flushed from here. Buffer in a cache shared by all processes, or not at all, "
+                "before reconciling.")
+
+        batch_size = options['batch_size']
+        story_ids = list(Story.objects.order_by('id').values_list('id', flat=True))
+        updated = 0
+        for start in range(0, len(story_ids), batch_size):
+            batch = story_ids[start:start + batch_size]
+            with transaction.atomic():
+                # No like or comment is recorded between the flush and the
+                # recount, it would be counted in both
+                counters.lock_recording(exclusive=True)
+                # Pending deltas would be applied twice on top of the recomputed values
+                counters.flush()
+                updated += Story.objects.filter(id__in=batch).update(
+                    no_of_likes=count_subquery(Like),
+                    no_of_comments=count_subquery(Comment),
+                )
+        self.stdout.write(self.style.SUCCESS(f"Reconciled counters of {updated} stories"))
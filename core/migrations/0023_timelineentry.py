@@ -0,0 +1,46 @@
+# Generated by Django 4.1.7 on 2026-10-18 09:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_timelines(apps, schema_editor):
+    Follower = apps.get_model('core', 'Follower')
+    Story = apps.get_model('core', 'Story')
+    TimelineEntry = apps.get_model('core', 'TimelineEntry')
+    for follow in Follower.objects.all().iterator():
+        stories = Story.objects.filter(
+            user_id=follow.user_id).values_list('id', 'created_at')
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(owner_id=follow.follower_id, story_id=story_id, created_at=created_at)
+             for story_id, created_at in stories],
+            batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0022_alter_profile_email_alter_profile_username'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to=settings.AUTH_USER_MODEL)),
+                ('story', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.story')),
+            ],
+            options={
+                'unique_together': {('owner', 'story')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['owner', '-created_at'], name='core_timeline_owner_idx'),
+        ),
+        migrations.RunPython(populate_timelines, migrations.RunPython.noop),
+    ]
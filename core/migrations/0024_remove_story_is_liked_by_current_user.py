@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:03
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_timelineentry'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='story',
+            name='is_liked_by_current_user',
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:41
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_likes(apps, schema_editor):
+    Like = apps.get_model('core', 'Like')
+    duplicates = (Like.objects.values('user', 'story')
+                  .annotate(like_count=Count('id'), keep_id=Min('id'))
+                  .filter(like_count__gt=1))
+    for duplicate in duplicates:
+        Like.objects.filter(user=duplicate['user'], story=duplicate['story']).exclude(
+            id=duplicate['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_remove_story_is_liked_by_current_user'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_likes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='like',
+            constraint=models.UniqueConstraint(fields=('user', 'story'), name='unique_like_per_user'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:26
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Same document as core.search.story_document, for the stories that exist
+# before the field does
+POPULATE_SEARCH_VECTORS = """
+UPDATE core_story s SET search_vector =
+    setweight(to_tsvector('simple', coalesce(s.title, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce((
+        SELECT string_agg(t.name, ' ') FROM core_story_tags st
+        JOIN core_tag t ON t.id = st.tag_id WHERE st.story_id = s.id), '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce((
+        SELECT string_agg(l.name, ' ') FROM core_story_locations sl
+        JOIN core_location l ON l.id = sl.location_id WHERE sl.story_id = s.id), '')), 'C') ||
+    setweight(to_tsvector('simple', regexp_replace(coalesce(s.content, ''), '<[^>]*>', ' ', 'g')), 'D');
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_like_unique_like_per_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='story',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='story',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='core_story_search_idx'),
+        ),
+        migrations.RunSQL(POPULATE_SEARCH_VECTORS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.1.7 on 2026-10-18 12:37
+
+import django.contrib.postgres.fields.ranges
+import django.contrib.postgres.indexes
+from django.db import migrations
+from psycopg2.extras import DateTimeTZRange
+from core.dates import date_bounds
+
+
+def populate_date_intervals(apps, schema_editor):
+    Story = apps.get_model('core', 'Story')
+    stories = []
+    for story in Story.objects.all().iterator():
+        bounds = date_bounds(
+            story.date_format,
+            date_exact=story.date_exact,
+            date_range_start=story.date_range_start,
+            date_range_end=story.date_range_end,
+            decade=story.decade,
+            exact_date_and_time=story.exact_date_and_time,
+        )
+        if bounds is not None:
+            story.date_interval = DateTimeTZRange(*bounds, bounds='[)')
+            stories.append(story)
+    Story.objects.bulk_update(stories, ['date_interval'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_profile_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='story',
+            name='date_interval',
+            field=django.contrib.postgres.fields.ranges.DateTimeRangeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='story',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['date_interval'], name='core_story_interval_idx'),
+        ),
+        migrations.RunPython(populate_date_intervals, migrations.RunPython.noop),
+    ]
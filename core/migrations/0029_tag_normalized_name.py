@@ -0,0 +1,26 @@
+# Generated by Django 4.1.7 on 2026-10-18 13:05
+
+from django.db import migrations, models
+from core.tags import merge_duplicate_tags
+
+
+def merge_tags(apps, schema_editor):
+    Tag = apps.get_model('core', 'Tag')
+    Story = apps.get_model('core', 'Story')
+    merge_duplicate_tags(Tag, Story)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0028_story_date_interval'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='normalized_name',
+            field=models.CharField(editable=False, max_length=255, null=True),
+        ),
+        migrations.RunPython(merge_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.1.7 on 2026-10-18 13:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0030_alter_tag_normalized_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodeCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cell', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=255)),
+                ('fetched_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.1.7 on 2026-10-18 15:47
+
+from django.db import migrations, models
+from core.geometry import simplified_geojson
+
+
+def populate_geojson(apps, schema_editor):
+    Location = apps.get_model('core', 'Location')
+    locations = []
+    for location in Location.objects.all().iterator():
+        location.geojson = simplified_geojson(location.point, location.area, location.lines)
+        locations.append(location)
+    Location.objects.bulk_update(locations, ['geojson'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0032_geocodejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='geojson',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(populate_geojson, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.1.7 on 2026-10-18 16:20
+
+from django.db import migrations, models
+from core.heatmap import rebuild_bins
+
+
+def count_bins(apps, schema_editor):
+    Story = apps.get_model('core', 'Story')
+    HeatmapBin = apps.get_model('core', 'HeatmapBin')
+    rebuild_bins(Story, HeatmapBin)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0034_location_geojson'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeatmapBin',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveSmallIntegerField()),
+                ('x', models.PositiveIntegerField()),
+                ('y', models.PositiveIntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='heatmapbin',
+            constraint=models.UniqueConstraint(fields=('resolution', 'x', 'y'), name='unique_heatmap_bin'),
+        ),
+        migrations.RunPython(count_bins, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:05
+
+from django.db import migrations, models
+from core.spacetime import rebuild_cells
+
+
+def count_cells(apps, schema_editor):
+    Story = apps.get_model('core', 'Story')
+    SpaceTimeCell = apps.get_model('core', 'SpaceTimeCell')
+    rebuild_cells(Story, SpaceTimeCell)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0035_heatmapbin'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpaceTimeCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('x', models.PositiveIntegerField()),
+                ('y', models.PositiveIntegerField()),
+                ('span', models.PositiveSmallIntegerField(choices=[(1, 'Year'), (10, 'Decade')])),
+                ('start_year', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='spacetimecell',
+            constraint=models.UniqueConstraint(fields=('span', 'start_year', 'x', 'y'), name='unique_space_time_cell'),
+        ),
+        migrations.RunPython(count_cells, migrations.RunPython.noop),
+    ]
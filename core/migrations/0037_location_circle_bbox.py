@@ -0,0 +1,44 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:40
+
+import django.contrib.gis.db.models.fields
+from django.contrib.gis.geos import Polygon
+from django.db import migrations
+from core.geometry import circle_bbox, circle_polygon
+
+BATCH_SIZE = 1000
+
+
+def store_circles(apps, schema_editor):
+    Location = apps.get_model('core', 'Location')
+    locations = Location.objects.filter(point__isnull=False, radius__isnull=False)
+    batch = []
+    for location in locations.only('id', 'point', 'radius').iterator(chunk_size=BATCH_SIZE):
+        location.circle = circle_polygon(location.point, location.radius)
+        location.bbox = Polygon.from_bbox(circle_bbox(location.point, location.radius))
+        batch.append(location)
+        if len(batch) >= BATCH_SIZE:
+            Location.objects.bulk_update(batch, ['circle', 'bbox'])
+            batch = []
+    if batch:
+        Location.objects.bulk_update(batch, ['circle', 'bbox'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0036_spacetimecell'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='bbox',
+            field=django.contrib.gis.db.models.fields.PolygonField(blank=True, editable=False, null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='circle',
+            field=django.contrib.gis.db.models.fields.PolygonField(blank=True, editable=False, geography=True, null=True, srid=4326),
+        ),
+        migrations.RunPython(store_circles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:30
+
+from django.db import migrations, models
+from core.summaries import update_story_summaries
+
+
+def populate_summaries(apps, schema_editor):
+    Story = apps.get_model('core', 'Story')
+    update_story_summaries(Story, Story.objects.values_list('id', flat=True))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0037_location_circle_bbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='story',
+            name='summary',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(populate_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-18 20:10
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def count_followers(apps, schema_editor):
+    Follower = apps.get_model('core', 'Follower')
+    FollowerCount = apps.get_model('core', 'FollowerCount')
+    counts = Follower.objects.values('user').annotate(count=Count('id')).values_list('user', 'count')
+    FollowerCount.objects.bulk_create(
+        [FollowerCount(user_id=user_id, count=count) for user_id, count in counts], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0038_story_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FollowerCount',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='follower_count', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_followers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.1.7 on 2026-10-18 20:40
+
+from django.db import migrations, models
+from django.db.models import Min, OuterRef, Subquery
+import django.utils.timezone
+
+
+def date_locations(apps, schema_editor):
+    # Existing locations were made along with their first story
+    Location = apps.get_model('core', 'Location')
+    Story = apps.get_model('core', 'Story')
+    first_story = Story.objects.filter(locations=OuterRef('pk')).values('locations').annotate(
+        first=Min('created_at')).values('first')
+    Location.objects.filter(story__isnull=False).update(created_at=Subquery(first_story))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0039_followercount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(date_locations, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='location',
+            index=models.Index(fields=['created_at', 'id'], name='core_location_created_idx'),
+        ),
+    ]
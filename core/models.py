@@ -1,8 +1,17 @@
 from django.contrib.auth import get_user_model
 import uuid
 from datetime import datetime
+from django.utils import timezone
 from django.contrib.gis.db import models
+from django.contrib.gis.geos import Polygon
+from django.contrib.postgres.fields import DateTimeRangeField
+from django.contrib.postgres.indexes import GinIndex, GistIndex
+from django.contrib.postgres.search import SearchVectorField
 from ckeditor.fields import RichTextField
+from psycopg2.extras import DateTimeTZRange
+from .dates import date_bounds
+from .geometry import circle_bbox, circle_polygon, simplified_geojson
+from .tags import normalize_tag_name
 
 User = get_user_model()
 
@@ -20,6 +29,19 @@ class Profile(models.Model):
         upload_to='profile_images', default='blank-profile-picture.png')
     bio = models.TextField(blank=True)
 
+    class Meta:
+        # Trigram indexes for the fuzzy people search in core.search
+        indexes = [
+            GinIndex(fields=['username'], opclasses=['gin_trgm_ops'],
+                     name='core_profile_username_trgm'),
+            GinIndex(fields=['first_name'], opclasses=['gin_trgm_ops'],
+                     name='core_profile_first_name_trgm'),
+            GinIndex(fields=['last_name'], opclasses=['gin_trgm_ops'],
+                     name='core_profile_last_name_trgm'),
+            GinIndex(fields=['bio'], opclasses=['gin_trgm_ops'],
+                     name='core_profile_bio_trgm'),
+        ]
+
     def __str__(self):
         return self.user.username
 
@@ -27,10 +49,18 @@ class Profile(models.Model):
 class Tag(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
     name = models.CharField(max_length=255)
+    normalized_name = models.CharField(max_length=255, unique=True, editable=False)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_tag_name(self.name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'normalized_name'}
+        super().save(*args, **kwargs)
+
 
 class Location(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4)
@@ -39,10 +69,44 @@ class Location(models.Model):
     area = models.PolygonField(null=True, geography=True, blank=True)
     lines = models.LineStringField(blank=True, null=True)
     radius = models.FloatField(null=True, blank=True)
+    # The geometry as GeoJSON at each core.geometry detail level
+    geojson = models.JSONField(null=True, blank=True, editable=False)
+    # A point with a radius as the area it stands for, and that area's
+    # bounding box, so circles are searched by index like areas
+    circle = models.PolygonField(null=True, geography=True, blank=True, editable=False)
+    bbox = models.PolygonField(null=True, blank=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # Duplicate places are merged into the earliest one
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='core_location_created_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'point', 'area', 'lines', 'radius'} & set(update_fields):
+            self.update_geojson()
+            self.update_circle()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'geojson', 'circle', 'bbox'}
+        super().save(*args, **kwargs)
+
+    def update_geojson(self):
+        # Also called before bulk inserts, which skip save()
+        self.geojson = simplified_geojson(self.point, self.area, self.lines)
+
+    def update_circle(self):
+        # Like update_geojson, also called before bulk inserts
+        if self.point and self.radius:
+            self.circle = circle_polygon(self.point, self.radius)
+            self.bbox = Polygon.from_bbox(circle_bbox(self.point, self.radius))
+        else:
+            self.circle = self.bbox = None
+
 
 class File(models.Model):
     file = models.FileField(upload_to='files')
@@ -75,12 +139,44 @@ class Story(models.Model):
     locations = models.ManyToManyField(Location)
     files = models.ManyToManyField(File, blank=True)
     no_of_likes = models.IntegerField(default=0)
-    is_liked_by_current_user = models.BooleanField(default=False)
     no_of_comments = models.IntegerField(default=0)
+    # Weighted title, tags, locations and content, maintained by core.search
+    search_vector = SearchVectorField(null=True, editable=False)
+    # [start, end) instants of the story's date whatever its date_format
+    date_interval = DateTimeRangeField(null=True, blank=True, editable=False)
+    # Author, tags, locations, files and excerpt shown on feed cards,
+    # maintained by core.summaries
+    summary = models.JSONField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='core_story_search_idx'),
+            GistIndex(fields=['date_interval'], name='core_story_interval_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        self.date_interval = self.get_date_interval()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'date_interval'}
+        super().save(*args, **kwargs)
+
+    def get_date_interval(self):
+        bounds = date_bounds(
+            self.date_format,
+            date_exact=self.date_exact,
+            date_range_start=self.date_range_start,
+            date_range_end=self.date_range_end,
+            decade=self.decade,
+            exact_date_and_time=self.exact_date_and_time,
+        )
+        if bounds is None:
+            return None
+        return DateTimeTZRange(*bounds, bounds='[)')
+
     def get_comments(self):
         return self.comment_set.all()
 
@@ -101,6 +197,12 @@ class Like(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     story = models.ForeignKey(Story, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'story'], name='unique_like_per_user'),
+        ]
+
     def __str__(self):
         return self.user.username
 
@@ -123,3 +225,114 @@ class Follower(models.Model):
 
     def __str__(self):
         return f"{self.follower.username} follows {self.user.username}"
+
+
+class TimelineEntry(models.Model):
+    owner = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="timeline_entries")
+    story = models.ForeignKey(Story, on_delete=models.CASCADE)
+    # Copy of story.created_at so the feed can be read from this table alone
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('owner', 'story')
+        indexes = [
+            models.Index(fields=['owner', '-created_at'],
+                         name='core_timeline_owner_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.story} in {self.owner.username}'s timeline"
+
+
+class FollowerCount(models.Model):
+    # Number of Follower rows of a user, kept by core.timeline on follow and
+    # unfollow so the home feed can tell big authors apart without counting
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name="follower_count")
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user.username} has {self.count} followers"
+
+
+class GeocodeCacheEntry(models.Model):
+    # Reverse geocoded name of one cell of the core.geocoding snapping grid
+    cell = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255)
+    fetched_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.cell}: {self.name}"
+
+
+class GeocodeJob(models.Model):
+    # A location whose name is resolved in the background by core.geocode_jobs
+
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    location = models.OneToOneField(
+        Location, on_delete=models.CASCADE, related_name='geocode_job')
+    # Kept in front of the resolved name, like "Area Around "
+    name_prefix = models.CharField(max_length=50, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    queued_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'],
+                         name='core_geocodejob_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.location} ({self.status})"
+
+
+class HeatmapBin(models.Model):
+    # Story locations in one Web Mercator grid cell, kept by core.heatmap
+    resolution = models.PositiveSmallIntegerField()
+    x = models.PositiveIntegerField()
+    y = models.PositiveIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['resolution', 'x', 'y'], name='unique_heatmap_bin'),
+        ]
+
+    def __str__(self):
+        return f"{self.resolution}/{self.x}/{self.y}: {self.count}"
+
+
+class SpaceTimeCell(models.Model):
+    # Story locations in one grid cell dated within one year or decade, kept by core.spacetime
+
+    SPAN_CHOICES = (
+        (1, 'Year'),
+        (10, 'Decade'),
+    )
+
+    x = models.PositiveIntegerField()
+    y = models.PositiveIntegerField()
+    span = models.PositiveSmallIntegerField(choices=SPAN_CHOICES)
+    # First year of the year or decade
+    start_year = models.IntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['span', 'start_year', 'x', 'y'], name='unique_space_time_cell'),
+        ]
+
+    def __str__(self):
+        return f"{self.x}/{self.y} {self.start_year}+{self.span}: {self.count}"
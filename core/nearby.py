@@ -0,0 +1,86 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from .geocode_jobs import geocode_target
+from .spatial import nearest_stories, story_shape
+from .tiles import tile_of
+
+# Other stories listed under a story, and the cache holding the panel
+LIMIT = getattr(settings, 'NEARBY_STORIES_LIMIT', 5)
+CACHE = getattr(settings, 'NEARBY_STORIES_CACHE', 'default')
+
+# Seconds a rendered panel is kept, a safety net for stories added further
+# away than the neighbouring regions
+CACHE_TTL = getattr(settings, 'NEARBY_STORIES_CACHE_TTL', 60 * 60)
+
+# Regions are the Web Mercator tiles of this zoom, about 150 km wide. A
+# panel depends on the regions around every location of its story and a
+# story added or removed in a region moves that region's version on
+REGION_ZOOM = 8
+
+TEMPLATE = 'partials/nearby_stories.html'
+
+
+def regions(locations, neighbours=False):
+    # The zoom REGION_ZOOM tiles of the locations, and the tiles around them
+    found = set()
+    n = 2 ** REGION_ZOOM
+    for location in locations:
+        target = geocode_target(location)
+        if target is None:
+            continue
+        x, y = tile_of(target.x, target.y, REGION_ZOOM)
+        if not neighbours:
+            found.add((x, y))
+            continue
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                if 0 <= y + dy < n:
+                    found.add(((x + dx) % n, y + dy))
+    return sorted(found)
+
+
+def region_key(x, y):
+    return f'nearby-region:{REGION_ZOOM}/{x}/{y}'
+
+
+def bump(locations):
+    """Invalidate the panels near ``locations`` by moving their regions on"""
+    cache = caches[CACHE]
+    for x, y in regions(locations):
+        key = region_key(x, y)
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Evicted between add and incr
+            cache.set(key, 1, timeout=None)
+
+
+def fragment_key(story, locations):
+    cache = caches[CACHE]
+    keys = [region_key(x, y) for x, y in regions(locations, neighbours=True)]
+    versions = cache.get_many(keys)
+    stamp = '.'.join(str(versions.get(key, 0)) for key in keys)
+    return f'nearby-stories:{story.id}:{LIMIT}:{stamp}'
+
+
+def nearby_stories_html(story):
+    """
+    The rendered panel of the stories closest to ``story``, from the cache
+    while no story was added or removed around its locations.
+    """
+    locations = list(story.locations.all())
+    shape = story_shape(locations)
+    if shape is None:
+        return ''
+
+    cache = caches[CACHE]
+    key = fragment_key(story, locations)
+    html = cache.get(key)
+    if html is None:
+        nearby = nearest_stories(shape, LIMIT, exclude=[story.id])
+        html = render_to_string(TEMPLATE, {'nearby': nearby})
+        cache.set(key, html, timeout=CACHE_TTL)
+    return mark_safe(html)
@@ -0,0 +1,88 @@
+import base64
+import uuid
+from datetime import datetime
+from django.conf import settings
+from django.db.models import FloatField, Q, Value
+from django.db.models.functions import Cast
+
+# Number of stories rendered per feed page
+PAGE_SIZE = getattr(settings, 'FEED_PAGE_SIZE', 20)
+
+
+def encode_cursor(story):
+    value = f"{story.created_at.isoformat()}|{story.id}"
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Turn a cursor back into its ``(created_at, id)`` key.
+
+    Returns None for a missing or malformed cursor so the feed starts over
+    from the newest story.
+    """
+    if not cursor:
+        return None
+    try:
+        value = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, story_id = value.split('|')
+        return datetime.fromisoformat(created_at), uuid.UUID(story_id)
+    except (ValueError, UnicodeError):
+        return None
+
+
+def encode_rank_cursor(story):
+    value = f"{story.rank!r}|{story.id}"
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_rank_cursor(cursor):
+    # Same as decode_cursor, for search results keyed on (rank, id)
+    if not cursor:
+        return None
+    try:
+        value = base64.urlsafe_b64decode(cursor.encode()).decode()
+        rank, story_id = value.split('|')
+        return float(rank), uuid.UUID(story_id)
+    except (ValueError, UnicodeError):
+        return None
+
+
+def before_cursor(key, created_at_field='created_at', id_field='id'):
+    # Everything strictly older than the (created_at, id) key
+    created_at, story_id = key
+    return (Q(**{f'{created_at_field}__lt': created_at}) |
+            Q(**{created_at_field: created_at, f'{id_field}__lt': story_id}))
+
+
+def split_page(stories, page_size=PAGE_SIZE, encode=encode_cursor):
+    """
+    Split a list of up to ``page_size + 1`` stories into the page to render
+    and the cursor of the next page, which is None on the last page.
+    """
+    stories = list(stories)
+    if len(stories) > page_size:
+        stories = stories[:page_size]
+        return stories, encode(stories[-1])
+    return stories, None
+
+
+def paginate_stories(stories, cursor=None, page_size=PAGE_SIZE):
+    # Keyset pagination of a Story queryset on (created_at, id), newest first
+    stories = stories.order_by('-created_at', '-id')
+    key = decode_cursor(cursor)
+    if key:
+        stories = stories.filter(before_cursor(key))
+    return split_page(stories[:page_size + 1], page_size)
+
+
+def paginate_ranked_stories(stories, cursor=None, page_size=PAGE_SIZE):
+    # Keyset pagination of search results annotated with a rank, best first
+    stories = stories.order_by('-rank', '-id')
+    key = decode_rank_cursor(cursor)
+    if key:
+        # Compare in double precision so the cursor's rank matches exactly
+        rank, story_id = key
+        rank = Cast(Value(rank), FloatField())
+        stories = stories.filter(Q(rank__lt=rank) | Q(rank=rank, id__lt=story_id))
+    return split_page(stories[:page_size + 1], page_size, encode_rank_cursor)
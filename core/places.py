@@ -0,0 +1,162 @@
+import math
+from functools import reduce
+from operator import or_
+from django.conf import settings
+from django.db.models import Q
+from .models import Location, Story
+from .spatial import METERS_PER_DEGREE, degrees
+
+# New points and circles join an existing place closer than this many
+# meters, lines whose every vertex is this close to it
+SNAP_DISTANCE = getattr(settings, 'PLACE_SNAP_DISTANCE', 25)
+
+# Areas join an existing area when their intersection covers this share of
+# their union
+OVERLAP_THRESHOLD = getattr(settings, 'PLACE_OVERLAP_THRESHOLD', 0.9)
+
+# Through rows moved per query by merge_places
+BATCH_SIZE = 500
+
+EARTH_RADIUS = 6371008.8
+
+
+def kind(location):
+    if location.point:
+        return 'circle' if location.radius else 'point'
+    if location.area:
+        return 'area'
+    if location.lines:
+        return 'lines'
+    return None
+
+
+def meters_between(a, b):
+    # Haversine distance between two points
+    lat1, lat2 = math.radians(a.y), math.radians(b.y)
+    dlat, dlon = lat2 - lat1, math.radians(b.x - a.x)
+    h = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(math.sqrt(h), 1.0))
+
+
+def overlap(a, b):
+    union = a.union(b).area
+    return a.intersection(b).area / union if union else 0
+
+
+def line_gap(a, b):
+    # Largest distance from a vertex of either line to the other, in degrees
+    gaps = [b.distance(point) for point in a] + [a.distance(point) for point in b]
+    return max(gaps)
+
+
+def match_score(location, place):
+    """
+    How well an existing ``place`` fits a new ``location``, lower is better,
+    or None when they are not the same place.
+    """
+    if kind(location) != kind(place):
+        return None
+
+    if kind(location) in ('point', 'circle'):
+        distance = meters_between(location.point, place.point)
+        if distance > SNAP_DISTANCE:
+            return None
+        if location.radius and abs(location.radius - place.radius) > max(
+                SNAP_DISTANCE, 0.1 * max(location.radius, place.radius)):
+            return None
+        return distance
+
+    shape = location.area or location.lines
+    place_shape = place.area or place.lines
+    if kind(location) == 'area':
+        share = overlap(shape, place_shape)
+        return 1 - share if share >= OVERLAP_THRESHOLD else None
+
+    gap = line_gap(shape, place_shape)
+    return gap if gap <= SNAP_DISTANCE / METERS_PER_DEGREE else None
+
+
+def nearby_filter(location):
+    # An indexed lookup finding every place that could match the location
+    if location.point:
+        return Q(point__dwithin=(location.point, degrees(SNAP_DISTANCE, location.point)))
+    if location.area:
+        return Q(area__intersects=location.area)
+    if location.lines:
+        return Q(lines__dwithin=(location.lines, degrees(SNAP_DISTANCE, location.lines)))
+    return None
+
+
+def best_match(location, candidates):
+    scored = [
+        (score, place) for place in candidates
+        if place.pk != location.pk and (score := match_score(location, place)) is not None
+    ]
+    return min(scored, key=lambda item: item[0])[1] if scored else None
+
+
+def find_places(locations):
+    """
+    The existing place each of the unsaved ``locations`` should be linked
+    to instead, by position, with one query for all of them.
+    """
+    filters = [nearby_filter(location) for location in locations]
+    filters = [q for q in filters if q is not None]
+    if not filters:
+        return {}
+
+    candidates = list(Location.objects.filter(reduce(or_, filters)))
+    places = {}
+    for i, location in enumerate(locations):
+        place = best_match(location, candidates)
+        if place is not None:
+            places[i] = place
+    return places
+
+
+def merge_places(keep, batch_size=BATCH_SIZE):
+    """
+    Point the stories of every duplicate location in ``keep``, a dict of
+    duplicate id to kept id, to the kept location and delete the duplicates.
+    Returns the ids of the stories whose locations changed.
+    """
+    Through = Story.locations.through
+    duplicate_ids = list(keep)
+    story_ids = set()
+    for start in range(0, len(duplicate_ids), batch_size):
+        batch = duplicate_ids[start:start + batch_size]
+        links = {
+            (story_id, keep[location_id])
+            for story_id, location_id in Through.objects.filter(
+                location_id__in=batch).values_list('story_id', 'location_id')
+        }
+        Through.objects.bulk_create(
+            [Through(story_id=story_id, location_id=location_id) for story_id, location_id in links],
+            ignore_conflicts=True)
+        Through.objects.filter(location_id__in=batch).delete()
+        Location.objects.filter(id__in=batch).delete()
+        story_ids.update(story_id for story_id, _ in links)
+    return story_ids
+
+
+def find_duplicates(batch_size=BATCH_SIZE):
+    """
+    Map every location that is the same place as an earlier one, in
+    creation order, to the location kept for that place. Locations are
+    read with one server side cursor, ``batch_size`` rows at a time.
+    """
+    keep = {}
+    kept = set()
+    locations = Location.objects.order_by('created_at', 'id')
+    for location in locations.iterator(chunk_size=batch_size):
+        query = nearby_filter(location)
+        if location.pk in keep or query is None:
+            continue
+        candidates = Location.objects.filter(query).exclude(pk=location.pk)
+        for candidate in candidates:
+            if candidate.pk in keep or candidate.pk in kept:
+                continue
+            if match_score(candidate, location) is not None:
+                keep[candidate.pk] = location.pk
+                kept.add(location.pk)
+    return keep
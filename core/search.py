@@ -0,0 +1,127 @@
+from html import unescape
+from django.conf import settings
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, SearchVector, TrigramSimilarity, TrigramWordSimilarity)
+from django.db import connection
+from django.db.models import FloatField, Q, TextField, Value
+from django.db.models.functions import Cast, Greatest
+from django.utils.html import strip_tags
+from psycopg2.extras import DateTimeTZRange
+from .dates import query_bounds
+from .models import Profile, Story
+
+# Text search configuration of the story documents, 'simple' does not stem
+# so it treats every language our stories are written in the same way
+SEARCH_CONFIG = getattr(settings, 'STORY_SEARCH_CONFIG', 'simple')
+
+BATCH_SIZE = 500
+
+# People search: how many profiles to return and how similar they must be
+PROFILE_SEARCH_LIMIT = getattr(settings, 'PROFILE_SEARCH_LIMIT', 20)
+PROFILE_SEARCH_THRESHOLD = getattr(settings, 'PROFILE_SEARCH_THRESHOLD', 0.3)
+
+
+def plain_text(html):
+    return unescape(strip_tags(html or ''))
+
+
+def weighted(text, weight):
+    return SearchVector(Value(text, output_field=TextField()),
+                        weight=weight, config=SEARCH_CONFIG)
+
+
+def story_document(story):
+    """
+    The weighted search document of a story: title first, then tag names,
+    location names and the plain text of the content. The story's tags and
+    locations should be prefetched.
+    """
+    return (
+        weighted(story.title, 'A') +
+        weighted(' '.join(tag.name for tag in story.tags.all()), 'B') +
+        weighted(' '.join(location.name for location in story.locations.all()), 'C') +
+        weighted(plain_text(story.content), 'D')
+    )
+
+
+def update_search_vectors(story_ids):
+    # Rebuild the search document of the given stories
+    story_ids = list(story_ids)
+    for start in range(0, len(story_ids), BATCH_SIZE):
+        stories = Story.objects.filter(
+            id__in=story_ids[start:start + BATCH_SIZE]
+        ).prefetch_related('tags', 'locations')
+        for story in stories:
+            Story.objects.filter(id=story.id).update(
+                search_vector=story_document(story))
+
+
+def stories_overlapping(start, end, stories=None):
+    """
+    Stories whose date overlaps [start, end), answered by the range index on
+    Story.date_interval whatever date format the stories were written with.
+    """
+    if stories is None:
+        stories = Story.objects.all()
+    return stories.filter(
+        date_interval__overlap=DateTimeTZRange(start, end, bounds='[)'))
+
+
+def date_query(query):
+    # Stories dated in a decade written like "1980s" or a year like "1985"
+    bounds = query_bounds(query)
+    if bounds is None:
+        return None
+    return Q(date_interval__overlap=DateTimeTZRange(*bounds, bounds='[)'))
+
+
+def search_stories(query):
+    """
+    Stories matching a search box query, annotated with their ``rank``.
+
+    Words are matched against the indexed search document with web search
+    syntax ("quoted phrases", or, -excluded), decades like "1980s" and
+    years like "1985" also match stories dated within them.
+    """
+    search_query = SearchQuery(
+        query, search_type='websearch', config=SEARCH_CONFIG)
+    story_query = Q(search_vector=search_query)
+
+    dated = date_query(query)
+    if dated is not None:
+        story_query |= dated
+
+    return Story.objects.filter(story_query).annotate(
+        rank=Cast(SearchRank('search_vector', search_query), FloatField()))
+
+
+def search_profiles(query, limit=None, threshold=None):
+    """
+    Profiles whose username, first or last name is similar to ``query``, or
+    whose bio contains a similar word, most similar first.
+
+    The trigram operators are answered by the Profile trigram indexes, their
+    threshold is set to ``threshold`` for the connection first.
+    """
+    limit = PROFILE_SEARCH_LIMIT if limit is None else limit
+    threshold = PROFILE_SEARCH_THRESHOLD if threshold is None else threshold
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT set_config('pg_trgm.similarity_threshold', %s, false), "
+            "set_config('pg_trgm.word_similarity_threshold', %s, false)",
+            [str(threshold), str(threshold)])
+
+    return list(
+        Profile.objects.filter(
+            Q(username__trigram_similar=query) |
+            Q(first_name__trigram_similar=query) |
+            Q(last_name__trigram_similar=query) |
+            Q(bio__trigram_word_similar=query)
+        ).annotate(similarity=Greatest(
+            TrigramSimilarity('username', query),
+            TrigramSimilarity('first_name', query),
+            TrigramSimilarity('last_name', query),
+            TrigramWordSimilarity(query, 'bio'),
+        )).order_by('-similarity', 'username')[:limit]
+    )
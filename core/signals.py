@@ -0,0 +1,224 @@
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from .models import Follower, Location, Profile, Story, Tag
+from . import autocomplete, heatmap, nearby, search, spacetime, summaries, tiles, timeline
+
+# One receiver per signal and sender, each refreshes every structure
+# derived from the changed rows: search documents, story summaries, map
+# tiles, nearby panels, heatmap bins, the space-time cube, the autocomplete
+# index and the home timelines. Cached cards follow the summaries.
+
+AUTOCOMPLETE_MODELS = {
+    Tag: ('tags', 'name'),
+    Location: ('places', 'name'),
+    Profile: ('users', 'username'),
+}
+
+RELATIONS = {
+    Story.tags.through: 'tags',
+    Story.locations.through: 'locations',
+    Story.files.through: 'files',
+}
+
+
+# Stories changed inside refresh_once, by the part to refresh
+deferred = threading.local()
+
+
+def refresh_stories(changed):
+    if changed.get('search'):
+        search.update_search_vectors(changed['search'])
+    if changed.get('summary'):
+        summaries.update_summaries(changed['summary'])
+
+
+def stories_changed(story_ids, parts):
+    story_ids = list(story_ids)
+    changed = getattr(deferred, 'changed', None)
+    if changed is None:
+        refresh_stories({part: story_ids for part in parts})
+        return
+    for part in parts:
+        changed[part].update(story_ids)
+
+
+@contextmanager
+def refresh_once():
+    """
+    Refresh the search documents and summaries of the stories changed in
+    the block once, when the outermost block ends, instead of after every
+    save and relation change.
+    """
+    if getattr(deferred, 'changed', None) is not None:
+        yield
+        return
+    deferred.changed = defaultdict(set)
+    try:
+        yield
+        changed = deferred.changed
+    finally:
+        deferred.changed = None
+    refresh_stories(changed)
+
+
+def apply_density(sign, **ids):
+    heatmap.apply(sign, **ids)
+    spacetime.apply(sign, **ids)
+
+
+# Stories
+
+@receiver(post_save, sender=Story)
+def story_saved(sender, instance, created, update_fields, **kwargs):
+    if created:
+        timeline.fan_out_story(instance)
+    parts = ['search']
+    # Counter updates leave the summary's content and author as they are
+    if update_fields is None or {'content', 'user'} & set(update_fields):
+        parts.append('summary')
+    stories_changed([instance.id], parts)
+
+
+@receiver(pre_delete, sender=Story)
+def story_deleting(sender, instance, **kwargs):
+    # The through rows go with the story without an m2m_changed signal
+    locations = list(instance.locations.all())
+    tiles.invalidate_locations(locations)
+    nearby.bump(locations)
+    apply_density(-1, story_ids=[instance.id])
+    if autocomplete.is_built():
+        for name in instance.tags.values_list('name', flat=True):
+            autocomplete.update('tags', name, -1)
+        for location in locations:
+            autocomplete.update('places', location.name, -1)
+
+
+@receiver(m2m_changed, sender=Story.tags.through)
+@receiver(m2m_changed, sender=Story.locations.through)
+@receiver(m2m_changed, sender=Story.files.through)
+def story_relations_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    relation = RELATIONS[sender]
+    if action in ('pre_add', 'pre_remove', 'pre_clear'):
+        relations_changing(relation, instance, action, reverse, model, pk_set)
+    else:
+        relations_changed(relation, instance, action, reverse, pk_set)
+
+
+def relations_changing(relation, instance, action, reverse, model, pk_set):
+    if action != 'pre_clear':
+        if relation == 'locations' and action == 'pre_remove':
+            # Removed links are counted out before their rows go
+            if reverse:
+                apply_density(-1, story_ids=pk_set, location_ids=[instance.id])
+            else:
+                apply_density(-1, story_ids=[instance.id], location_ids=pk_set)
+        return
+
+    if reverse:
+        # A clear from the tag/location side does not say which stories it touches
+        instance._cleared_story_ids = list(instance.story_set.values_list('id', flat=True))
+    if relation == 'locations':
+        locations = [instance] if reverse else list(instance.locations.all())
+        tiles.invalidate_locations(locations)
+        nearby.bump(locations)
+        apply_density(-1, **{'location_ids' if reverse else 'story_ids': [instance.id]})
+    if relation != 'files' and autocomplete.is_built():
+        if reverse:
+            instance._autocomplete_cleared = [(instance.name, len(instance._cleared_story_ids))]
+        else:
+            instance._autocomplete_cleared = [
+                (name, 1) for name in model.objects.filter(story=instance).values_list('name', flat=True)]
+
+
+def relations_changed(relation, instance, action, reverse, pk_set):
+    if action == 'post_clear':
+        story_ids = getattr(instance, '_cleared_story_ids', []) if reverse else [instance.id]
+        usage = [(name, -uses) for name, uses in getattr(instance, '_autocomplete_cleared', [])]
+    else:
+        story_ids = (pk_set or []) if reverse else [instance.id]
+        sign = 1 if action == 'post_add' else -1
+        if relation == 'locations':
+            locations = [instance] if reverse else list(Location.objects.filter(pk__in=pk_set or []))
+            tiles.invalidate_locations(locations)
+            nearby.bump(locations)
+            if sign > 0:
+                if reverse:
+                    apply_density(1, story_ids=pk_set, location_ids=[instance.id])
+                else:
+                    apply_density(1, story_ids=[instance.id], location_ids=pk_set)
+
+        if not pk_set or relation == 'files':
+            usage = []
+        elif reverse:
+            usage = [(instance.name, sign * len(pk_set))]
+        elif relation == 'tags':
+            usage = [(name, sign) for name in Tag.objects.filter(pk__in=pk_set).values_list('name', flat=True)]
+        else:
+            usage = [(location.name, sign) for location in locations]
+    if relation != 'files':
+        kind = 'tags' if relation == 'tags' else 'places'
+        for name, delta in usage:
+            autocomplete.update(kind, name, delta)
+
+    # Files are not part of the search document
+    parts = ['summary'] if relation == 'files' else ['search', 'summary']
+    stories_changed(story_ids, parts)
+
+
+# Tags, locations and profiles
+
+@receiver(pre_save, sender=Tag)
+@receiver(pre_save, sender=Location)
+@receiver(pre_save, sender=Profile)
+def name_saving(sender, instance, **kwargs):
+    # Remember the stored name so a rename can move its usage count
+    if autocomplete.is_built() and not instance._state.adding:
+        field = AUTOCOMPLETE_MODELS[sender][1]
+        instance._autocomplete_old_name = sender.objects.filter(
+            pk=instance.pk).values_list(field, flat=True).first()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Location)
+@receiver(post_save, sender=Profile)
+def name_saved(sender, instance, created, **kwargs):
+    kind, field = AUTOCOMPLETE_MODELS[sender]
+    name = getattr(instance, field)
+    old_name = getattr(instance, '_autocomplete_old_name', None)
+    if old_name is not None:
+        autocomplete.rename(kind, old_name, name)
+    else:
+        autocomplete.update(kind, name)
+
+    if sender is Profile:
+        # Summaries hold the author's profile id, username and avatar
+        stories_changed(Story.objects.filter(
+            user_id=instance.user_id).values_list('id', flat=True), ['summary'])
+    elif not created:
+        # A renamed tag or a geocoded location name is in the search
+        # documents and summaries of its stories
+        stories_changed(instance.story_set.values_list('id', flat=True), ['search', 'summary'])
+
+
+@receiver(post_delete, sender=Profile)
+def profile_deleted(sender, instance, **kwargs):
+    autocomplete.remove('users', instance.username)
+
+
+# Followers
+
+@receiver(post_save, sender=Follower)
+def follower_saved(sender, instance, created, **kwargs):
+    if created:
+        timeline.add_follow(instance.follower, instance.user)
+        autocomplete.update('users', instance.user.username, 1)
+
+
+@receiver(post_delete, sender=Follower)
+def follower_deleted(sender, instance, **kwargs):
+    timeline.remove_follow(instance.follower_id, instance.user_id)
+    if autocomplete.is_built():
+        autocomplete.update('users', instance.user.username, -1)
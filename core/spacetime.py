@@ -0,0 +1,166 @@
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from .heatmap import WORLD_HALF_WIDTH, link_filter
+
+# Zoom level of the Web Mercator tile grid the cube is counted in, coarser
+# zoom levels are summed up from it
+RESOLUTION = getattr(settings, 'SPACE_TIME_RESOLUTION', 8)
+
+# Most cells a single cube request may return
+MAX_CELLS = getattr(settings, 'SPACE_TIME_MAX_CELLS', 1000000)
+
+# Years in each time bucket the cube is kept at
+SPANS = {'year': 1, 'decade': 10}
+
+# Every year or decade each story location link is dated within, per grid
+# cell. A story counts in every bucket its date_interval overlaps, at the
+# spot the heatmap counts its location
+CELLS_SQL = """
+WITH linked AS (
+    SELECT ST_Transform(ST_SetSRID(ST_MakePoint(
+               ST_X(geom), GREATEST(LEAST(ST_Y(geom), 85.0511), -85.0511)), 4326), 3857) AS geom,
+           first_year, last_year
+    FROM (
+        SELECT COALESCE(
+                   location.point,
+                   ST_Centroid(location.area::geometry),
+                   ST_LineInterpolatePoint(location.lines, 0.5)
+               ) AS geom,
+               extract(year FROM lower(story.date_interval))::integer AS first_year,
+               extract(year FROM upper(story.date_interval) - interval '1 microsecond')::integer AS last_year
+        FROM {through_table} story_location
+        JOIN {location_table} location ON location.id = story_location.location_id
+        JOIN {story_table} story ON story.id = story_location.story_id
+        WHERE {where} AND story.date_interval IS NOT NULL
+    ) links
+    WHERE geom IS NOT NULL
+)
+SELECT LEAST(GREATEST(floor((ST_X(geom) + %(half)s) / (2 * %(half)s) * %(size)s), 0), %(size)s - 1)::integer AS x,
+       LEAST(GREATEST(floor((%(half)s - ST_Y(geom)) / (2 * %(half)s) * %(size)s), 0), %(size)s - 1)::integer AS y,
+       span,
+       start_year,
+       count(*) AS count
+FROM linked
+CROSS JOIN unnest(%(spans)s::integer[]) AS span
+CROSS JOIN LATERAL generate_series(
+    floor(first_year::numeric / span)::integer * span,
+    floor(last_year::numeric / span)::integer * span,
+    span
+) AS start_year
+GROUP BY 1, 2, 3, 4
+"""
+
+APPLY_SQL = """
+INSERT INTO {cell_table} AS cell (x, y, span, start_year, count)
+SELECT x, y, span, start_year, %(sign)s * count FROM ({cells}) cells
+ON CONFLICT (span, start_year, x, y) DO UPDATE SET count = cell.count + EXCLUDED.count
+"""
+
+
+def quoted_tables(Story, SpaceTimeCell):
+    quote = connection.ops.quote_name
+    return {
+        'through_table': quote(Story.locations.through._meta.db_table),
+        'location_table': quote(Story.locations.field.related_model._meta.db_table),
+        'story_table': quote(Story._meta.db_table),
+        'cell_table': quote(SpaceTimeCell._meta.db_table),
+    }
+
+
+def apply_links(Story, SpaceTimeCell, sign, story_ids=None, location_ids=None):
+    """
+    Count the links between ``story_ids`` and ``location_ids`` in the cube
+    (``sign`` 1) or take them out (``sign`` -1), with one query. Takes the
+    models so migrations can pass their historical ones.
+    """
+    links = link_filter(story_ids, location_ids)
+    if links is None:
+        return
+    where, params = links
+
+    tables = quoted_tables(Story, SpaceTimeCell)
+    cells = CELLS_SQL.format(where=where, **tables)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(APPLY_SQL.format(cells=cells, **tables), {
+            'sign': sign,
+            'half': WORLD_HALF_WIDTH,
+            'size': 2 ** RESOLUTION,
+            'spans': list(SPANS.values()),
+            **params,
+        })
+        if sign < 0:
+            SpaceTimeCell.objects.filter(count__lte=0).delete()
+
+
+def rebuild_cells(Story, SpaceTimeCell):
+    """Recount the whole cube from the dated story locations"""
+    with transaction.atomic():
+        SpaceTimeCell.objects.all().delete()
+        apply_links(Story, SpaceTimeCell, 1)
+    return SpaceTimeCell.objects.count()
+
+
+def apply(sign, story_ids=None, location_ids=None):
+    from .models import SpaceTimeCell, Story
+
+    apply_links(Story, SpaceTimeCell, sign, story_ids, location_ids)
+
+
+def rebuild():
+    from .models import SpaceTimeCell, Story
+
+    return rebuild_cells(Story, SpaceTimeCell)
+
+
+def cube(bbox, start_year, end_year, step='year', zoom=RESOLUTION):
+    """
+    Story location counts in ``bbox`` from ``start_year`` to ``end_year``
+    as a dense array indexed by [bucket, row, column]. Buckets are years or
+    decades from the one holding ``start_year``, rows and columns the zoom
+    ``zoom`` tiles from the north west corner of ``bbox``, given back as
+    ``origin``.
+    """
+    if step not in SPANS:
+        raise ValidationError(f"step must be one of {', '.join(SPANS)}.")
+    if not 0 <= zoom <= RESOLUTION:
+        raise ValidationError(f'zoom must be between 0 and {RESOLUTION}.')
+    if start_year > end_year:
+        raise ValidationError('start must not be after end.')
+    from .models import SpaceTimeCell
+    from .tiles import tile_of
+
+    span = SPANS[step]
+    first = start_year - start_year % span
+    buckets = (end_year - first) // span + 1
+    shift = RESOLUTION - zoom
+
+    west, south, east, north = bbox
+    min_x, min_y = tile_of(west, north, RESOLUTION)
+    max_x, max_y = tile_of(east, south, RESOLUTION)
+    origin_x, origin_y = min_x >> shift, min_y >> shift
+    shape = (buckets, (max_y >> shift) - origin_y + 1, (max_x >> shift) - origin_x + 1)
+    if np.prod(shape) > MAX_CELLS:
+        raise ValidationError('Too many cells, zoom out or narrow the box or the years.')
+
+    rows = SpaceTimeCell.objects.filter(
+        span=span, start_year__range=(first, end_year),
+        x__range=(min_x, max_x), y__range=(min_y, max_y),
+    ).values_list('start_year', 'y', 'x', 'count')
+    cells = np.array(list(rows), dtype=np.int64).reshape(-1, 4)
+
+    counts = np.zeros(shape, dtype=np.int64)
+    # Fine cells falling in the same coarse cell add up
+    np.add.at(counts, (
+        (cells[:, 0] - first) // span,
+        (cells[:, 1] >> shift) - origin_y,
+        (cells[:, 2] >> shift) - origin_x,
+    ), cells[:, 3])
+    return {
+        'zoom': zoom,
+        'origin': [origin_x, origin_y],
+        'start': first,
+        'step': step,
+        'counts': counts,
+    }
@@ -0,0 +1,242 @@
+import json
+import math
+from datetime import timedelta
+from django.contrib.gis.db.models import GeometryField
+from django.contrib.gis.db.models.functions import GeometryDistance
+from django.contrib.gis.gdal import GDALException
+from django.contrib.gis.geos import GEOSException, GEOSGeometry, MultiPoint, Point, Polygon
+from django.contrib.gis.measure import D
+from django.core.exceptions import ValidationError
+from django.db.models import BooleanField, F, FloatField, Func, Q, Value
+from .dates import as_date, as_datetime, day_start
+from .geocode_jobs import geocode_target
+from .models import Location, Story
+from .search import stories_overlapping
+
+# Locations each geometry column offers per round of nearest_stories, and
+# the most it offers before giving up on finding enough stories
+NEAREST_BATCH = 20
+NEAREST_MAX_BATCH = 640
+
+# Longest distance a "near a point" search may cover
+MAX_DISTANCE = 500000
+
+# Meters in a degree of latitude, and of longitude at the equator
+METERS_PER_DEGREE = 111320.0
+
+
+def geography(expression):
+    return Func(expression, function='geography', output_field=GeometryField(geography=True))
+
+
+def within_meters(column, shape, meters):
+    # Exact ST_DWithin on the sphere, ``meters`` may be an expression
+    return Func(
+        geography(F(column)),
+        geography(Value(shape, output_field=GeometryField(srid=4326))),
+        meters,
+        function='ST_DWithin',
+        output_field=BooleanField(),
+    )
+
+
+def degrees(meters, shape):
+    """
+    A distance in degrees that covers ``meters`` everywhere around
+    ``shape``, for the degree based lookups the geometry indexes answer.
+    """
+    if not meters:
+        return 0
+    _, south, _, north = shape.extent
+    latitude = min(max(abs(south), abs(north)) + meters / METERS_PER_DEGREE, 89.0)
+    return meters / (METERS_PER_DEGREE * math.cos(math.radians(latitude)))
+
+
+def locations_near(shape, meters=0):
+    """
+    Locations within ``meters`` of ``shape``, or intersecting it when
+    ``meters`` is 0.
+
+    Every condition starts with a lookup the GiST index of its column can
+    answer and the exact distance on the sphere is only computed for the
+    rows it lets through. A point with a radius is searched by its circle,
+    the same way as an area.
+    """
+    points = Q(point__dwithin=(shape, degrees(meters, shape)), circle__isnull=True)
+    lines = Q(lines__dwithin=(shape, degrees(meters, shape)))
+    if meters:
+        points &= Q(within_meters('point', shape, Value(meters)))
+        lines &= Q(within_meters('lines', shape, Value(meters)))
+        areas = Q(area__dwithin=(shape, D(m=meters)))
+        circles = Q(circle__dwithin=(shape, D(m=meters)))
+    else:
+        areas = Q(area__intersects=shape)
+        circles = Q(circle__intersects=shape)
+
+    return Location.objects.filter(points | circles | lines | areas)
+
+
+def distance_meters(shape):
+    # Meters on the sphere between a location, whichever column it uses, and the shape
+    geometry = Func(
+        F('point'), Func(F('area'), function='geometry', output_field=GeometryField()), F('lines'),
+        function='COALESCE', output_field=GeometryField())
+    return Func(
+        geography(geometry),
+        geography(Value(shape, output_field=GeometryField(srid=4326))),
+        function='ST_Distance',
+        output_field=FloatField(),
+    )
+
+
+def nearest_locations(shape, count):
+    """
+    The ids of up to ``count`` locations per geometry column closest to
+    ``shape``, and whether every column ran out before ``count``. Each is a
+    KNN ``<->`` ordering the column's GiST index walks in distance order,
+    so only ``count`` rows are read per column.
+    """
+    target = Value(shape, output_field=GeometryField(srid=4326))
+    ids = []
+    exhausted = True
+    for column in ('point', 'area', 'lines'):
+        # The area column is geography, its operator needs a geography target
+        distance = GeometryDistance(column, geography(target) if column == 'area' else target)
+        column_ids = list(Location.objects.filter(**{f'{column}__isnull': False}).order_by(
+            distance).values_list('id', flat=True)[:count])
+        # A full column may hold more locations further away
+        exhausted = exhausted and len(column_ids) < count
+        ids += column_ids
+    return ids, exhausted
+
+
+def nearest_stories(shape, limit, exclude=()):
+    """
+    The ``limit`` stories closest to ``shape``, as ``(story, meters)`` pairs
+    nearest first, leaving out the stories in ``exclude``.
+
+    Candidate locations come from the KNN index scans and are ranked by
+    their exact distance, the scans are widened until they hold enough
+    other stories or NEAREST_MAX_BATCH is reached.
+    """
+    exclude = set(exclude)
+    count = NEAREST_BATCH
+    while True:
+        location_ids, exhausted = nearest_locations(shape, count)
+        distances = dict(Location.objects.filter(id__in=location_ids).annotate(
+            distance=distance_meters(shape)).values_list('id', 'distance'))
+
+        story_distances = {}
+        links = Story.locations.through.objects.filter(
+            location_id__in=location_ids).values_list('story_id', 'location_id')
+        for story_id, location_id in links:
+            if story_id in exclude:
+                continue
+            distance = distances[location_id]
+            if story_id not in story_distances or distance < story_distances[story_id]:
+                story_distances[story_id] = distance
+
+        enough = len(story_distances) >= limit
+        if enough or exhausted or count >= NEAREST_MAX_BATCH:
+            break
+        count *= 2
+
+    nearest = sorted(story_distances.items(), key=lambda item: item[1])[:limit]
+    stories = Story.objects.in_bulk([story_id for story_id, _ in nearest])
+    return [(stories[story_id], distance) for story_id, distance in nearest if story_id in stories]
+
+
+def story_shape(locations):
+    # The points standing for a story's locations, as one KNN target
+    points = [geocode_target(location) for location in locations]
+    points = [Point(point.x, point.y) for point in points if point is not None]
+    return MultiPoint(*points, srid=4326) if points else None
+
+
+def stories_near(shape, meters=0, stories=None):
+    # Stories with at least one location near the shape
+    if stories is None:
+        stories = Story.objects.all()
+    story_ids = Story.locations.through.objects.filter(
+        location__in=locations_near(shape, meters)).values('story_id')
+    return stories.filter(id__in=story_ids)
+
+
+def parse_bbox(value):
+    try:
+        west, south, east, north = (float(part) for part in value.split(','))
+    except ValueError:
+        raise ValidationError('bbox must be west,south,east,north.')
+    if not (-180 <= west <= 180 and -180 <= east <= 180 and -90 <= south < north <= 90):
+        raise ValidationError('bbox is out of range.')
+    if west > east:
+        raise ValidationError('bbox must not cross the antimeridian.')
+    shape = Polygon.from_bbox((west, south, east, north))
+    shape.srid = 4326
+    return shape
+
+
+def parse_polygon(value):
+    # A GeoJSON polygon geometry or a feature holding one
+    try:
+        data = json.loads(value)
+        if data.get('type') == 'Feature':
+            data = data['geometry']
+        shape = GEOSGeometry(json.dumps(data))
+    except (ValueError, TypeError, KeyError, AttributeError, GDALException, GEOSException):
+        # GeoJSON is read by GDAL, which rejects a geometry without coordinates
+        raise ValidationError('polygon must be a GeoJSON polygon.')
+    if shape.geom_type not in ('Polygon', 'MultiPolygon') or not shape.valid:
+        raise ValidationError('polygon must be a valid GeoJSON polygon.')
+    shape.srid = 4326
+    return shape
+
+
+def parse_point(lat, lon, distance):
+    try:
+        lat, lon, distance = float(lat), float(lon), float(distance)
+    except (TypeError, ValueError):
+        raise ValidationError('lat, lon and distance must be numbers.')
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValidationError('lat and lon are out of range.')
+    if not 0 <= distance <= MAX_DISTANCE:
+        raise ValidationError(f'distance must be between 0 and {MAX_DISTANCE} meters.')
+    return Point(lon, lat, srid=4326), distance
+
+
+def parse_moment(value, end=False):
+    # A date covers the whole day, a datetime is taken as is
+    try:
+        if 'T' in value:
+            moment = as_datetime(value)
+        else:
+            day = as_date(value)
+            moment = day and day_start(day + timedelta(days=1) if end else day)
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise ValidationError(f'{value} is not a date.')
+    return moment
+
+
+def spatial_stories(params):
+    """
+    Stories matching the query string of the spatial search endpoint: one
+    of ``bbox``, ``lat`` + ``lon`` + ``distance`` or ``polygon``, optionally
+    narrowed to those dated between ``start`` and ``end``.
+    """
+    if params.get('bbox'):
+        stories = stories_near(parse_bbox(params['bbox']))
+    elif params.get('polygon'):
+        stories = stories_near(parse_polygon(params['polygon']))
+    elif params.get('lat') or params.get('lon'):
+        stories = stories_near(*parse_point(params.get('lat'), params.get('lon'), params.get('distance', 0)))
+    else:
+        raise ValidationError('One of bbox, polygon or lat and lon is required.')
+
+    start, end = params.get('start'), params.get('end')
+    if start or end:
+        start = parse_moment(start) if start else None
+        end = parse_moment(end, end=True) if end else None
+        stories = stories_overlapping(start, end, stories)
+    return stories
@@ -0,0 +1,96 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from .geocode_jobs import enqueue, location_from_feature
+from .models import File, Location, Story
+from .places import find_places
+from .signals import refresh_once
+from .tags import get_or_create_tags
+
+# Geometry types a story location can be drawn as
+LOCATION_TYPES = ('Point', 'Polygon', 'LineString')
+
+# Story fields holding the date of each of the DATE_FORMAT_CHOICES
+DATE_FIELDS = {
+    1: 'date_exact',
+    2: ('date_range_start', 'date_range_end'),
+    3: 'decade',
+    4: 'exact_date_and_time',
+}
+
+DATE_ERRORS = {
+    1: 'Exact date is required.',
+    2: 'Start date and end date are required.',
+    3: 'Decade is required.',
+    4: 'Exact date and time is required.',
+}
+
+
+def location_features(features):
+    # The drawn features that become story locations
+    return [
+        feature for feature in features
+        if (feature.get('geometry') or {}).get('type') in LOCATION_TYPES
+    ]
+
+
+def validate_story(title, content, features, date_format, dates):
+    """
+    Check a new story before anything is geocoded or written, raises a
+    ValidationError with the message to show otherwise.
+    """
+    if not content:
+        raise ValidationError('Content is required.')
+    if not title:
+        raise ValidationError('Title is required.')
+    if not location_features(features):
+        raise ValidationError('At least one location is required.')
+    if date_format not in DATE_FIELDS:
+        raise ValidationError('Invalid date option.')
+
+    fields = DATE_FIELDS[date_format]
+    if isinstance(fields, str):
+        fields = (fields,)
+    if not all(dates.get(field) for field in fields):
+        raise ValidationError(DATE_ERRORS[date_format])
+
+
+def create_story(user, title, content, date_format, dates, features, tag_names=(), files=()):
+    """
+    Write a validated story with a location for each drawn feature, its
+    tags and its uploaded ``files`` in one transaction.
+
+    Related rows are inserted with one bulk query per model and each
+    relation's through rows with one more, so a story costs the same number
+    of queries whatever its number of locations, tags or files, and a
+    failure leaves nothing behind. Features drawn on an existing place are
+    linked to it, the names of new locations are placeholders until the
+    geocode worker resolves them. The story's search document and summary
+    are built once, after all its rows are in.
+    """
+    drawn = [location_from_feature(feature) for feature in location_features(features)]
+
+    with transaction.atomic(), refresh_once():
+        # Features on an existing place link to it instead of a new row
+        places = find_places([location for location, _ in drawn])
+        pending = [(location, prefix) for i, (location, prefix) in enumerate(drawn) if i not in places]
+        for location, _ in pending:
+            location.update_geojson()
+            location.update_circle()
+        Location.objects.bulk_create([location for location, _ in pending])
+        enqueue(pending)
+        locations = [places.get(i, location) for i, (location, _) in enumerate(drawn)]
+
+        tags = get_or_create_tags(tag_names)
+        file_objs = File.objects.bulk_create([File(file=file) for file in files])
+
+        story = Story(user=user, title=title, content=content, date_format=date_format, **dates)
+        story.save()
+
+        # add() inserts all through rows of a relation at once and still
+        # sends m2m_changed, which keeps the search document current
+        story.locations.add(*locations)
+        if tags:
+            story.tags.add(*tags)
+        if file_objs:
+            story.files.add(*file_objs)
+    return story
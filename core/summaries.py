@@ -0,0 +1,71 @@
+import os
+from html import unescape
+from django.db import transaction
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
+
+# Characters of plain text a feed card shows of a story's content
+EXCERPT_LENGTH = 300
+
+# Stories summarized per query by update_story_summaries
+BATCH_SIZE = 500
+
+DEFAULT_AVATAR_URL = '/media/blank-profile-picture.png'
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'}
+
+
+def avatar_url(profile):
+    if profile is None or not profile.profile_image:
+        return DEFAULT_AVATAR_URL
+    return profile.profile_image.url
+
+
+def file_entry(file):
+    # Images are shown as their own thumbnail, other files only linked
+    url = file.file.url
+    is_image = os.path.splitext(file.file.name)[1].lower() in IMAGE_EXTENSIONS
+    return {'url': url, 'thumbnail': url if is_image else None}
+
+
+def story_summary(story, profile):
+    """
+    Everything a feed card shows of a story besides the story row itself,
+    as a JSON document. The story's tags, locations and files should be
+    prefetched.
+    """
+    locations = [location.name for location in story.locations.all()]
+    content = unescape(strip_tags(story.content or ''))
+    return {
+        'username': story.user.username,
+        'profile_id': profile.id if profile is not None else None,
+        'avatar_url': avatar_url(profile),
+        'tags': [tag.name for tag in story.tags.all()],
+        'first_location': locations[0] if locations else None,
+        'location_count': len(locations),
+        'locations': locations,
+        'files': [file_entry(file) for file in story.files.all()],
+        'excerpt': Truncator(' '.join(content.split())).chars(EXCERPT_LENGTH),
+    }
+
+
+def update_story_summaries(Story, story_ids, batch_size=BATCH_SIZE):
+    """
+    Rebuild the summary of the given stories in the current transaction.
+    Takes the model so migrations can pass their historical one.
+    """
+    story_ids = list(story_ids)
+    with transaction.atomic():
+        for start in range(0, len(story_ids), batch_size):
+            stories = Story.objects.filter(
+                id__in=story_ids[start:start + batch_size]
+            ).select_related('user__profile').prefetch_related('tags', 'locations', 'files')
+            for story in stories:
+                profile = getattr(story.user, 'profile', None)
+                Story.objects.filter(id=story.id).update(summary=story_summary(story, profile))
+
+
+def update_summaries(story_ids):
+    from .models import Story
+
+    update_story_summaries(Story, story_ids)
@@ -0,0 +1,86 @@
+from collections import defaultdict
+
+# Tags merged or linked per query by merge_duplicate_tags
+BATCH_SIZE = 500
+
+
+def clean_tag_name(name):
+    # The name shown on cards, with runs of whitespace collapsed
+    return ' '.join(name.split())
+
+
+def normalize_tag_name(name):
+    """The key a tag is unique on, "Istanbul " and "istanbul" share one tag"""
+    return clean_tag_name(name).casefold()
+
+
+def get_or_create_tags(names):
+    """
+    The canonical Tag of every name in ``names``, in their order and without
+    duplicates. Missing tags are inserted with one bulk upsert and the whole
+    set is read back with one query, whatever the number of names.
+    """
+    from .models import Tag
+
+    cleaned = {}
+    for name in names:
+        name = clean_tag_name(name or '')
+        if name:
+            cleaned.setdefault(normalize_tag_name(name), name)
+    if not cleaned:
+        return []
+
+    # The first spelling of a new tag becomes its display name
+    Tag.objects.bulk_create(
+        [Tag(name=name, normalized_name=key) for key, name in cleaned.items()],
+        ignore_conflicts=True)
+    tags = Tag.objects.in_bulk(list(cleaned), field_name='normalized_name')
+    return [tags[key] for key in cleaned]
+
+
+def merge_duplicate_tags(Tag, Story, batch_size=BATCH_SIZE):
+    """
+    Merge tags whose names normalize to the same key into one, moving their
+    Story.tags links to the kept tag in batches, then store every tag's
+    normalized name. Takes the models so migrations can pass their historical
+    ones. Returns the number of tags removed and the ids of the stories whose
+    tags moved.
+    """
+    Through = Story.tags.through
+
+    groups = defaultdict(list)
+    tags = Tag.objects.values_list('id', 'name', 'normalized_name').order_by('name', 'id')
+    for tag_id, name, normalized_name in tags.iterator():
+        key = normalize_tag_name(name)
+        # A tag already stored under its key is the one kept
+        if normalized_name == key:
+            groups[key].insert(0, tag_id)
+        else:
+            groups[key].append(tag_id)
+
+    # Every duplicate tag id mapped to the id of the tag kept in its place
+    keep = {}
+    for tag_ids in groups.values():
+        for tag_id in tag_ids[1:]:
+            keep[tag_id] = tag_ids[0]
+
+    duplicate_ids = list(keep)
+    story_ids = set()
+    for start in range(0, len(duplicate_ids), batch_size):
+        batch = duplicate_ids[start:start + batch_size]
+        links = {
+            (story_id, keep[tag_id])
+            for story_id, tag_id in Through.objects.filter(
+                tag_id__in=batch).values_list('story_id', 'tag_id')
+        }
+        Through.objects.bulk_create(
+            [Through(story_id=story_id, tag_id=tag_id) for story_id, tag_id in links],
+            ignore_conflicts=True)
+        story_ids.update(story_id for story_id, _ in links)
+        Through.objects.filter(tag_id__in=batch).delete()
+        Tag.objects.filter(id__in=batch).delete()
+
+    kept = {tag_ids[0]: key for key, tag_ids in groups.items()}
+    tags = [Tag(id=tag_id, normalized_name=key) for tag_id, key in kept.items()]
+    Tag.objects.bulk_update(tags, ['normalized_name'], batch_size=batch_size)
+    return len(duplicate_ids), story_ids
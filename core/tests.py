@@ -1,18 +1,44 @@
 import datetime
+import io
+import json
+import math
+import os
+import shutil
+import tempfile
 from urllib.parse import unquote
 import uuid
-from django.db import IntegrityError
+from unittest import mock
+from django.core.cache import cache
+from django.db import IntegrityError, connection
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.test import TestCase, Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from memorycloud.settings import AUTH_PASSWORD_VALIDATORS
 from .models import Follower, Like, Story, Tag, Location, Comment
-from .models import Profile
+from .models import GeocodeCacheEntry, GeocodeJob, HeatmapBin, Profile, SpaceTimeCell, TimelineEntry
 from .forms import StoryForm
 from django.contrib.auth.models import User
+from django.contrib.gis.geos import LineString, Point, Polygon
+from django.core.exceptions import ValidationError
+from geopy.exc import GeocoderTimedOut
 from django.utils import timezone
 from django.db.models import QuerySet
 from core.views import search
+from core.dates import query_bounds
+from core.search import search_profiles, search_stories, stories_overlapping
+from core.timeline import get_timeline
+from core.cards import get_liked_story_ids, load_story_cards
+from core import autocomplete, card_cache, counters, geocode_jobs, geocoding, heatmap, nearby, spacetime, tiles
+from core.pagination import PAGE_SIZE, decode_cursor, paginate_stories
+from core.tags import get_or_create_tags
+from core.stories import create_story, validate_story
+from core.summaries import EXCERPT_LENGTH
+from core.spatial import nearest_stories, stories_near
+from core.geometry import circle_bbox, simplified_geojson
+from core.places import find_places
 from django.http import HttpRequest
 
 # Create your tests here.
@@ -233,12 +259,10 @@ class LikePostViewTestCase(TestCase):
             new_like = Like.objects.create(story=self.story, user=self.user)
             new_like.save()
             self.story.no_of_likes += 1
-            self.story.is_liked_by_current_user = True
             self.story.save()
         else:
             like_filter.delete()
             self.story.no_of_likes -= 1
-            self.story.is_liked_by_current_user = False
             self.story.save()
         self.assertRedirects(response, '/')
 
@@ -461,3 +485,1194 @@ class SignupTestCase(TestCase):
         self.assertEqual(profile.first_name, data['First Name'])
         self.assertEqual(profile.last_name, data['Last Name'])
 
+
+class TimelineTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+        username='testuser', email='testuser@example.com', password='testpass')
+        self.author = User.objects.create_user(
+        username='author', email='author@example.com', password='testpass')
+
+    def test_story_fanned_out_to_followers(self):
+        Follower.objects.create(user=self.author, follower=self.user)
+        story = Story.objects.create(title='Test Story', user=self.author)
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.user, story=story).exists())
+        self.assertListEqual(get_timeline(self.user), [story])
+
+    def test_follow_backfills_and_unfollow_clears(self):
+        story = Story.objects.create(title='Test Story', user=self.author)
+        follow = Follower.objects.create(user=self.author, follower=self.user)
+        self.assertListEqual(get_timeline(self.user), [story])
+        follow.delete()
+        self.assertListEqual(get_timeline(self.user), [])
+
+    def test_follow_backfills_every_story(self):
+        stories = [Story.objects.create(title=f'Story {i}', user=self.author) for i in range(5)]
+        with mock.patch('core.timeline.BATCH_SIZE', 2):
+            Follower.objects.create(user=self.author, follower=self.user)
+        self.assertSetEqual(set(get_timeline(self.user)), set(stories))
+
+    def test_delete_story_removes_entry(self):
+        Follower.objects.create(user=self.author, follower=self.user)
+        story = Story.objects.create(title='Test Story', user=self.author)
+        story.delete()
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user).exists())
+
+    def test_big_authors_merged_at_read_time(self):
+        with mock.patch('core.timeline.FANOUT_FOLLOWER_LIMIT', 0):
+            Follower.objects.create(user=self.author, follower=self.user)
+            story = Story.objects.create(title='Test Story', user=self.author)
+            self.assertFalse(TimelineEntry.objects.filter(owner=self.user).exists())
+            self.assertListEqual(get_timeline(self.user), [story])
+
+    def test_authors_crossing_the_limit(self):
+        other = User.objects.create_user(
+        username='other', email='other@example.com', password='testpass')
+        with mock.patch('core.timeline.FANOUT_FOLLOWER_LIMIT', 1):
+            Follower.objects.create(user=self.author, follower=self.user)
+            old_story = Story.objects.create(title='Old Story', user=self.author)
+            follow = Follower.objects.create(user=self.author, follower=other)
+            self.assertFalse(TimelineEntry.objects.filter(story__user=self.author).exists())
+            story = Story.objects.create(title='Test Story', user=self.author)
+            self.assertListEqual(get_timeline(self.user), [story, old_story])
+
+            # Back under the limit, the stories are in the timeline again
+            follow.delete()
+            self.assertEqual(self.author.follower_count.count, 1)
+            self.assertSetEqual(set(TimelineEntry.objects.filter(owner=self.user).values_list(
+                'story', flat=True)), {story.id, old_story.id})
+            self.assertListEqual(get_timeline(self.user), [story, old_story])
+
+class StoryCardTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+        username='testuser', email='testuser@example.com', password='testpass')
+        self.user_profile = Profile.objects.create(user=self.user)
+        self.client.login(username='testuser', password='testpass')
+
+    def create_stories(self, count):
+        for i in range(count):
+            author = User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@example.com')
+            Profile.objects.create(user=author, username=f'author{i}', email=f'author{i}@example.com')
+            story = Story.objects.create(title=f'Story {i}', user=author)
+            story.tags.add(Tag.objects.create(name=f'tag{i}'))
+            story.locations.add(Location.objects.create(name=f'Place {i}'),
+                                Location.objects.create(name=f'Other place {i}'))
+
+    def test_load_story_cards_query_count(self):
+        self.create_stories(5)
+        # Only the stories, the rest is in the story summaries
+        with self.assertNumQueries(1):
+            cards = load_story_cards(Story.objects.all())
+            for card in cards:
+                self.assertIsNotNone(card.profile)
+                self.assertEqual(card.location_count, 2)
+                self.assertEqual(len(card.tags), 1)
+                self.assertEqual(card.username, 'author' + card.story.title[len('Story '):])
+                self.assertEqual(card.profile.user_id, card.story.user_id)
+
+    def test_discover_query_count_does_not_grow(self):
+        self.create_stories(1)
+        with CaptureQueriesContext(connection) as small_page:
+            self.client.get(reverse('discover'))
+        for i in range(1, 20):
+            author = User.objects.create_user(
+                username=f'more{i}', email=f'more{i}@example.com')
+            Profile.objects.create(user=author, username=f'more{i}', email=f'more{i}@example.com')
+            Story.objects.create(title=f'More {i}', user=author).locations.add(
+                Location.objects.create(name=f'More place {i}'))
+        with CaptureQueriesContext(connection) as large_page:
+            response = self.client.get(reverse('discover'))
+        self.assertEqual(len(response.context['story_profile_list']), 20)
+        self.assertEqual(len(large_page), len(small_page))
+
+class FeedPaginationTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+        username='testuser', email='testuser@example.com', password='testpass')
+        self.user_profile = Profile.objects.create(user=self.user)
+        self.client.login(username='testuser', password='testpass')
+        self.author = User.objects.create_user(
+        username='author', email='author@example.com', password='testpass')
+        Profile.objects.create(user=self.author, username='author', email='author@example.com')
+        self.stories = [Story.objects.create(title=f'Story {i}', user=self.author)
+                        for i in range(PAGE_SIZE + 5)]
+
+    def test_discover_first_page(self):
+        response = self.client.get(reverse('discover'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['story_profile_list']), PAGE_SIZE)
+        self.assertIsNotNone(response.context['next_cursor'])
+
+    def test_feed_page_returns_the_rest(self):
+        response = self.client.get(reverse('discover'))
+        first_page = [card.story for card in response.context['story_profile_list']]
+        cursor = response.context['next_cursor']
+
+        response = self.client.get(reverse('feed-page', args=['discover']), {'cursor': cursor})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertIsNone(data['next_cursor'])
+
+        second_page, next_cursor = paginate_stories(Story.objects.all(), cursor)
+        self.assertEqual(len(second_page), 5)
+        self.assertIsNone(next_cursor)
+        self.assertFalse(set(first_page) & set(second_page))
+        for story in second_page:
+            self.assertIn(str(story.id), data['html'])
+
+    def test_later_pages_render_cards_like_the_first(self):
+        Follower.objects.create(user=self.author, follower=self.user)
+        for feed in ('index', 'discover'):
+            first = self.client.get(reverse(feed))
+            cards = len(first.context['story_profile_list'])
+            first_html = first.content.decode()
+            response = self.client.get(reverse('feed-page', args=[feed]), {'cursor': first.context['next_cursor']})
+            rest_html = response.json()['html']
+            # Every card has the comment form and a single details link
+            for html, count in ((first_html, cards), (rest_html, 5)):
+                self.assertEqual(html.count('data-comment-story='), count)
+                self.assertEqual(html.count('See Details'), count)
+            Follower.objects.filter(follower=self.user).delete()
+
+    def test_invalid_cursor_starts_over(self):
+        self.assertIsNone(decode_cursor('not-a-cursor'))
+        page, next_cursor = paginate_stories(Story.objects.all(), 'not-a-cursor')
+        self.assertEqual(len(page), PAGE_SIZE)
+
+    def test_unknown_feed(self):
+        response = self.client.get(reverse('feed-page', args=['unknown']))
+        self.assertEqual(response.status_code, 404)
+
+class LikeStateTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+        username='testuser', email='testuser@example.com', password='testpass')
+        self.other = User.objects.create_user(
+        username='other', email='other@example.com', password='testpass')
+        self.story = Story.objects.create(title='Test Story', user=self.other)
+        Like.objects.create(story=self.story, user=self.user)
+
+    def test_like_state_is_per_viewer(self):
+        self.assertTrue(load_story_cards([self.story], viewer=self.user)[0].liked)
+        self.assertFalse(load_story_cards([self.story], viewer=self.other)[0].liked)
+
+    def test_liked_ids_in_one_query(self):
+        stories = [self.story] + [Story.objects.create(title=f'Story {i}', user=self.other) for i in range(5)]
+        with self.assertNumQueries(1):
+            liked_ids = get_liked_story_ids(self.user, [story.id for story in stories])
+        self.assertSetEqual(liked_ids, {self.story.id})
+
+class EngagementApiTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+        username='testuser', email='testuser@example.com', password='testpass')
+        self.user_profile = Profile.objects.create(user=self.user)
+        self.story = Story.objects.create(title='Test Story', user=self.user)
+        self.client.login(username='testuser', password='testpass')
+
+    def test_like_toggle(self):
+        url = reverse('like-post-api')
+        response = self.client.post(url, {'story_id': self.story.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['liked'], True)
+        self.assertEqual(response.json()['no_of_likes'], 1)
+
+        response = self.client.post(url, {'story_id': self.story.id})
+        self.assertEqual(response.json()['liked'], False)
+        self.assertEqual(response.json()['no_of_likes'], 0)
+        self.assertFalse(Like.objects.filter(story=self.story).exists())
+
+    def test_comment(self):
+        url = reverse('comment-post-api')
+        response = self.client.post(url, {'story_id': self.story.id, 'comment': 'Test Comment'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['no_of_comments'], 1)
+        self.assertEqual(response.json()['comment']['content'], 'Test Comment')
+        counters.flush()
+        self.story.refresh_from_db()
+        self.assertEqual(self.story.no_of_comments, 1)
+
+    def test_missing_story(self):
+        response = self.client.post(reverse('like-post-api'), {'story_id': uuid.uuid4()})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post(reverse('comment-post-api'), {'story_id': 'not-a-uuid', 'comment': 'Test'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_get_not_allowed(self):
+        response = self.client.get(reverse('like-post-api'), {'story_id': self.story.id})
+        self.assertEqual(response.status_code, 405)
+
+class CounterBufferTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+        username='testuser', email='testuser@example.com', password='testpass')
+        self.story = Story.objects.create(title='Test Story', user=self.user)
+        self.buffer = counters.LocalCounterBuffer()
+        patcher = mock.patch('core.counters.buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_merge_pending_deltas(self):
+        counters.record(self.story.id, 'no_of_likes', 1)
+        counters.record(self.story.id, 'no_of_likes', 1)
+        self.story.refresh_from_db()
+        self.assertEqual(self.story.no_of_likes, 0)
+        self.assertEqual(counters.current_count(self.story.id, 'no_of_likes'), 2)
+        self.assertEqual(load_story_cards([self.story])[0].story.no_of_likes, 2)
+
+    def test_flush_writes_deltas(self):
+        counters.record(self.story.id, 'no_of_likes', 3)
+        counters.record(self.story.id, 'no_of_comments', 1)
+        counters.record(self.story.id, 'no_of_likes', -1)
+        self.assertEqual(counters.flush(), 1)
+        self.story.refresh_from_db()
+        self.assertEqual(self.story.no_of_likes, 2)
+        self.assertEqual(self.story.no_of_comments, 1)
+        self.assertEqual(self.buffer.pending([self.story.id]), {})
+
+    def test_cache_buffer(self):
+        cache_buffer = counters.CacheCounterBuffer(prefix='test-counters')
+        with mock.patch('core.counters.buffer', cache_buffer):
+            counters.record(self.story.id, 'no_of_comments', 2)
+            counters.record(self.story.id, 'no_of_comments', -1)
+            self.assertEqual(counters.current_count(self.story.id, 'no_of_comments'), 1)
+            counters.flush()
+        self.story.refresh_from_db()
+        self.assertEqual(self.story.no_of_comments, 1)
+
+    def test_reconcile_counters(self):
+        Like.objects.create(story=self.story, user=self.user)
+        Story.objects.filter(id=self.story.id).update(no_of_likes=7, no_of_comments=3)
+        with mock.patch('core.counters.buffer', None):
+            call_command('reconcile_counters', stdout=io.StringIO())
+        self.story.refresh_from_db()
+        self.assertEqual(self.story.no_of_likes, 1)
+        self.assertEqual(self.story.no_of_comments, 0)
+
+    def test_reconcile_refuses_a_process_local_buffer(self):
+        counters.record(self.story.id, 'no_of_likes', 1)
+        with self.assertRaises(CommandError):
+            call_command('reconcile_counters', stdout=io.StringIO())
+        # The default cache is local memory, a separate one in every process
+        with mock.patch('core.counters.buffer', counters.CacheCounterBuffer(prefix='test-counters')):
+            self.assertTrue(counters.is_process_local())
+            with self.assertRaises(CommandError):
+                call_command('reconcile_counters', stdout=io.StringIO())
+
+    def test_cache_buffer_flushes_once_at_a_time(self):
+        cache_buffer = counters.CacheCounterBuffer(prefix='test-counters')
+        with mock.patch('core.counters.buffer', cache_buffer):
+            counters.record(self.story.id, 'no_of_likes', 2)
+            cache_buffer.cache.add('test-counters:flush_lock', 1)
+            self.assertEqual(counters.flush(), 0)
+            cache_buffer.cache.delete('test-counters:flush_lock')
+            self.assertEqual(counters.flush(), 1)
+        self.story.refresh_from_db()
+        self.assertEqual(self.story.no_of_likes, 2)
+
+class FullTextSearchTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+        username='testuser', email='testuser@example.com', password='testpass')
+        self.user_profile = Profile.objects.create(user=self.user)
+        self.client.login(username='testuser', password='testpass')
+        self.title_story = Story.objects.create(
+            title='Galata bridge', content='<p>Fishing at dawn</p>', user=self.user)
+        self.content_story = Story.objects.create(
+            title='Summer', content='<p>We walked to the <b>galata</b> tower</p>', user=self.user)
+
+    def test_ranked_by_weight(self):
+        stories = list(search_stories('galata').order_by('-rank'))
+        self.assertListEqual(stories, [self.title_story, self.content_story])
+
+    def test_matches_tags_and_locations(self):
+        self.content_story.tags.add(Tag.objects.create(name='ferry'))
+        location = Location.objects.create(name='Karakoy')
+        self.title_story.locations.add(location)
+        self.assertListEqual(list(search_stories('ferry')), [self.content_story])
+        self.assertListEqual(list(search_stories('karakoy')), [self.title_story])
+
+        location.name = 'Eminonu'
+        location.save()
+        self.assertListEqual(list(search_stories('karakoy')), [])
+        self.assertListEqual(list(search_stories('eminonu')), [self.title_story])
+
+    def test_search_view(self):
+        response = self.client.get(reverse('search'), {'query': 'fishing'})
+        self.assertEqual(response.status_code, 200)
+        self.assertListEqual(response.context['stories'], [self.title_story])
+
+class ProfileSearchTestCase(TestCase):
+    def setUp(self):
+        for username, first_name, last_name in [('johnsmith', 'John', 'Smith'),
+                                                ('ayse', 'Ayse', 'Yilmaz'),
+                                                ('mehmet', 'Mehmet', 'Demir')]:
+            user = User.objects.create_user(
+                username=username, email=f'{username}@example.com', password='testpass')
+            Profile.objects.create(user=user, username=username, email=f'{username}@example.com',
+                                   first_name=first_name, last_name=last_name)
+
+    def test_typo_tolerant(self):
+        profiles = search_profiles('jonhsmith')
+        self.assertEqual(profiles[0].username, 'johnsmith')
+        self.assertNotIn('mehmet', [profile.username for profile in profiles])
+
+    def test_limit_and_threshold(self):
+        self.assertEqual(len(search_profiles('yilmaz', limit=1)), 1)
+        self.assertListEqual(search_profiles('yilmaz', threshold=0.99), [])
+
+class DateIntervalTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+        username='testuser', email='testuser@example.com', password='testpass')
+
+    def test_interval_for_each_date_format(self):
+        exact = Story.objects.create(title='Exact', user=self.user, date_format=1, date_exact='1985-06-01')
+        date_range = Story.objects.create(title='Range', user=self.user, date_format=2,
+                                          date_range_start='1979-12-01', date_range_end='1980-01-15')
+        decade = Story.objects.create(title='Decade', user=self.user, date_format=3, decade='1990s')
+        moment = Story.objects.create(title='Moment', user=self.user, date_format=4,
+                                      exact_date_and_time='2001-09-01T10:30')
+
+        utc = datetime.timezone.utc
+        self.assertEqual(exact.date_interval.lower, datetime.datetime(1985, 6, 1, tzinfo=utc))
+        self.assertEqual(exact.date_interval.upper, datetime.datetime(1985, 6, 2, tzinfo=utc))
+        self.assertEqual(date_range.date_interval.upper, datetime.datetime(1980, 1, 16, tzinfo=utc))
+        self.assertEqual(decade.date_interval.lower, datetime.datetime(1990, 1, 1, tzinfo=utc))
+        self.assertEqual(decade.date_interval.upper, datetime.datetime(2000, 1, 1, tzinfo=utc))
+        self.assertEqual(moment.date_interval.lower, datetime.datetime(2001, 9, 1, 10, 30, tzinfo=utc))
+
+    def test_last_year_and_decade_have_no_interval(self):
+        self.assertIsNone(query_bounds('9999'))
+        self.assertIsNone(query_bounds('9990s'))
+        self.assertIsNotNone(query_bounds('9998'))
+        self.assertIsNotNone(query_bounds('9980s'))
+        story = Story.objects.create(title='Far future', user=self.user, date_format=3, decade='9990s')
+        self.assertIsNone(story.date_interval)
+        last_day = Story.objects.create(title='Last day', user=self.user, date_format=1, date_exact='9999-12-31')
+        self.assertIsNone(last_day.date_interval)
+
+        Profile.objects.create(user=self.user)
+        self.client.login(username='testuser', password='testpass')
+        self.assertEqual(self.client.get(reverse('search'), {'query': '9999'}).status_code, 200)
+
+    def test_stories_overlapping(self):
+        inside = Story.objects.create(title='Inside', user=self.user, date_format=1, date_exact='1985-06-01')
+        spanning = Story.objects.create(title='Spanning', user=self.user, date_format=2,
+                                        date_range_start='1979-12-01', date_range_end='1980-01-15')
+        Story.objects.create(title='Outside', user=self.user, date_format=3, decade='1990s')
+        Story.objects.create(title='Undated', user=self.user, date_format=3)
+
+        utc = datetime.timezone.utc
+        stories = stories_overlapping(datetime.datetime(1980, 1, 1, tzinfo=utc),
+                                      datetime.datetime(1990, 1, 1, tzinfo=utc))
+        self.assertSetEqual(set(stories), {inside, spanning})
+        self.assertSetEqual(set(search_stories('1980s')), {inside, spanning})
+        self.assertListEqual(list(search_stories('1985')), [inside])
+
+class AutocompleteTestCase(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+        username='testuser', email='testuser@example.com', password='testpass')
+        self.client.login(username='testuser', password='testpass')
+        Profile.objects.create(user=self.user, username='testuser', email='testuser@example.com')
+        self.sea = Tag.objects.create(name='Sea')
+        self.seaside = Tag.objects.create(name='Seaside')
+        Tag.objects.create(name='Mountain')
+        for title in ['First', 'Second']:
+            story = Story.objects.create(title=title, user=self.user, date_format=1)
+            story.tags.add(self.seaside)
+        # The refresh thread reads outside the test's transaction
+        patcher = mock.patch.object(autocomplete, 'start_refresh')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        autocomplete.build()
+
+    def test_prefix_index_ranking(self):
+        index = autocomplete.PrefixIndex()
+        index.build([('Sea', 1), ('Seaside', 5), ('season', 1), ('Mountain', 9)])
+        self.assertListEqual(index.search('sea'), [('Seaside', 5), ('Sea', 1), ('season', 1)])
+        self.assertListEqual(index.search('SEA', limit=1), [('Seaside', 5)])
+        self.assertListEqual(index.search('x'), [])
+
+        index.add('Seashell', 7)
+        index.remove('Seaside')
+        self.assertListEqual(index.search('se', limit=2), [('Seashell', 7), ('Sea', 1)])
+
+    def test_deleted_stories_are_not_counted(self):
+        Story.objects.filter(title='First').delete()
+        self.assertListEqual(autocomplete.autocomplete('seas', kinds=['tags']),
+                             [{'type': 'tags', 'name': 'Seaside', 'count': 1}])
+
+    def test_signals_keep_index_current(self):
+        story = Story.objects.create(title='Third', user=self.user, date_format=1)
+        story.tags.add(self.sea)
+        story.tags.add(Tag.objects.create(name='Seagull'))
+        self.assertIn({'type': 'tags', 'name': 'Seagull', 'count': 1},
+                      autocomplete.autocomplete('seag'))
+
+        self.sea.name = 'Ocean'
+        self.sea.save()
+        self.assertListEqual(autocomplete.autocomplete('ocean', kinds=['tags']),
+                             [{'type': 'tags', 'name': 'Ocean', 'count': 1}])
+        self.assertListEqual(autocomplete.autocomplete('sea', kinds=['tags']),
+                             [{'type': 'tags', 'name': 'Seaside', 'count': 2},
+                              {'type': 'tags', 'name': 'Seagull', 'count': 1}])
+
+    def test_requests_read_the_index_as_it_is(self):
+        Tag.objects.create(name='Seal')
+        Tag.objects.filter(name='Seal').update(name='Seals')
+        autocomplete.invalidate()
+        with self.assertNumQueries(0):
+            names = [result['name'] for result in autocomplete.autocomplete('seal')]
+        self.assertListEqual(names, ['Seal'])
+
+        autocomplete.refresh()
+        self.assertListEqual([result['name'] for result in autocomplete.autocomplete('seal')], ['Seals'])
+
+    def test_autocomplete_view(self):
+        response = self.client.get(reverse('autocomplete'), {'q': 'sea', 'type': 'tags'})
+        self.assertEqual(response.status_code, 200)
+        names = [result['name'] for result in response.json()['results']]
+        self.assertListEqual(names, ['Seaside', 'Sea'])
+
+        response = self.client.get(reverse('autocomplete'), {'q': 'test'})
+        self.assertIn('testuser', [result['name'] for result in response.json()['results']])
+
+class TagNormalizationTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+        username='testuser', email='testuser@example.com', password='testpass')
+        Profile.objects.create(user=self.user, username='testuser', email='testuser@example.com')
+        self.client.login(username='testuser', password='testpass')
+
+    def test_get_or_create_tags(self):
+        istanbul = Tag.objects.create(name='Istanbul')
+        with self.assertNumQueries(2):
+            tags = get_or_create_tags(['istanbul ', 'Sea  side', 'ISTANBUL', 'sea side', ''])
+        self.assertListEqual(tags, [istanbul, Tag.objects.get(normalized_name='sea side')])
+        self.assertEqual(tags[1].name, 'Sea side')
+        self.assertEqual(Tag.objects.count(), 2)
+
+    def test_new_post_reuses_tags(self):
+        Tag.objects.create(name='Istanbul')
+        data = {
+            'title': 'Test Title',
+            'content': 'Test Content',
+            'date_option': 'exact_date',
+            'exact_date': '2022-01-01',
+            'tags': '[{"value": "istanbul"}, {"value": "Bosphorus"}]',
+            'features': '[{"geometry": {"type": "Point", "coordinates": [29.0, 41.0]}}]'
+        }
+        self.client.post(reverse('newpost'), data)
+        self.client.post(reverse('newpost'), data)
+
+        self.assertEqual(Tag.objects.count(), 2)
+        for story in Story.objects.filter(title='Test Title'):
+            self.assertSetEqual({tag.name for tag in story.tags.all()}, {'Istanbul', 'Bosphorus'})
+
+    def test_merge_duplicate_tags(self):
+        kept = Tag.objects.create(name='Istanbul')
+        duplicate = Tag.objects.create(name='placeholder')
+        # Rows written before names were normalized
+        Tag.objects.filter(id=duplicate.id).update(name='istanbul ', normalized_name='old')
+        both = Story.objects.create(title='Both', user=self.user, date_format=1)
+        both.tags.add(kept, duplicate)
+        only_duplicate = Story.objects.create(title='Duplicate', user=self.user, date_format=1)
+        only_duplicate.tags.add(duplicate)
+
+        version = autocomplete.current_version()
+        out = io.StringIO()
+        call_command('merge_duplicate_tags', stdout=out)
+        self.assertIn('Merged 1 duplicate tags', out.getvalue())
+        self.assertListEqual(list(Tag.objects.all()), [kept])
+        self.assertListEqual(list(both.tags.all()), [kept])
+        self.assertListEqual(list(only_duplicate.tags.all()), [kept])
+        # The moved links are in the summaries
+        only_duplicate.refresh_from_db()
+        self.assertListEqual(only_duplicate.summary['tags'], ['Istanbul'])
+        self.assertNotEqual(autocomplete.current_version(), version)
+
+class StoryCreationTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+        username='testuser', email='testuser@example.com', password='testpass')
+        self.dates = {'date_exact': '2022-01-01', 'date_range_start': None, 'date_range_end': None,
+                      'decade': None, 'exact_date_and_time': None}
+
+    def create(self, count, prefix):
+        features = [{'geometry': {'type': 'Point', 'coordinates': [29.0, 41.0 + i]}} for i in range(count)]
+        tag_names = [f'{prefix}{i}' for i in range(count)]
+        with CaptureQueriesContext(connection) as queries:
+            story = create_story(self.user, 'Title', 'Content', 1, self.dates, features, tag_names)
+        return story, len(queries)
+
+    def test_constant_queries(self):
+        story, one = self.create(1, 'a')
+        _, ten = self.create(10, 'b')
+        self.assertEqual(one, ten)
+        self.assertEqual(story.locations.count(), 1)
+        self.assertEqual(story.tags.count(), 1)
+
+    def test_failure_leaves_nothing(self):
+        with mock.patch('core.stories.get_or_create_tags', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.create(3, 'a')
+        self.assertFalse(Location.objects.exists())
+        self.assertFalse(Story.objects.exists())
+
+    def test_validate_story(self):
+        features = [{'geometry': {'type': 'Point', 'coordinates': [29.0, 41.0]}}]
+        validate_story('Title', 'Content', features, 1, self.dates)
+        with self.assertRaisesMessage(ValidationError, 'At least one location is required.'):
+            validate_story('Title', 'Content', [], 1, self.dates)
+        with self.assertRaisesMessage(ValidationError, 'Decade is required.'):
+            validate_story('Title', 'Content', features, 3, self.dates)
+
+class GeocodeCacheTestCase(TestCase):
+    def setUp(self):
+        geocoding.lru.clear()
+        patcher = mock.patch('core.geocoding.nominatim_reverse', return_value='Kadikoy, Istanbul')
+        self.nominatim = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_nearby_points_share_a_lookup(self):
+        before = geocoding.get_stats()
+        self.assertEqual(geocoding.reverse_geocode(40.99012, 29.02301), 'Kadikoy, Istanbul')
+        self.assertEqual(geocoding.reverse_geocode(40.99018, 29.02297), 'Kadikoy, Istanbul')
+        self.assertEqual(self.nominatim.call_count, 1)
+        self.assertEqual(GeocodeCacheEntry.objects.count(), 1)
+
+        after = geocoding.get_stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['memory_hits'] - before['memory_hits'], 1)
+
+        # Another process only has the table
+        geocoding.lru.clear()
+        self.assertEqual(geocoding.reverse_geocode(40.99012, 29.02301), 'Kadikoy, Istanbul')
+        self.assertEqual(self.nominatim.call_count, 1)
+        self.assertEqual(geocoding.get_stats()['database_hits'] - after['database_hits'], 1)
+
+    def test_stale_names_are_refreshed(self):
+        geocoding.reverse_geocode(40.99, 29.02)
+        GeocodeCacheEntry.objects.update(fetched_at=timezone.now() - datetime.timedelta(days=365))
+        geocoding.lru.clear()
+
+        self.nominatim.return_value = 'Moda, Istanbul'
+        self.assertEqual(geocoding.reverse_geocode(40.99, 29.02), 'Moda, Istanbul')
+        self.assertEqual(GeocodeCacheEntry.objects.get().name, 'Moda, Istanbul')
+
+    def test_stale_name_served_when_lookup_fails(self):
+        geocoding.reverse_geocode(40.99, 29.02)
+        GeocodeCacheEntry.objects.update(fetched_at=timezone.now() - datetime.timedelta(days=365))
+        geocoding.lru.clear()
+
+        self.nominatim.side_effect = GeocoderTimedOut
+        self.assertEqual(geocoding.reverse_geocode(40.99, 29.02), 'Kadikoy, Istanbul')
+        with self.assertRaises(GeocoderTimedOut):
+            geocoding.reverse_geocode(10.0, 10.0)
+
+class GazetteerGeocoderTestCase(TestCase):
+    def setUp(self):
+        gazetteer = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8')
+        gazetteer.write('name,latitude,longitude,admin2,admin1,country\n'
+                        'Kadikoy,40.9903,29.0290,,Istanbul,Turkey\n'
+                        'Besiktas,41.0422,29.0083,,Istanbul,Turkey\n'
+                        'Ankara,39.9334,32.8597,,,Turkey\n'
+                        'Fiji,-17.7134,178.0650,,,Fiji\n')
+        gazetteer.close()
+        self.addCleanup(os.remove, gazetteer.name)
+        self.geocoder = geocoding.GazetteerGeocoder(gazetteer.name, max_distance_km=25)
+
+    def test_nearest_place(self):
+        self.assertEqual(self.geocoder.reverse(40.99, 29.03), 'Kadikoy, Istanbul, Turkey')
+        self.assertEqual(self.geocoder.reverse(41.05, 29.00), 'Besiktas, Istanbul, Turkey')
+        # Across the antimeridian
+        self.assertEqual(self.geocoder.reverse(-17.7, -179.99), None)
+        self.assertEqual(geocoding.GazetteerGeocoder(self.geocoder.path, 500).reverse(-17.7, -179.99),
+                         'Fiji, Fiji')
+
+    def test_falls_back_when_no_place_is_near(self):
+        with mock.patch.object(geocoding, 'BACKEND', 'gazetteer'), \
+                mock.patch.object(geocoding, 'FALLBACK', 'nominatim'), \
+                mock.patch.dict(geocoding.geocoders, {'gazetteer': self.geocoder}), \
+                mock.patch('core.geocoding.cached_nominatim_reverse', return_value='Atlantic Ocean') as nominatim:
+            self.assertEqual(geocoding.reverse_geocode(39.93, 32.86), 'Ankara, Turkey')
+            nominatim.assert_not_called()
+            self.assertEqual(geocoding.reverse_geocode(30.0, -40.0), 'Atlantic Ocean')
+
+class GeocodeJobTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+        username='testuser', email='testuser@example.com', password='testpass')
+        Profile.objects.create(user=self.user, username='testuser', email='testuser@example.com')
+        self.client.login(username='testuser', password='testpass')
+        limiter = mock.patch.object(geocode_jobs, 'limiter', geocode_jobs.RateLimiter(0))
+        limiter.start()
+        self.addCleanup(limiter.stop)
+
+    def post(self):
+        features = [
+            {'geometry': {'type': 'Point', 'coordinates': [29.0, 41.0]}, 'properties': {'radius': 50}},
+            {'geometry': {'type': 'LineString', 'coordinates': [[29.0, 41.0], [29.1, 41.1]]}},
+        ]
+        with mock.patch('core.geocode_jobs.reverse_geocode') as geocode:
+            self.client.post(reverse('newpost'), {
+                'title': 'Test Title',
+                'content': 'Test Content',
+                'date_option': 'exact_date',
+                'exact_date': '2022-01-01',
+                'features': json.dumps(features),
+            })
+            geocode.assert_not_called()
+        return Story.objects.get(title='Test Title')
+
+    def test_names_resolved_in_background(self):
+        story = self.post()
+        self.assertSetEqual({location.name for location in story.locations.all()},
+                            {'Circle Area in 41.0000, 29.0000', 'Lines Around 41.0500, 29.0500'})
+        self.assertEqual(geocode_jobs.metrics()['queue_depth'], 2)
+
+        with mock.patch('core.geocode_jobs.reverse_geocode', return_value='Istanbul'):
+            counts = geocode_jobs.process(concurrency=1)
+        self.assertEqual(counts['done'], 2)
+        self.assertSetEqual({location.name for location in story.locations.all()},
+                            {'Circle Area in Istanbul', 'Lines Around Istanbul'})
+        self.assertListEqual(list(search_stories('istanbul')), [story])
+
+        metrics = geocode_jobs.metrics()
+        self.assertEqual(metrics['queue_depth'], 0)
+        self.assertIsNotNone(metrics['latency_seconds']['average'])
+
+    def test_failures_retried_with_backoff(self):
+        self.post()
+        with mock.patch('core.geocode_jobs.reverse_geocode', side_effect=GeocoderTimedOut):
+            counts = geocode_jobs.process(concurrency=1)
+        self.assertEqual(counts['pending'], 2)
+        job = GeocodeJob.objects.first()
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.next_attempt_at, timezone.now() + datetime.timedelta(seconds=20))
+        # Not due yet
+        self.assertEqual(sum(geocode_jobs.process(concurrency=1).values()), 0)
+
+        GeocodeJob.objects.update(attempts=geocode_jobs.MAX_ATTEMPTS - 1, next_attempt_at=timezone.now())
+        with mock.patch('core.geocode_jobs.reverse_geocode', side_effect=GeocoderTimedOut):
+            counts = geocode_jobs.process(concurrency=1)
+        self.assertEqual(counts['failed'], 2)
+        self.assertEqual(geocode_jobs.metrics()['failed'], 2)
+
+    def test_unnamed_places_keep_placeholder(self):
+        story = self.post()
+        with mock.patch('core.geocode_jobs.reverse_geocode', return_value=None):
+            counts = geocode_jobs.process(concurrency=1)
+        self.assertEqual(counts['done'], 2)
+        self.assertSetEqual({location.name for location in story.locations.all()},
+                            {'Circle Area in 41.0000, 29.0000', 'Lines Around 41.0500, 29.0500'})
+
+class SpatialSearchTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+        username='testuser', email='testuser@example.com', password='testpass')
+        Profile.objects.create(user=self.user, username='testuser', email='testuser@example.com')
+        self.client.login(username='testuser', password='testpass')
+
+        def story(title, date, **geometry):
+            story = Story.objects.create(title=title, user=self.user, date_format=1, date_exact=date)
+            story.locations.add(Location.objects.create(name=title, **geometry))
+            return story
+
+        self.point = story('Kadikoy', '1985-06-01', point=Point(29.03, 40.99))
+        self.circle = story('Circle', '1995-06-01', point=Point(29.10, 41.00), radius=5000)
+        self.area = story('Area', '1985-06-01', area=Polygon(
+            ((28.95, 41.00), (28.99, 41.00), (28.99, 41.03), (28.95, 41.03), (28.95, 41.00))))
+        self.line = story('Line', '1985-06-01', lines=LineString((29.00, 41.05), (29.02, 41.07)))
+
+    def test_bbox(self):
+        response = self.client.get(reverse('spatial-search'), {'bbox': '29.02,40.98,29.04,41.00'})
+        self.assertEqual(response.status_code, 200)
+        self.assertListEqual([story['title'] for story in response.json()['stories']], ['Kadikoy'])
+
+    def test_circles_are_areas(self):
+        # About 5 km east of the circle's center, just outside its radius
+        edge = Point(29.1603, 41.00, srid=4326)
+        self.assertListEqual(list(stories_near(edge, 100)), [self.circle])
+        self.assertListEqual(list(stories_near(Point(29.2, 41.00, srid=4326), 100)), [])
+
+    def test_polygon_and_temporal_filter(self):
+        polygon = json.dumps({'type': 'Polygon', 'coordinates': [
+            [[28.90, 40.95], [29.05, 40.95], [29.05, 41.10], [28.90, 41.10], [28.90, 40.95]]]})
+        response = self.client.get(reverse('spatial-search'), {'polygon': polygon})
+        # The circle's center is outside the polygon, its edge is not
+        self.assertSetEqual({story['title'] for story in response.json()['stories']},
+                            {'Kadikoy', 'Circle', 'Area', 'Line'})
+
+        response = self.client.get(reverse('spatial-search'), {
+            'lat': '41.0', 'lon': '29.05', 'distance': '10000', 'start': '1990-01-01', 'end': '1999-12-31'})
+        self.assertListEqual([story['title'] for story in response.json()['stories']], ['Circle'])
+
+    def test_invalid_query(self):
+        response = self.client.get(reverse('spatial-search'), {'bbox': '1,2,3'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('spatial-search'))
+        self.assertEqual(response.status_code, 400)
+        for polygon in ('{"type": "Polygon"}', '{"type": "Feature"}', '[1, 2]', 'not json'):
+            response = self.client.get(reverse('spatial-search'), {'polygon': polygon})
+            self.assertEqual(response.status_code, 400, polygon)
+
+class MapTileTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+        username='testuser', email='testuser@example.com', password='testpass')
+        Profile.objects.create(user=self.user, username='testuser', email='testuser@example.com')
+        self.client.login(username='testuser', password='testpass')
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, True)
+        patcher = mock.patch.object(tiles, 'CACHE_DIR', cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add_story(self, lon, lat):
+        story = Story.objects.create(title='Story', user=self.user, date_format=1)
+        story.locations.add(Location.objects.create(name='Place', point=Point(lon, lat)))
+        return story
+
+    def test_tile_of(self):
+        self.assertEqual(tiles.tile_of(0, 0, 0), (0, 0))
+        self.assertEqual(tiles.tile_of(29.03, 40.99, 10), (594, 383))
+        self.assertEqual(tiles.tile_of(180, -90, 2), (3, 3))
+
+    def test_tiles_cached_and_invalidated(self):
+        self.add_story(29.03, 40.99)
+        self.add_story(29.031, 40.991)
+        response = self.client.get(reverse('map-tile', args=[0, 0, 0]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        self.assertGreater(len(response.content), 0)
+
+        path = tiles.tile_path(0, 0, 0)
+        self.assertTrue(os.path.exists(path))
+        with mock.patch('core.tiles.render_tile') as render:
+            self.assertEqual(self.client.get(reverse('map-tile', args=[0, 0, 0])).content, response.content)
+            render.assert_not_called()
+
+        # A story elsewhere leaves this tile's neighbour alone
+        x, y = tiles.tile_of(29.03, 40.99, 10)
+        self.client.get(reverse('map-tile', args=[10, x, y]))
+        other = self.add_story(-74.0, 40.7)
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.exists(tiles.tile_path(10, x, y)))
+
+        self.client.get(reverse('map-tile', args=[0, 0, 0]))
+        other.delete()
+        self.assertFalse(os.path.exists(path))
+
+    def test_invalid_tile(self):
+        self.assertEqual(self.client.get(reverse('map-tile', args=[2, 4, 0])).status_code, 404)
+
+    def test_clusters_stop_at_tile_edges(self):
+        # Either side of the 0 meridian, the edge of the zoom 1 tiles
+        self.add_story(-1.0, 10.0)
+        self.add_story(1.0, 10.0)
+        # Either side of the middle of a cell, which a snapped grid splits
+        self.add_story(66.0, 10.0)
+        self.add_story(69.0, 10.0)
+        self.assertListEqual(tiles.tile_clusters(1, 0, 0), [(1, 1)])
+        self.assertListEqual(tiles.tile_clusters(1, 1, 0), [(1, 1), (2, 2)])
+
+class StoryGeoJSONTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+        username='testuser', email='testuser@example.com', password='testpass')
+        Profile.objects.create(user=self.user, username='testuser', email='testuser@example.com')
+        self.client.login(username='testuser', password='testpass')
+
+        # A hand drawn circle of 2000 vertices
+        ring = [(29.0 + 0.05 * math.cos(2 * math.pi * i / 2000), 41.0 + 0.05 * math.sin(2 * math.pi * i / 2000))
+                for i in range(2000)]
+        self.area = Polygon(ring + [ring[0]])
+        self.story = Story.objects.create(title='Story', user=self.user, date_format=1)
+        self.story.locations.add(
+            Location.objects.create(name='Area', area=self.area),
+            Location.objects.create(name='Circle', point=Point(29.123456789, 41.0), radius=300))
+
+    def test_simplified_levels(self):
+        levels = simplified_geojson(area=self.area)
+        sizes = {level: len(geometry['coordinates'][0]) for level, geometry in levels.items()}
+        self.assertLess(sizes['low'], sizes['medium'])
+        self.assertLess(sizes['medium'], sizes['high'])
+        self.assertLess(sizes['high'], 2001)
+        self.assertListEqual(levels['low']['coordinates'][0][0], [29.05, 41.0])
+
+        point = simplified_geojson(point=Point(29.123456789, 41.0))
+        self.assertListEqual(point['low']['coordinates'], [29.123, 41.0])
+
+    def test_feature_collection(self):
+        url = reverse('story-geojson', args=[self.story.id])
+        response = self.client.get(url, {'detail': 'low'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['type'], 'FeatureCollection')
+        features = {feature['properties']['name']: feature for feature in data['features']}
+        self.assertEqual(features['Circle']['properties']['radius'], 300)
+        self.assertEqual(features['Area']['geometry']['type'], 'Polygon')
+        self.assertLess(len(features['Area']['geometry']['coordinates'][0]), 100)
+
+        self.assertEqual(self.client.get(url, {'detail': 'huge'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('story-geojson', args=[uuid.uuid4()])).status_code, 404)
+
+class PlaceDedupeTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+        username='testuser', email='testuser@example.com', password='testpass')
+        self.dates = {'date_exact': '2022-01-01', 'date_range_start': None, 'date_range_end': None,
+                      'decade': None, 'exact_date_and_time': None}
+        self.square = [[28.95, 41.00], [28.99, 41.00], [28.99, 41.03], [28.95, 41.03], [28.95, 41.00]]
+
+    def post(self, *geometries):
+        features = [{'geometry': geometry} for geometry in geometries]
+        return create_story(self.user, 'Title', 'Content', 1, self.dates, features)
+
+    def test_new_features_snap_to_places(self):
+        first = self.post({'type': 'Point', 'coordinates': [29.0, 41.0]},
+                          {'type': 'Polygon', 'coordinates': [self.square]})
+        # 10 m away, and the same square drawn a little off
+        second = self.post({'type': 'Point', 'coordinates': [29.0001, 41.0]},
+                           {'type': 'Polygon', 'coordinates': [[[x + 0.0005, y] for x, y in self.square]]},
+                           {'type': 'Point', 'coordinates': [29.01, 41.0]})
+
+        self.assertEqual(Location.objects.count(), 3)
+        shared = set(first.locations.all())
+        self.assertTrue(shared <= set(second.locations.all()))
+        for location in shared:
+            self.assertSetEqual(set(Story.objects.filter(locations=location)), {first, second})
+
+    def test_kinds_do_not_mix(self):
+        point = Location(name='Point', point=Point(29.0, 41.0))
+        circle = Location(name='Circle', point=Point(29.0, 41.0), radius=500)
+        Location.objects.bulk_create([point])
+        self.assertDictEqual(find_places([circle]), {})
+
+    def test_dedupe_command(self):
+        stories = []
+        for lon in (29.0, 29.00005, 29.0001, 29.1):
+            story = Story.objects.create(title='Title', user=self.user, date_format=1)
+            story.locations.add(Location.objects.create(name='Place', point=Point(lon, 41.0)))
+            stories.append(story)
+
+        first_place = stories[0].locations.get()
+        version = autocomplete.current_version()
+        out = io.StringIO()
+        call_command('dedupe_places', stdout=out)
+        self.assertIn('Merged 2 duplicate locations of 2 stories', out.getvalue())
+        self.assertEqual(Location.objects.count(), 2)
+        # The earliest place is kept
+        self.assertEqual(stories[1].locations.get(), first_place)
+        self.assertSetEqual(set(Story.objects.filter(locations=first_place)), set(stories[:3]))
+        self.assertNotEqual(autocomplete.current_version(), version)
+
+
+class NearbyStoriesTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+        username='testuser', email='testuser@example.com', password='testpass')
+        Profile.objects.create(user=self.user, email='testuser@example.com', username='testuser')
+        self.client.login(username='testuser', password='testpass')
+
+    def story_at(self, title, **geometry):
+        story = Story.objects.create(title=title, user=self.user, date_format=1)
+        story.locations.add(Location.objects.create(name=title, **geometry))
+        return story
+
+    def test_nearest_first_across_columns(self):
+        origin = self.story_at('Origin', point=Point(29.0, 41.0, srid=4326))
+        far = self.story_at('Far', point=Point(29.5, 41.0, srid=4326))
+        line = self.story_at('Line', lines=LineString((29.02, 40.9), (29.02, 41.1), srid=4326))
+        area = self.story_at('Area', area=Polygon.from_bbox((29.05, 40.95, 29.1, 41.05)))
+
+        shape = Point(29.0, 41.0, srid=4326)
+        nearest = nearest_stories(shape, 3, exclude=[origin.id])
+        self.assertListEqual([story for story, _ in nearest], [line, area, far])
+        self.assertAlmostEqual(nearest[0][1], 0.02 * 111320 * math.cos(math.radians(41)), delta=50)
+
+    def test_widens_while_a_column_is_full(self):
+        origin = self.story_at('Origin', point=Point(29.0, 41.0, srid=4326))
+        for offset in (0.001, 0.002):
+            origin.locations.add(Location.objects.create(name='Origin', point=Point(29.0 + offset, 41.0, srid=4326)))
+        far = self.story_at('Far', point=Point(29.5, 41.0, srid=4326))
+
+        # The excluded story fills the first scan of the point column alone
+        with mock.patch('core.spatial.NEAREST_BATCH', 2):
+            nearest = nearest_stories(Point(29.0, 41.0, srid=4326), 1, exclude=[origin.id])
+        self.assertListEqual([story for story, _ in nearest], [far])
+
+    def test_panel_is_cached_until_a_story_is_added_nearby(self):
+        origin = self.story_at('Origin', point=Point(29.0, 41.0, srid=4326))
+        self.story_at('Neighbour', point=Point(29.01, 41.0, srid=4326))
+        url = f'/postdetailed?story_id={origin.id}'
+
+        response = self.client.get(url)
+        self.assertContains(response, 'Neighbour')
+        self.assertNotContains(response, 'Newcomer')
+
+        with mock.patch.object(nearby, 'nearest_stories', wraps=nearby.nearest_stories) as query:
+            self.client.get(url)
+            query.assert_not_called()
+
+            self.story_at('Newcomer', point=Point(29.001, 41.0, srid=4326))
+            response = self.client.get(url)
+            query.assert_called_once()
+        self.assertContains(response, 'Newcomer')
+
+    def test_story_without_locations_has_no_panel(self):
+        story = Story.objects.create(title='Nowhere', user=self.user, date_format=1)
+        self.assertEqual(nearby.nearby_stories_html(story), '')
+
+
+class HeatmapTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+        username='testuser', email='testuser@example.com', password='testpass')
+        self.client.login(username='testuser', password='testpass')
+        self.dates = {'date_exact': '2022-01-01', 'date_range_start': None, 'date_range_end': None,
+                      'decade': None, 'exact_date_and_time': None}
+
+    def post(self, *geometries):
+        features = [{'geometry': geometry} for geometry in geometries]
+        return create_story(self.user, 'Title', 'Content', 1, self.dates, features)
+
+    def counts(self, resolution):
+        return {
+            (x, y): count for x, y, count in
+            HeatmapBin.objects.filter(resolution=resolution).values_list('x', 'y', 'count')
+        }
+
+    def test_bins_follow_new_and_deleted_stories(self):
+        istanbul = tiles.tile_of(29.0, 41.0, 10)
+        first = self.post({'type': 'Point', 'coordinates': [29.0, 41.0]},
+                          {'type': 'LineString', 'coordinates': [[28.9, 41.0], [29.1, 41.0]]})
+        second = self.post({'type': 'Point', 'coordinates': [2.35, 48.85]})
+        self.assertEqual(self.counts(10)[istanbul], 2)
+        self.assertEqual(sum(self.counts(2).values()), 3)
+
+        first.delete()
+        self.assertNotIn(istanbul, self.counts(10))
+        second.locations.clear()
+        self.assertFalse(HeatmapBin.objects.exists())
+
+    def test_rebuild_matches_incremental_bins(self):
+        self.post({'type': 'Point', 'coordinates': [29.0, 41.0]},
+                  {'type': 'Polygon', 'coordinates': [[[28.9, 40.9], [29.1, 40.9], [29.1, 41.1], [28.9, 41.1], [28.9, 40.9]]]})
+        kept = {resolution: self.counts(resolution) for resolution in heatmap.RESOLUTIONS}
+        heatmap.rebuild()
+        self.assertDictEqual({resolution: self.counts(resolution) for resolution in heatmap.RESOLUTIONS}, kept)
+
+    def test_endpoint_returns_bin_arrays(self):
+        self.post({'type': 'Point', 'coordinates': [29.0, 41.0]})
+        self.post({'type': 'Point', 'coordinates': [2.35, 48.85]})
+
+        response = self.client.get('/api/heatmap', {'zoom': 7, 'bbox': '28,40,30,42'})
+        data = response.json()
+        self.assertEqual(data['resolution'], 10)
+        x, y = tiles.tile_of(29.0, 41.0, 10)
+        self.assertListEqual(data['bins'], [y * data['size'] + x])
+        self.assertListEqual(data['counts'], [1])
+
+        self.assertEqual(self.client.get('/api/heatmap', {'zoom': 'far'}).status_code, 400)
+
+
+class SpaceTimeCubeTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+        username='testuser', email='testuser@example.com', password='testpass')
+        self.client.login(username='testuser', password='testpass')
+        self.cell = tiles.tile_of(29.0, 41.0, spacetime.RESOLUTION)
+
+    def post(self, date_format, **dates):
+        dates = {'date_exact': None, 'date_range_start': None, 'date_range_end': None,
+                 'decade': None, 'exact_date_and_time': None, **dates}
+        features = [{'geometry': {'type': 'Point', 'coordinates': [29.0, 41.0]}}]
+        return create_story(self.user, 'Title', 'Content', date_format, dates, features)
+
+    def test_stories_count_in_every_bucket_they_overlap(self):
+        self.post(1, date_exact='1985-06-01')
+        ranged = self.post(2, date_range_start='1988-03-01', date_range_end='1991-02-01')
+        self.post(3, decade='1980s')
+
+        years = dict(SpaceTimeCell.objects.filter(span=1).values_list('start_year', 'count'))
+        self.assertEqual(years[1985], 2)
+        self.assertEqual(years[1990], 1)
+        self.assertEqual(len(years), 12)
+        decades = dict(SpaceTimeCell.objects.filter(span=10).values_list('start_year', 'count'))
+        self.assertDictEqual(decades, {1980: 3, 1990: 1})
+
+        ranged.delete()
+        decades = dict(SpaceTimeCell.objects.filter(span=10).values_list('start_year', 'count'))
+        self.assertDictEqual(decades, {1980: 2})
+
+    def test_cube_is_dense_and_sums_coarse_cells(self):
+        self.post(1, date_exact='1985-06-01')
+        self.post(4, exact_date_and_time='1987-01-01T10:00:00Z')
+
+        data = spacetime.cube((28.0, 40.0, 30.0, 42.0), 1984, 1987)
+        counts = data['counts']
+        self.assertEqual(counts.shape[0], 4)
+        x, y = self.cell
+        column, row = x - data['origin'][0], y - data['origin'][1]
+        self.assertListEqual(counts[:, row, column].tolist(), [0, 1, 0, 1])
+        self.assertEqual(counts.sum(), 2)
+
+        data = spacetime.cube((-180.0, -85.0, 180.0, 85.0), 1980, 1989, step='decade', zoom=0)
+        self.assertListEqual(data['counts'].tolist(), [[[2]]])
+
+    def test_endpoint(self):
+        self.post(3, decade='1980s')
+        response = self.client.get('/api/space-time', {
+            'bbox': '28,40,30,42', 'start': 1970, 'end': 1999, 'step': 'decade'})
+        data = response.json()
+        self.assertEqual(data['shape'][0], 3)
+        self.assertEqual(sum(sum(row) for row in data['counts'][1]), 1)
+
+        response = self.client.get('/api/space-time', {'bbox': '28,40,30,42', 'start': 1990, 'end': 1980})
+        self.assertEqual(response.status_code, 400)
+
+
+class CircleLocationTestCase(TestCase):
+    def test_circle_and_bbox_follow_the_radius(self):
+        location = Location.objects.create(name='Circle', point=Point(29.0, 41.0), radius=1000)
+        location.refresh_from_db()
+        west, south, east, north = location.bbox.extent
+        self.assertAlmostEqual(north - 41.0, 1000 / 111195, places=4)
+        self.assertAlmostEqual(east - 29.0, 1000 / (111195 * math.cos(math.radians(41.0))), places=4)
+        for lon, lat in location.circle.coords[0]:
+            self.assertTrue(west - 1e-9 <= lon <= east + 1e-9 and south - 1e-9 <= lat <= north + 1e-9)
+
+        location.radius = None
+        location.save(update_fields=['radius'])
+        location.refresh_from_db()
+        self.assertIsNone(location.circle)
+        self.assertIsNone(location.bbox)
+
+    def test_bbox_across_the_antimeridian(self):
+        self.assertEqual(circle_bbox(Point(179.99, 0.0), 5000)[::2], (-180, 180))
+
+    def test_backfill_command(self):
+        Location.objects.create(name='Circle', point=Point(29.0, 41.0), radius=1000)
+        Location.objects.create(name='Point', point=Point(29.0, 41.0))
+        Location.objects.update(circle=None, bbox=None)
+
+        out = io.StringIO()
+        call_command('backfill_circles', stdout=out)
+        self.assertIn('Stored the circles of 1 locations', out.getvalue())
+        self.assertTrue(Location.objects.get(name='Circle').circle.intersects(Point(29.0, 41.0)))
+        self.assertIsNone(Location.objects.get(name='Point').circle)
+
+
+class StoryCardCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', email='author@example.com')
+        Profile.objects.create(user=self.author, username='author', email='author@example.com')
+        self.viewer = User.objects.create_user(username='viewer', email='viewer@example.com')
+        self.story = Story.objects.create(title='Title', user=self.author, content='<p>Content</p>')
+        self.tag = Tag.objects.create(name='harbour')
+        self.story.tags.add(self.tag)
+        self.story.locations.add(Location.objects.create(name='Karakoy'))
+
+    def load(self, viewer=None):
+        return load_story_cards(Story.objects.all(), viewer=viewer, bodies=True)
+
+    def test_bodies_come_from_the_cache(self):
+        body = self.load()[0].body
+        self.assertIn('harbour', body)
+        self.assertIn('Karakoy', body)
+
+        with mock.patch.object(card_cache, 'render_to_string') as render:
+            # Stories and the like state
+            with self.assertNumQueries(2):
+                cards = self.load(viewer=self.viewer)
+            render.assert_not_called()
+        self.assertEqual(cards[0].body, body)
+
+    def test_changes_to_the_story_or_its_rows_render_it_again(self):
+        self.load()
+        self.tag.name = 'port'
+        self.tag.save()
+        self.assertIn('port', self.load()[0].body)
+
+        self.story.locations.add(Location.objects.create(name='Galata'))
+        self.assertIn('Galata', self.load()[0].body)
+
+        self.story.title = 'New title'
+        self.story.save()
+        self.assertIn('New title', self.load()[0].body)
+
+    def test_changes_made_elsewhere_render_it_again(self):
+        # Another process has its own cache, the rows tell the body changed
+        self.load()
+        Story.objects.filter(id=self.story.id).update(title='Renamed elsewhere')
+        self.assertIn('Renamed elsewhere', self.load()[0].body)
+
+    def test_like_state_is_rendered_per_viewer(self):
+        Like.objects.create(user=self.viewer, story=self.story)
+        self.load()
+        self.assertTrue(self.load(viewer=self.viewer)[0].liked)
+        self.assertFalse(self.load(viewer=self.author)[0].liked)
+
+
+class StorySummaryTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+        username='testuser', email='testuser@example.com', password='testpass')
+        self.profile = Profile.objects.create(user=self.user, username='testuser', email='testuser@example.com')
+        self.dates = {'date_exact': '2022-01-01', 'date_range_start': None, 'date_range_end': None,
+                      'decade': None, 'exact_date_and_time': None}
+
+    def test_summary_follows_the_story_and_its_rows(self):
+        features = [{'geometry': {'type': 'Point', 'coordinates': [29.0, 41.0 + i]}} for i in range(3)]
+        content = '<p>Ferry &amp; ' + 'gulls ' * 100 + '</p>'
+        story = create_story(self.user, 'Title', content, 1, self.dates, features, ['harbour'])
+        story.refresh_from_db()
+
+        summary = story.summary
+        self.assertEqual(summary['username'], 'testuser')
+        self.assertEqual(summary['profile_id'], self.profile.id)
+        self.assertEqual(summary['avatar_url'], self.profile.profile_image.url)
+        self.assertListEqual(summary['tags'], ['harbour'])
+        self.assertEqual(summary['location_count'], 3)
+        self.assertIn(summary['first_location'], summary['locations'])
+        self.assertTrue(summary['excerpt'].startswith('Ferry & gulls'))
+        self.assertLessEqual(len(summary['excerpt']), EXCERPT_LENGTH)
+
+        story.tags.clear()
+        location = story.locations.first()
+        location.name = 'Kadikoy'
+        location.save(update_fields=['name'])
+        story.refresh_from_db()
+        self.assertListEqual(story.summary['tags'], [])
+        self.assertIn('Kadikoy', story.summary['locations'])
+
+    def test_new_story_is_refreshed_once(self):
+        features = [{'geometry': {'type': 'Point', 'coordinates': [29.0, 41.0]}}]
+        with mock.patch('core.search.update_search_vectors') as update_search, \
+                mock.patch('core.summaries.update_summaries') as update_summaries:
+            story = create_story(self.user, 'Title', 'Content', 1, self.dates, features, ['harbour'])
+        update_search.assert_called_once()
+        update_summaries.assert_called_once()
+        self.assertSetEqual(set(update_summaries.call_args.args[0]), {story.id})
+
+    def test_cards_render_from_the_summary(self):
+        story = Story.objects.create(title='Title', user=self.user, content='<b>Bold</b> words')
+        story.locations.add(Location.objects.create(name='Moda'))
+
+        with self.assertNumQueries(1):
+            card = load_story_cards(Story.objects.filter(id=story.id))[0]
+            self.assertEqual(card.username, 'testuser')
+            self.assertEqual(card.avatar_url, self.profile.profile_image.url)
+            self.assertEqual(card.profile, self.profile)
+            self.assertListEqual(card.locations, ['Moda'])
+            self.assertEqual(card.first_location, 'Moda')
+            self.assertEqual(card.excerpt, 'Bold words')
@@ -0,0 +1,171 @@
+import math
+import os
+import shutil
+import tempfile
+import time
+from django.conf import settings
+from django.db import connection
+from .geocode_jobs import geocode_target
+from .models import Location, Story
+
+# Tiles are cached on disk under this directory as {z}/{x}/{y}.mvt
+CACHE_DIR = getattr(settings, 'TILE_CACHE_DIR', None)
+
+# Seconds a cached tile is served for, a safety net for the tiles of other
+# servers, which the invalidation in this process cannot reach
+CACHE_TTL = getattr(settings, 'TILE_CACHE_TTL', 24 * 60 * 60)
+
+MAX_ZOOM = getattr(settings, 'TILE_MAX_ZOOM', 20)
+
+# Locations closer than this many pixels of a 256 pixel tile are one
+# cluster, from CLUSTER_MAX_ZOOM on every location is its own feature
+CLUSTER_PIXELS = getattr(settings, 'TILE_CLUSTER_PIXELS', 64)
+CLUSTER_MAX_ZOOM = getattr(settings, 'TILE_CLUSTER_MAX_ZOOM', 16)
+
+LAYER_NAME = 'stories'
+EXTENT = 4096
+
+# Half the width of the Web Mercator world in meters
+WORLD_HALF_WIDTH = 20037508.342789244
+
+# The locations in a tile grouped by the grid cell they fall in. Cells are
+# counted from the world's corner so every tile edge is a cell edge
+CLUSTERS_SQL = """
+WITH bounds AS (
+    SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS geom,
+           ST_Transform(ST_TileEnvelope(%(z)s, %(x)s, %(y)s), 4326) AS geom_4326
+),
+locations AS (
+    SELECT location.id, story_location.story_id,
+           ST_Transform(COALESCE(
+               location.point,
+               ST_Centroid(location.area::geometry),
+               ST_LineInterpolatePoint(location.lines, 0.5)
+           ), 3857) AS geom
+    FROM {location_table} location
+    JOIN {through_table} story_location ON story_location.location_id = location.id
+    CROSS JOIN bounds
+    WHERE location.point && bounds.geom_4326
+       OR location.area && bounds.geom_4326::geography
+       OR location.lines && bounds.geom_4326
+),
+clusters AS (
+    SELECT ST_Centroid(ST_Collect(locations.geom)) AS geom,
+           count(DISTINCT locations.story_id) AS story_count,
+           count(DISTINCT locations.id) AS location_count,
+           CASE WHEN count(DISTINCT locations.story_id) = 1
+                THEN min(locations.story_id::text) END AS story_id
+    FROM locations, bounds
+    WHERE ST_Intersects(locations.geom, bounds.geom)
+    GROUP BY floor((ST_X(locations.geom) + %(half)s) / %(cell)s),
+             floor((ST_Y(locations.geom) + %(half)s) / %(cell)s)
+)
+"""
+
+TILE_SQL = CLUSTERS_SQL + """
+SELECT ST_AsMVT(tile, %(layer)s, %(extent)s, 'geom')
+FROM (
+    SELECT ST_AsMVTGeom(clusters.geom, bounds.geom, %(extent)s, 64, true) AS geom,
+           story_count, location_count, story_id
+    FROM clusters, bounds
+) tile
+WHERE tile.geom IS NOT NULL
+"""
+
+
+def is_valid(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def cluster_cell(z):
+    """Size in meters of the grid cells locations are clustered in at zoom ``z``"""
+    tile_width = 2 * WORLD_HALF_WIDTH / 2 ** z
+    if z >= CLUSTER_MAX_ZOOM:
+        # One tile unit, so only locations drawn on the same spot merge
+        return tile_width / EXTENT
+    # A whole number of cells per tile so no cluster straddles two tiles
+    return tile_width / max(round(256 / CLUSTER_PIXELS), 1)
+
+
+def run_tile_query(sql, z, x, y):
+    sql = sql.format(
+        location_table=connection.ops.quote_name(Location._meta.db_table),
+        through_table=connection.ops.quote_name(Story.locations.through._meta.db_table),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {
+            'z': z, 'x': x, 'y': y,
+            'cell': cluster_cell(z),
+            'half': WORLD_HALF_WIDTH,
+            'layer': LAYER_NAME,
+            'extent': EXTENT,
+        })
+        return cursor.fetchall()
+
+
+def tile_clusters(z, x, y):
+    """The ``(story_count, location_count)`` of every cluster in tile z/x/y"""
+    return run_tile_query(
+        CLUSTERS_SQL + 'SELECT story_count, location_count FROM clusters ORDER BY 1, 2', z, x, y)
+
+
+def render_tile(z, x, y):
+    rows = run_tile_query(TILE_SQL, z, x, y)
+    return bytes(rows[0][0]) if rows and rows[0][0] else b''
+
+
+def tile_path(z, x, y):
+    return os.path.join(CACHE_DIR, str(z), str(x), f'{y}.mvt')
+
+
+def get_tile(z, x, y):
+    """The Mapbox Vector Tile at z/x/y, from the disk cache when fresh"""
+    if not CACHE_DIR:
+        return render_tile(z, x, y)
+
+    path = tile_path(z, x, y)
+    try:
+        if time.time() - os.path.getmtime(path) < CACHE_TTL:
+            with open(path, 'rb') as f:
+                return f.read()
+    except OSError:
+        pass
+
+    tile = render_tile(z, x, y)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written aside and renamed so readers never see half a tile
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(tile)
+    os.replace(temp_path, path)
+    return tile
+
+
+def tile_of(lon, lat, z):
+    # The x/y of the Web Mercator tile holding a point at zoom z
+    lat = max(min(lat, 85.0511), -85.0511)
+    n = 2 ** z
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def invalidate_locations(locations):
+    """Drop the cached tiles, at every zoom, holding any of ``locations``"""
+    if not CACHE_DIR:
+        return
+    for location in locations:
+        target = geocode_target(location)
+        if target is None:
+            continue
+        for z in range(MAX_ZOOM + 1):
+            x, y = tile_of(target.x, target.y, z)
+            try:
+                os.remove(tile_path(z, x, y))
+            except FileNotFoundError:
+                pass
+
+
+def clear_cache():
+    if CACHE_DIR and os.path.isdir(CACHE_DIR):
+        shutil.rmtree(CACHE_DIR)
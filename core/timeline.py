@@ -0,0 +1,159 @@
+import heapq
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from .models import Follower, FollowerCount, Story, TimelineEntry
+from .pagination import before_cursor
+
+# Authors with more followers than this are not fanned out on write, their
+# stories are merged into the home feed at read time instead.
+FANOUT_FOLLOWER_LIMIT = getattr(settings, 'TIMELINE_FANOUT_FOLLOWER_LIMIT', 1000)
+
+BATCH_SIZE = 1000
+
+
+def follower_count(user):
+    return FollowerCount.objects.filter(user=user).values_list('count', flat=True).first() or 0
+
+
+def is_fanout_author(user):
+    return follower_count(user) <= FANOUT_FOLLOWER_LIMIT
+
+
+def change_follower_count(user, delta):
+    """
+    Move the follower count of ``user`` by ``delta`` and return the new
+    count. The row stays locked until the transaction ends, so follows of
+    the same author are counted one after another.
+    """
+    FollowerCount.objects.bulk_create([FollowerCount(user_id=getattr(user, 'pk', user))], ignore_conflicts=True)
+    FollowerCount.objects.filter(user=user).update(count=F('count') + delta)
+    return follower_count(user)
+
+
+def fan_out_story(story):
+    # Push a new story into the timeline of every follower of its author
+    if not is_fanout_author(story.user_id):
+        return
+
+    follower_ids = Follower.objects.filter(
+        user=story.user_id).values_list('follower', flat=True).distinct()
+    entries = [
+        TimelineEntry(owner_id=follower_id, story=story,
+                      created_at=story.created_at)
+        for follower_id in follower_ids
+    ]
+    TimelineEntry.objects.bulk_create(
+        entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def backfill(follower_ids, user):
+    """
+    Copy all of the author's stories into the timelines of the followers,
+    BATCH_SIZE stories at a time, so paging a timeline back never runs out
+    of them.
+    """
+    follower_ids = list(follower_ids)
+    stories = Story.objects.filter(user=user).values_list('id', 'created_at')
+    batch = []
+    for story in stories.iterator(chunk_size=BATCH_SIZE):
+        batch.append(story)
+        if len(batch) == BATCH_SIZE:
+            add_entries(follower_ids, batch)
+            batch = []
+    add_entries(follower_ids, batch)
+
+
+def add_entries(follower_ids, stories):
+    for follower_id in follower_ids:
+        entries = [
+            TimelineEntry(owner_id=follower_id, story_id=story_id, created_at=created_at)
+            for story_id, created_at in stories
+        ]
+        TimelineEntry.objects.bulk_create(
+            entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def add_follow(follower, user):
+    with transaction.atomic():
+        count = change_follower_count(user, 1)
+        if count == FANOUT_FOLLOWER_LIMIT + 1:
+            # The author just became too big, their stories are merged in
+            # at read time from now on
+            TimelineEntry.objects.filter(story__user=user).delete()
+        elif count <= FANOUT_FOLLOWER_LIMIT:
+            # Backfill the new follower's timeline with the author's stories
+            backfill([getattr(follower, 'pk', follower)], user)
+
+
+def remove_follow(follower, user):
+    with transaction.atomic():
+        TimelineEntry.objects.filter(owner=follower, story__user=user).delete()
+        count = change_follower_count(user, -1)
+        if count == FANOUT_FOLLOWER_LIMIT:
+            # The author is fanned out on write again, the stories that were
+            # merged in at read time have to be in the timelines now
+            backfill(Follower.objects.filter(
+                user=user).values_list('follower', flat=True).distinct(), user)
+
+
+def rebuild_timeline(user):
+    # Recompute a user's timeline from scratch out of the Follower table
+    TimelineEntry.objects.filter(owner=user).delete()
+    for follow in Follower.objects.filter(follower=user).select_related('user'):
+        if is_fanout_author(follow.user):
+            backfill([user.pk], follow.user)
+
+
+def read_time_authors(user):
+    # Followed authors that are too big to be fanned out on write
+    following_users = Follower.objects.filter(
+        follower=user).values('user')
+    return list(
+        FollowerCount.objects.filter(
+            user__in=following_users, count__gt=FANOUT_FOLLOWER_LIMIT)
+        .values_list('user', flat=True)
+    )
+
+
+def get_timeline(user, limit=None, before=None):
+    """
+    Return the home feed of ``user`` as a list of stories, newest first.
+
+    Stories are read from the materialized timeline, and stories of authors
+    above FANOUT_FOLLOWER_LIMIT are merged in at read time. ``before`` is a
+    ``(created_at, id)`` key, only stories older than it are returned.
+    """
+    entries = TimelineEntry.objects.filter(owner=user)
+    if before:
+        entries = entries.filter(
+            before_cursor(before, id_field='story_id'))
+    entries = entries.order_by(
+        '-created_at', '-story_id').values_list('created_at', 'story_id')
+    if limit is not None:
+        entries = entries[:limit]
+    feeds = [list(entries)]
+
+    big_authors = read_time_authors(user)
+    if big_authors:
+        merged = Story.objects.filter(user__in=big_authors)
+        if before:
+            merged = merged.filter(before_cursor(before))
+        merged = merged.order_by(
+            '-created_at', '-id').values_list('created_at', 'id')
+        if limit is not None:
+            merged = merged[:limit]
+        feeds.append(list(merged))
+
+    story_ids = []
+    seen = set()
+    for created_at, story_id in heapq.merge(*feeds, reverse=True):
+        if story_id in seen:
+            continue
+        seen.add(story_id)
+        story_ids.append(story_id)
+        if limit is not None and len(story_ids) >= limit:
+            break
+
+    stories = Story.objects.in_bulk(story_ids)
+    return [stories[story_id] for story_id in story_ids if story_id in stories]
@@ -13,6 +13,10 @@ urlpatterns = [
     path('like-post', views.like_post, name="like-post"),
     path('usersliked', views.usersLiked, name='usersliked'),
     path('comment-post', views.comment_post, name="comment-post"),
+    path('api/like-post', views.like_post_api, name="like-post-api"),
+    path('api/comment-post', views.comment_post_api, name="comment-post-api"),
+    path('api/stories/spatial', views.spatial_search, name='spatial-search'),
+    path('api/stories/<uuid:story_id>/geojson', views.story_geojson, name='story-geojson'),
     path('userscommented', views.usersCommented, name='userscommented'),
     path('profile/<str:pk>', views.profile, name='profile'), 
     path('delete-story', views.delete_story, name="delete-story"),
@@ -21,4 +25,10 @@ urlpatterns = [
     path('usersfollowing', views.usersFollowing, name='usersfollowing'),
     path('discover', views.discover, name="discover"),
     path('search/', views.search, name='search'),
+    path('feed/<str:feed>', views.feed_page, name='feed-page'),
+    path('autocomplete', views.autocomplete_view, name='autocomplete'),
+    path('tiles/<int:z>/<int:x>/<int:y>.mvt', views.map_tile, name='map-tile'),
+    path('api/heatmap', views.heatmap_bins, name='heatmap'),
+    path('api/space-time', views.space_time_cube, name='space-time-cube'),
+    path('metrics/geocoding', views.geocoding_metrics, name='geocoding-metrics'),
 ]
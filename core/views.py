@@ -2,62 +2,89 @@ import json
 import os
 import geojson
 from django.db import IntegrityError
-from django.db.models import Q
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
 from django.shortcuts import render, redirect
+from django.template.loader import render_to_string
 from django.contrib.auth.models import User, auth
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from .models import File, Profile, Story, Tag, Like, Comment, Follower
-from django.contrib.gis.geos import Point, Polygon, LineString
-from .models import Location
+from django.core.exceptions import ValidationError
+from django.views.decorators.http import require_POST
+from .models import Location, Profile, Story, Like, Comment, Follower
 from .forms import StoryForm
-from datetime import datetime
+from .timeline import get_timeline
+from .cards import load_story_cards
+from .engagement import add_comment, toggle_like
+from .pagination import PAGE_SIZE, decode_cursor, paginate_ranked_stories, paginate_stories, split_page
+from .search import search_profiles, search_stories
+from .spatial import parse_bbox, spatial_stories
+from .nearby import nearby_stories_html
+from .geometry import DEFAULT_DETAIL, DETAIL_LEVELS
+from . import autocomplete
+from . import geocode_jobs, geocoding, heatmap, spacetime, tiles
+from .stories import create_story, validate_story
 from django.test import TestCase, Client
 from dotenv import load_dotenv
-from geopy.geocoders import Nominatim
 
 load_dotenv()
 
 # Create your views here.
 
-def reverse_geocode_nominatim(lat, lon):
-    geolocator = Nominatim(user_agent="my_app")
-    location = geolocator.reverse(f"{lat}, {lon}")
-    print(location)
-    return location
+# Story card partial rendered by each paginated feed
+FEED_CARD_TEMPLATES = {
+    'index': 'partials/story_card.html',
+    'discover': 'partials/story_card.html',
+    'search': 'partials/search_story_card.html',
+    'profile': 'partials/profile_story_card.html',
+}
 
 
-@login_required(login_url='signin')
-def index(request):
-    user_object = User.objects.get(username=request.user.username)
-    user_profile = Profile.objects.get(user=user_object)
-
+def discover_stories(user_object):
     # Get the users you are following
     following_users = Follower.objects.filter(
         follower=user_object).values_list('user', flat=True)
 
-    # Get the stories of the following users
-    stories = Story.objects.filter(
-        user__in=following_users).order_by('-created_at')
+    # Get all other stories except your posts and the following posts
+    return Story.objects.exclude(user=user_object).exclude(
+        user__in=following_users)
+
+
+def load_feed_page(feed, user_object, cursor=None, query='', username=''):
+    """
+    Return one page of story cards of a feed and the cursor of the next
+    page. Pages are keyed on (created_at, id), or (rank, id) for search
+    results, so they stay stable while new stories come in.
+    """
+    if feed == 'index':
+        # Get the stories of the following users from the materialized timeline
+        stories = get_timeline(
+            user_object, limit=PAGE_SIZE + 1, before=decode_cursor(cursor))
+        stories, next_cursor = split_page(stories)
+    elif feed == 'search':
+        # Search results come best match first
+        stories = search_stories(query) if query else Story.objects.none()
+        stories, next_cursor = paginate_ranked_stories(stories, cursor)
+    else:
+        if feed == 'discover':
+            stories = discover_stories(user_object)
+        elif feed == 'profile':
+            stories = Story.objects.filter(user__username=username)
+        stories, next_cursor = paginate_stories(stories, cursor)
 
-    # Create a list to store tuples of story and profile
-    story_profile_list = []
+    # Load authors, profiles, like state and the cached card bodies for all the stories
+    return load_story_cards(stories, viewer=user_object, bodies=True), next_cursor
 
-    # Iterate over each story and fetch the profile object
-    for story in stories:
-        user_story_object = User.objects.get(username=story.user.username)
-        likes = Like.objects.filter(story=story)
-        comments = Comment.objects.filter(story=story)
-        try:
-            user_story_profile = Profile.objects.get(user=user_story_object)
-        except Profile.DoesNotExist:
-            user_story_profile = None
 
-        story_profile_list.append((story, user_story_profile))
+@login_required(login_url='signin')
+def index(request):
+    user_object = User.objects.get(username=request.user.username)
+    user_profile = Profile.objects.get(user=user_object)
+
+    story_profile_list, next_cursor = load_feed_page('index', user_object)
 
     context = {
         'story_profile_list': story_profile_list,
+        'next_cursor': next_cursor,
         'user_profile': user_profile,
         'user_object': user_object
     }
@@ -69,37 +96,11 @@ def discover(request):
     user_object = User.objects.get(username=request.user.username)
     user_profile = Profile.objects.get(user=user_object)
 
-    # Get your posts
-    your_posts = Story.objects.filter(user=user_object)
-
-    # Get the users you are following
-    following_users = Follower.objects.filter(
-        follower=user_object).values_list('user', flat=True)
-
-    # Get the stories of the users you are following
-    following_posts = Story.objects.filter(user__in=following_users)
-
-    # Get all other stories except your posts and the following posts
-    stories = Story.objects.exclude(user=user_object).exclude(
-        user__in=following_users).order_by('-created_at')
-
-    # Create a list to store tuples of story and profile
-    story_profile_list = []
-
-    # Iterate over each story and fetch the profile object
-    for story in stories:
-        user_story_object = User.objects.get(username=story.user.username)
-        likes = Like.objects.filter(story=story)
-        comments = Comment.objects.filter(story=story)
-        try:
-            user_story_profile = Profile.objects.get(user=user_story_object)
-        except Profile.DoesNotExist:
-            user_story_profile = None
-
-        story_profile_list.append((story, user_story_profile))
+    story_profile_list, next_cursor = load_feed_page('discover', user_object)
 
     context = {
         'story_profile_list': story_profile_list,
+        'next_cursor': next_cursor,
         'user_profile': user_profile,
         'user_object': user_object
     }
@@ -114,60 +115,20 @@ def search(request):
 
     # Check if query parameter is provided
     if query:
-        # Search profiles
-        profile_query = Q(
-            Q(user__username__icontains=query) |
-            Q(first_name__icontains=query) |
-            Q(last_name__icontains=query) |
-            Q(bio__icontains=query)
-        )
-        profiles = Profile.objects.filter(profile_query).distinct()
-
-        # Search stories
-        story_query = Q(
-            Q(title__icontains=query) |
-            Q(content__icontains=query) |
-            Q(tags__name__icontains=query) |
-            Q(locations__name__icontains=query) |
-            Q(date_exact__icontains=query) |
-            Q(date_range_start__icontains=query) |
-            Q(date_range_end__icontains=query) |
-            Q(decade__icontains=query) |
-            Q(exact_date_and_time__icontains=query)
-        )
-
-        # Search for stories matching the decade
-        if query.endswith('s') and len(query) == 5 and query[:-1].isdigit():
-            decade = query[:-1]
-            decade_start = datetime.strptime(decade, '%Y')
-            decade_end = datetime.strptime(str(int(decade) + 9), '%Y')
-            story_query |= Q(decade__icontains=decade) | (
-                Q(date_exact__gte=decade_start, date_exact__lt=decade_end) |
-                Q(date_range_start__gte=decade_start, date_range_start__lt=decade_end) |
-                Q(date_range_end__gte=decade_start, date_range_end__lt=decade_end) |
-                Q(exact_date_and_time__gte=decade_start,
-                  exact_date_and_time__lt=decade_end)
-            )
-
-        stories = Story.objects.filter(story_query).distinct()
-        story_profile_list = []
-        for story in stories:
-            user_story_object = User.objects.get(username=story.user.username)
-            try:
-                user_story_profile = Profile.objects.get(
-                    user=user_story_object)
-            except Profile.DoesNotExist:
-                user_story_profile = None
-
-            story_profile_list.append((story, user_story_profile))
+        # Search profiles, most similar first
+        profiles = search_profiles(query)
+
+        story_profile_list, next_cursor = load_feed_page(
+            'search', user_object, query=query)
 
         context = {
             'query': query,
             'profiles': profiles,
-            'stories': stories,
+            'stories': [card.story for card in story_profile_list],
             'user_profile': user_profile,
             'user_object': user_object,
-            'story_profile_list': story_profile_list
+            'story_profile_list': story_profile_list,
+            'next_cursor': next_cursor
         }
     else:
         # Handle case when query parameter is not provided
@@ -177,12 +138,168 @@ def search(request):
             'stories': [],
             'user_profile': user_profile,
             'user_object': user_object,
-            'story_profile_list': []
+            'story_profile_list': [],
+            'next_cursor': None
         }
 
     return render(request, 'search.html', context)
 
 
+@login_required(login_url='signin')
+def feed_page(request, feed):
+    """
+    JSON fragment of the next page of a feed for infinite scroll, with the
+    rendered story cards and the cursor to ask for after them.
+    """
+    if feed not in FEED_CARD_TEMPLATES:
+        raise Http404("Unknown feed")
+
+    user_object = User.objects.get(username=request.user.username)
+    current_profile = Profile.objects.get(user=user_object)
+    username = request.GET.get('username', '')
+
+    story_profile_list, next_cursor = load_feed_page(
+        feed, user_object,
+        cursor=request.GET.get('cursor'),
+        query=request.GET.get('query', ''),
+        username=username)
+
+    # Cards get the same profiles as on the first page of their feed: the
+    # profile cards compare the page owner's profile with the viewer's, the
+    # others only know the viewer's
+    context = {
+        'story_profile_list': story_profile_list,
+        'card_template': FEED_CARD_TEMPLATES[feed],
+        'user_profile': current_profile,
+        'user_object': user_object
+    }
+    if feed == 'profile':
+        context['user_profile'] = Profile.objects.filter(user__username=username).first()
+        context['current_profile'] = current_profile
+    html = render_to_string('partials/feed_page.html', context, request=request)
+    return JsonResponse({'html': html, 'next_cursor': next_cursor})
+
+
+@login_required(login_url='signin')
+def autocomplete_view(request):
+    query = request.GET.get('q', '')
+    kinds = [kind for kind in request.GET.getlist('type') if kind in autocomplete.indexes]
+    try:
+        limit = min(int(request.GET.get('limit', autocomplete.DEFAULT_LIMIT)), 50)
+    except ValueError:
+        limit = autocomplete.DEFAULT_LIMIT
+
+    results = autocomplete.autocomplete(query, kinds=kinds, limit=limit)
+    return JsonResponse({'query': query, 'results': results})
+
+
+@login_required(login_url='signin')
+def spatial_search(request):
+    # Stories in a bounding box, near a point or inside a drawn polygon
+    try:
+        stories = spatial_stories(request.GET)
+    except ValidationError as e:
+        return JsonResponse({'error': e.message}, status=400)
+
+    page, next_cursor = paginate_stories(stories, request.GET.get('cursor'))
+    cards = load_story_cards(page, viewer=request.user)
+    results = []
+    for card in cards:
+        results.append({
+            'id': card.story.id,
+            'title': card.story.title,
+            'username': card.username,
+            'created_at': card.story.created_at.isoformat(),
+            'no_of_likes': card.story.no_of_likes,
+            'no_of_comments': card.story.no_of_comments,
+            'locations': card.locations,
+            'url': f"/postdetailed?story_id={card.story.id}&profile_id={card.profile.id if card.profile else ''}",
+        })
+    return JsonResponse({'stories': results, 'next_cursor': next_cursor})
+
+
+@login_required(login_url='signin')
+def story_geojson(request, story_id):
+    # All of a story's locations as one FeatureCollection at the asked detail
+    detail = request.GET.get('detail', DEFAULT_DETAIL)
+    if detail not in DETAIL_LEVELS:
+        return JsonResponse({'error': f"detail must be one of {', '.join(DETAIL_LEVELS)}"}, status=400)
+    if not Story.objects.filter(id=story_id).exists():
+        return JsonResponse({'error': 'Story not found'}, status=404)
+
+    locations = Location.objects.filter(story=story_id).values('id', 'name', 'radius', 'geojson')
+    features = [
+        {
+            'type': 'Feature',
+            'id': str(location['id']),
+            'geometry': location['geojson'][detail],
+            'properties': {'name': location['name'], 'radius': location['radius']},
+        }
+        for location in locations if location['geojson']
+    ]
+    response = JsonResponse({'type': 'FeatureCollection', 'features': features})
+    response['Cache-Control'] = 'private, max-age=60'
+    return response
+
+
+@login_required(login_url='signin')
+def map_tile(request, z, x, y):
+    # Clustered story locations as a Mapbox Vector Tile
+    if not tiles.is_valid(z, x, y):
+        raise Http404
+    response = HttpResponse(tiles.get_tile(z, x, y), content_type='application/vnd.mapbox-vector-tile')
+    response['Cache-Control'] = 'private, max-age=60'
+    return response
+
+
+@login_required(login_url='signin')
+def heatmap_bins(request):
+    # Story location counts per grid cell for the map's zoom and view
+    try:
+        zoom = int(request.GET.get('zoom', 0))
+        bbox = parse_bbox(request.GET['bbox']).extent if request.GET.get('bbox') else None
+    except ValueError:
+        return JsonResponse({'error': 'zoom must be a whole number.'}, status=400)
+    except ValidationError as e:
+        return JsonResponse({'error': e.message}, status=400)
+    if not 0 <= zoom <= tiles.MAX_ZOOM:
+        return JsonResponse({'error': f'zoom must be between 0 and {tiles.MAX_ZOOM}.'}, status=400)
+
+    response = JsonResponse(heatmap.heatmap(zoom, bbox))
+    response['Cache-Control'] = 'private, max-age=60'
+    return response
+
+
+@login_required(login_url='signin')
+def space_time_cube(request):
+    # Story location counts per grid cell and year or decade, for the map's timeline slider
+    try:
+        bbox = parse_bbox(request.GET.get('bbox', '')).extent
+        start, end = int(request.GET['start']), int(request.GET['end'])
+        zoom = int(request.GET.get('zoom', spacetime.RESOLUTION))
+        data = spacetime.cube(bbox, start, end, request.GET.get('step', 'year'), zoom)
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'start, end and zoom must be whole numbers.'}, status=400)
+    except ValidationError as e:
+        return JsonResponse({'error': e.message}, status=400)
+
+    counts = data.pop('counts')
+    response = JsonResponse({**data, 'shape': list(counts.shape), 'counts': counts.tolist()})
+    response['Cache-Control'] = 'private, max-age=60'
+    return response
+
+
+@login_required(login_url='signin')
+def geocoding_metrics(request):
+    # Background geocoding queue and this process's geocode cache counters
+    if not request.user.is_staff:
+        raise Http404
+    return JsonResponse({
+        'queue': geocode_jobs.metrics(),
+        'cache': geocoding.get_stats(),
+    })
+
+
 @login_required(login_url='signin')
 def postDetailed(request):
     story_id = request.GET.get('story_id')
@@ -194,8 +311,11 @@ def postDetailed(request):
         story = Story.objects.get(id=story_id)
         likes = Like.objects.filter(story=story)
         comments = Comment.objects.filter(story=story)
+        liked = likes.filter(user=user_object).exists()
         profile = Profile.objects.get(id=profile_id) if profile_id else None
-        return render(request, 'postdetailed.html', {'story': story, 'profile': profile, 'user_profile': user_profile, 'likes': likes, 'comments': comments})
+        # Get the closest other stories, rendered once per change around them
+        nearby_stories = nearby_stories_html(story)
+        return render(request, 'postdetailed.html', {'story': story, 'profile': profile, 'user_profile': user_profile, 'likes': likes, 'comments': comments, 'liked': liked, 'nearby_stories': nearby_stories})
     except Story.DoesNotExist:
         return HttpResponse(story_id)
     except Profile.DoesNotExist:
@@ -215,8 +335,9 @@ def profile(request, pk):
         user_profile = None
         # Handle the profile not found case, e.g., display an error message or redirect to a different page
 
-    user_posts = Story.objects.filter(user=user_object).order_by('-created_at')
-    user_posts_length = len(user_posts)
+    user_posts, next_cursor = load_feed_page(
+        'profile', current_user, username=user_object.username)
+    user_posts_length = Story.objects.filter(user=user_object).count()
 
     follower = current_user
     user = user_object
@@ -238,6 +359,7 @@ def profile(request, pk):
         'user_profile': user_profile,
         'user_posts': user_posts,
         'user_posts_length': user_posts_length,
+        'next_cursor': next_cursor,
         'button_text': button_text,
         'user_followers': user_followers,
         'user_followers_count': user_followers_count,
@@ -321,20 +443,7 @@ def like_post(request):
     user_object = User.objects.get(username=request.user.username)
 
     if story_id:
-        story = Story.objects.get(id=story_id)
-        like_filter = Like.objects.filter(
-            story=story, user=user_object).first()
-        if like_filter is None:
-            new_like = Like.objects.create(story=story, user=user_object)
-            new_like.save()
-            story.no_of_likes += 1
-            story.is_liked_by_current_user = True
-            story.save()
-        else:
-            like_filter.delete()
-            story.no_of_likes -= 1
-            story.is_liked_by_current_user = False
-            story.save()
+        toggle_like(user_object, story_id)
 
     # Get the URL of the current page
     current_page = request.META.get('HTTP_REFERER')
@@ -351,12 +460,7 @@ def comment_post(request):
         story_id = request.POST.get('story_id')
         user_object = User.objects.get(username=request.user.username)
         if content and story_id:
-            story = Story.objects.get(id=story_id)
-            comment = Comment.objects.create(
-                user=user_object, content=content, story=story)
-            comment.save()
-            story.no_of_comments += 1
-            story.save()
+            add_comment(user_object, story_id, content)
 
     # Get the URL of the current page
     current_page = request.META.get('HTTP_REFERER')
@@ -366,6 +470,46 @@ def comment_post(request):
         return redirect('/')
 
 
+@login_required(login_url='signin')
+@require_POST
+def like_post_api(request):
+    story_id = request.POST.get('story_id')
+    if not story_id:
+        return JsonResponse({'error': 'story_id is required'}, status=400)
+
+    try:
+        liked, no_of_likes = toggle_like(request.user, story_id)
+    except (Story.DoesNotExist, ValidationError):
+        return JsonResponse({'error': 'Story not found'}, status=404)
+
+    return JsonResponse({'story_id': story_id, 'liked': liked, 'no_of_likes': no_of_likes})
+
+
+@login_required(login_url='signin')
+@require_POST
+def comment_post_api(request):
+    content = request.POST.get('comment')
+    story_id = request.POST.get('story_id')
+    if not content or not story_id:
+        return JsonResponse({'error': 'comment and story_id are required'}, status=400)
+
+    try:
+        comment, no_of_comments = add_comment(request.user, story_id, content)
+    except (Story.DoesNotExist, ValidationError):
+        return JsonResponse({'error': 'Story not found'}, status=404)
+
+    return JsonResponse({
+        'story_id': story_id,
+        'no_of_comments': no_of_comments,
+        'comment': {
+            'id': comment.id,
+            'username': request.user.username,
+            'content': comment.content,
+            'created_at': comment.created_at.isoformat(),
+        },
+    })
+
+
 @login_required(login_url='signin')
 def delete_story(request):
     story_id = request.GET.get('story_id')
@@ -529,154 +673,39 @@ def newPost(request):
         else:
             feature_data = []
 
-        locations = []
-        for feature in feature_data:
-            if feature.get('geometry'):
-                location_type = feature['geometry']['type']
-                coordinates = feature['geometry']['coordinates']
-
-                if location_type == 'Point':
-                    point = Point(coordinates)
-                    results = reverse_geocode_nominatim(point.y, point.x)
-                    location_name = results
-                    
-                    radius = feature.get('properties', {}).get('radius')
-                    if radius:
-                        location = Location(
-                            name="Circle Area in " + str(location_name), point=point)
-                        location.radius = float(radius)
-                    else:
-                        location = Location(name=str(location_name), point=point)
-
-                elif location_type == 'Polygon':
-                    polygon = Polygon(coordinates[0])
-                    centroid = polygon.centroid
-                    results =  reverse_geocode_nominatim(centroid.y, centroid.x)
-                    location_name = results
-                    
-                    location = Location(
-                        name="Area Around "+str(location_name), area=polygon)
-
-                elif location_type == 'LineString':
-                    linestring = LineString(coordinates)
-                    midpoint = linestring.interpolate(linestring.length/2)
-                    results = reverse_geocode_nominatim(midpoint.y, midpoint.x)
-                    location_name = results
-                    location = Location(
-                        name="Lines Around "+str(location_name), lines=linestring)
-
-                if location:
-                    locations.append(location)
-
         # date
-        date_format = DATE_FORMAT_MAPPING[date_option]
+        date_format = DATE_FORMAT_MAPPING.get(date_option)
+        dates = {
+            'date_exact': None,
+            'date_range_start': None,
+            'date_range_end': None,
+            'decade': None,
+            'exact_date_and_time': None
+        }
         if date_format == 1:
-            date_exact = request.POST.get('exact_date', None)
-            date_range_start = None
-            date_range_end = None
-            decade = None
-            exact_date_and_time = None
+            dates['date_exact'] = request.POST.get('exact_date', None)
         elif date_format == 2:
-            date_exact = None
-            date_range_start = request.POST.get('start_date', None)
-            date_range_end = request.POST.get('end_date', None)
-            decade = None
-            exact_date_and_time = None
-
+            dates['date_range_start'] = request.POST.get('start_date', None)
+            dates['date_range_end'] = request.POST.get('end_date', None)
         elif date_format == 3:
-            date_exact = None
-            date_range_start = None
-            date_range_end = None
-            decade = request.POST.get('decade', None)
-            exact_date_and_time = None
+            dates['decade'] = request.POST.get('decade', None)
         elif date_format == 4:
-            date_exact = None
-            date_range_start = None
-            date_range_end = None
-            decade = None
-            exact_date_and_time = request.POST.get('exact_date_and_time', None)
-
-        # Validation checks
-        if not content:
-            messages.error(request, 'Content is required.')
-            return redirect('newpost')
-
-        if not title:
-            messages.error(request, 'Title is required.')
-            return redirect('newpost')
-
-        if not locations:
-            messages.error(request, 'At least one location is required.')
-            return redirect('newpost')
-
-        if date_format == 1:
-            if not date_exact:
-                messages.error(request, 'Exact date is required.')
-                return redirect('newpost')
-
-        elif date_format == 2:
-            if not date_range_start or not date_range_end:
-                messages.error(
-                    request, 'Start date and end date are required.')
-                return redirect('newpost')
+            dates['exact_date_and_time'] = request.POST.get('exact_date_and_time', None)
 
-        elif date_format == 3:
-            if not decade:
-                messages.error(request, 'Decade is required.')
-                return redirect('newpost')
-        elif date_format == 4:
-            if not exact_date_and_time:
-                messages.error(request, 'Exact date and time is required.')
-                return redirect('newpost')
-        else:
-            messages.error(request, 'Invalid date option.')
+        # Validation checks, before anything is geocoded or saved
+        try:
+            validate_story(title, content, feature_data, date_format, dates)
+        except ValidationError as e:
+            messages.error(request, e.message)
             return redirect('newpost')
 
         # tags
-        tag_objs = []
-        for tag in tags_list:
-            tag_name = tag.get('value', None)
-            if tag_name:
-                tag_obj = Tag(name=tag_name)
-                tag_objs.append(tag_obj)
-
-        # file_objs
-        file_objs = []
-        for file in files:
-            file_obj = File(file=file)
-            file_objs.append(file_obj)
-
-
-
-        # Save all the Location objects to the database
-        for location in locations:
-            location.save()
-
-        # Save all the Tag objects to the database
-        for tag in tag_objs:
-            tag.save()
-
-        # Save all the File objects to the database
-        for file in file_objs:
-            file.save()
-
-        story = Story(
-            user=user,
-            title=title,
-            content=content,
-            date_format=date_format,
-            date_exact=date_exact,
-            date_range_start=date_range_start,
-            date_range_end=date_range_end,
-            decade=decade,
-            exact_date_and_time=exact_date_and_time
-        )
-
-        # Save the story object to the database
-        story.save()
-        story.locations.set(locations)
-        story.tags.set(tag_objs)
-        story.files.set(file_objs)
+        tag_names = [tag.get('value', None) for tag in tags_list]
+
+        # Save the story with its locations, tags and files in one transaction,
+        # the geocode worker names the locations afterwards
+        create_story(user, title, content, date_format, dates,
+                     feature_data, tag_names, files)
         return redirect('index')
 
     context = {
@@ -53,6 +53,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.gis',
+    'django.contrib.postgres',
     'core',
     'leaflet',
     'ckeditor'
@@ -105,6 +106,22 @@ DATABASES = {
 }
 
 
+# Caches: 'default' is local to each process, 'shared' is seen by every
+# process and management command, for invalidations that have to reach them
+# all. The shared one lives in the database, its table is made by
+# manage.py createcachetable
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'core_shared_cache',
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -152,3 +169,85 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 
 GDAL_LIBRARY_PATH = "/usr/lib/libgdal.so.20"
+
+# Home timeline: authors with more followers than this are merged into feeds
+# at read time instead of being fanned out to every follower on write
+TIMELINE_FANOUT_FOLLOWER_LIMIT = int(os.getenv('TIMELINE_FANOUT_FOLLOWER_LIMIT', 1000))
+
+# Like and comment counters: None writes every change straight to the story
+# row, 'cache' buffers them in ENGAGEMENT_COUNTER_CACHE, which has to be a
+# Redis or Memcached cache shared by all processes, and 'local' in the
+# process, for a single development server only. Buffered deltas are written
+# to the database every ENGAGEMENT_COUNTER_FLUSH_INTERVAL seconds by
+# manage.py flush_counters, which runs alongside the web processes
+ENGAGEMENT_COUNTER_BUFFER = os.getenv('ENGAGEMENT_COUNTER_BUFFER') or None
+ENGAGEMENT_COUNTER_CACHE = 'default'
+ENGAGEMENT_COUNTER_FLUSH_INTERVAL = 5
+
+# Text search configuration of the story search documents
+STORY_SEARCH_CONFIG = 'simple'
+
+# People search: result limit and minimum trigram similarity
+PROFILE_SEARCH_LIMIT = 20
+PROFILE_SEARCH_THRESHOLD = 0.3
+
+# Search box and tag field suggestions
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_REBUILD_INTERVAL = 600
+AUTOCOMPLETE_CHECK_INTERVAL = 30
+AUTOCOMPLETE_CACHE = 'shared'
+
+# Reverse geocoding cache: grid cell size in degrees, days before a cached
+# name is looked up again and cells kept in each process
+GEOCODE_CACHE_GRID_SIZE = 0.001
+GEOCODE_CACHE_TTL_DAYS = 30
+GEOCODE_CACHE_LRU_SIZE = 10000
+NOMINATIM_USER_AGENT = os.getenv('NOMINATIM_USER_AGENT', 'my_app')
+
+# Reverse geocoder: 'nominatim' looks names up online, 'gazetteer' finds the
+# nearest place of a local CSV gazetteer within the maximum distance and
+# asks the fallback backend when there is none
+GEOCODER_BACKEND = os.getenv('GEOCODER_BACKEND', 'nominatim')
+GEOCODER_FALLBACK = os.getenv('GEOCODER_FALLBACK', 'nominatim')
+GEOCODER_GAZETTEER_PATH = os.getenv('GEOCODER_GAZETTEER_PATH', os.path.join(BASE_DIR, 'data', 'gazetteer.csv'))
+GEOCODER_GAZETTEER_MAX_DISTANCE_KM = 25
+
+# Background geocoding of new locations (manage.py geocode_locations):
+# concurrent lookups, lookups started per second and attempts before giving up
+GEOCODE_WORKER_CONCURRENCY = 4
+GEOCODE_RATE_LIMIT = 1.0
+GEOCODE_MAX_ATTEMPTS = 5
+
+# Story map vector tiles: disk cache, seconds a cached tile is served for,
+# deepest zoom, cluster size in pixels and the zoom clustering stops at
+TILE_CACHE_DIR = os.path.join(BASE_DIR, 'tile_cache')
+TILE_CACHE_TTL = 24 * 60 * 60
+TILE_MAX_ZOOM = 20
+TILE_CLUSTER_PIXELS = 64
+TILE_CLUSTER_MAX_ZOOM = 16
+
+# Canonical places: a new point, circle or line within this many meters of
+# an existing one, or an area overlapping an existing area by this share of
+# their union, is linked to the existing location instead of a new row
+PLACE_SNAP_DISTANCE = 25
+PLACE_OVERLAP_THRESHOLD = 0.9
+
+# Nearby stories panel of the story page: stories listed, cache alias and
+# seconds a rendered panel is kept
+NEARBY_STORIES_LIMIT = 5
+NEARBY_STORIES_CACHE = 'shared'
+NEARBY_STORIES_CACHE_TTL = 60 * 60
+
+# Location heatmap: zoom levels of the grids locations are counted in, and
+# how many levels finer than the map the bins it is drawn with are
+HEATMAP_RESOLUTIONS = (2, 4, 6, 8, 10, 12, 14)
+HEATMAP_BIN_ZOOM_OFFSET = 3
+
+# Map timeline space-time cube: zoom level of the grid it is counted in and
+# most cells one request may return
+SPACE_TIME_RESOLUTION = 8
+SPACE_TIME_MAX_CELLS = 1000000
+
+# Story card bodies: cache alias and seconds a rendered body is kept
+STORY_CARD_CACHE = 'default'
+STORY_CARD_CACHE_TTL = 24 * 60 * 60
@@ -0,0 +1,35 @@
+// Suggests tags, usernames and place names under the navbar search box
+(function () {
+    document.querySelectorAll('input[name="query"]').forEach(function (input, index) {
+        var list = document.createElement('datalist');
+        list.id = 'search-suggestions-' + index;
+        input.setAttribute('list', list.id);
+        input.setAttribute('autocomplete', 'off');
+        input.after(list);
+
+        var timer = null;
+        input.addEventListener('input', function () {
+            clearTimeout(timer);
+            var query = input.value.trim();
+            if (!query) {
+                list.innerHTML = '';
+                return;
+            }
+            timer = setTimeout(function () {
+                fetch('/autocomplete?q=' + encodeURIComponent(query), { credentials: 'same-origin' })
+                    .then(function (response) {
+                        return response.json();
+                    })
+                    .then(function (data) {
+                        list.innerHTML = '';
+                        data.results.forEach(function (result) {
+                            var option = document.createElement('option');
+                            option.value = result.name;
+                            option.label = result.type === 'users' ? 'user' : result.type === 'tags' ? 'tag' : 'place';
+                            list.appendChild(option);
+                        });
+                    });
+            }, 100);
+        });
+    });
+})();
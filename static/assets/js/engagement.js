@@ -0,0 +1,65 @@
+// Likes and comments through the JSON endpoints so the page is updated in
+// place instead of being reloaded. The plain links and forms keep working
+// as a fallback when this script is not loaded.
+(function () {
+    function getCookie(name) {
+        var match = document.cookie.match('(^|;)\\s*' + name + '=([^;]*)');
+        return match ? decodeURIComponent(match[2]) : null;
+    }
+
+    function post(url, data) {
+        return fetch(url, {
+            method: 'POST',
+            credentials: 'same-origin',
+            headers: { 'X-CSRFToken': getCookie('csrftoken') },
+            body: data
+        }).then(function (response) {
+            if (!response.ok) {
+                throw new Error(response.statusText);
+            }
+            return response.json();
+        });
+    }
+
+    function setCount(attribute, storyId, text) {
+        document.querySelectorAll('[' + attribute + '="' + storyId + '"]').forEach(function (element) {
+            element.textContent = text;
+        });
+    }
+
+    document.addEventListener('click', function (event) {
+        var link = event.target.closest('[data-like-story]');
+        if (!link) {
+            return;
+        }
+        event.preventDefault();
+
+        var storyId = link.dataset.likeStory;
+        var data = new FormData();
+        data.append('story_id', storyId);
+        post('/api/like-post', data).then(function (result) {
+            document.querySelectorAll('[data-like-story="' + storyId + '"] > div').forEach(function (icon) {
+                icon.classList.toggle('text-red-500', result.liked);
+            });
+            setCount('data-like-count', storyId, result.no_of_likes + ' likes');
+        }).catch(function () {
+            window.location.href = link.href;
+        });
+    });
+
+    document.addEventListener('submit', function (event) {
+        var form = event.target.closest('[data-comment-story]');
+        if (!form) {
+            return;
+        }
+        event.preventDefault();
+
+        var storyId = form.dataset.commentStory;
+        post('/api/comment-post', new FormData(form)).then(function (result) {
+            form.reset();
+            setCount('data-comment-count', storyId, result.no_of_comments + ' comments');
+        }).catch(function () {
+            form.submit();
+        });
+    });
+})();
@@ -0,0 +1,44 @@
+// Loads the next page of story cards when the end of a feed scrolls into view.
+// Feeds mark their end with <div class="feed-more" data-next-url="...">.
+(function () {
+    function loadMore(sentinel, observer) {
+        var url = sentinel.dataset.nextUrl;
+        if (!url || sentinel.dataset.loading) {
+            return;
+        }
+        sentinel.dataset.loading = 'true';
+
+        fetch(url, { credentials: 'same-origin' })
+            .then(function (response) {
+                return response.json();
+            })
+            .then(function (data) {
+                sentinel.insertAdjacentHTML('beforebegin', data.html);
+                if (data.next_cursor) {
+                    var next = new URL(url, window.location.href);
+                    next.searchParams.set('cursor', data.next_cursor);
+                    sentinel.dataset.nextUrl = next.toString();
+                    delete sentinel.dataset.loading;
+                } else {
+                    observer.unobserve(sentinel);
+                    sentinel.remove();
+                }
+            })
+            .catch(function () {
+                delete sentinel.dataset.loading;
+            });
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        document.querySelectorAll('.feed-more').forEach(function (sentinel) {
+            var observer = new IntersectionObserver(function (entries) {
+                entries.forEach(function (entry) {
+                    if (entry.isIntersecting) {
+                        loadMore(sentinel, observer);
+                    }
+                });
+            }, { rootMargin: '600px' });
+            observer.observe(sentinel);
+        });
+    });
+})();
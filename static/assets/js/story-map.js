@@ -0,0 +1,64 @@
+// Draws a story's locations from its GeoJSON endpoint, loading finer shapes as the map zooms in
+(function () {
+    var container = document.getElementById('map');
+    if (!container || !container.dataset.geojsonUrl) {
+        return;
+    }
+
+    var map = L.map(container).setView([0, 0], 2);
+    L.tileLayer('https://api.maptiler.com/maps/streets-v2/{z}/{x}/{y}.png?key=ObmhcyIVPHpLuSAuaCKz', {
+        attribution: '<a href="https://www.maptiler.com/copyright/" target="_blank">&copy; MapTiler</a> <a href="https://www.openstreetmap.org/copyright" target="_blank">&copy; OpenStreetMap contributors</a>',
+        maxZoom: 18
+    }).addTo(map);
+
+    var layer = null;
+    var detail = null;
+
+    function detailFor(zoom) {
+        if (zoom >= 14) {
+            return 'high';
+        }
+        return zoom >= 9 ? 'medium' : 'low';
+    }
+
+    function load(level, fit) {
+        if (level === detail) {
+            return;
+        }
+        detail = level;
+        fetch(container.dataset.geojsonUrl + '?detail=' + level, { credentials: 'same-origin' })
+            .then(function (response) {
+                return response.json();
+            })
+            .then(function (data) {
+                if (level !== detail) {
+                    return;
+                }
+                var next = L.geoJSON(data, {
+                    pointToLayer: function (feature, latlng) {
+                        if (feature.properties.radius) {
+                            return L.circle(latlng, { radius: feature.properties.radius });
+                        }
+                        return L.marker(latlng);
+                    },
+                    onEachFeature: function (feature, featureLayer) {
+                        featureLayer.bindPopup(feature.properties.name);
+                    }
+                }).addTo(map);
+                if (layer) {
+                    map.removeLayer(layer);
+                }
+                layer = next;
+
+                if (fit && data.features.length) {
+                    map.fitBounds(layer.getBounds(), { maxZoom: 12, animate: false });
+                    // Only zooming by the reader loads another level
+                    map.on('zoomend', function () {
+                        load(detailFor(map.getZoom()), false);
+                    });
+                }
+            });
+    }
+
+    load('medium', true);
+})();